@@ -45,6 +45,17 @@
 from __future__ import absolute_import
 
 import ast
+import hashlib
+import importlib.util
+import json
+import os
+import re
+
+# Timestamps SageMaker appends to generated job names, which change every time a definition is rendered.
+JOB_NAME_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}-\d{1,3}")
+FINGERPRINT_PREFIX = "fingerprint="
+# Number of the most recent executions of a pipeline searched for a fingerprint.
+MAX_FINGERPRINT_EXECUTIONS = 50
 
 
 def get_pipeline_driver(module_name, passed_args=None):
@@ -89,3 +100,173 @@ def get_pipeline_custom_tags(module_name, args, tags):
     except Exception as e:
         print(f"Error getting project tags: {e}")
     return tags
+
+
+def hash_directory(path):
+    """Hashes the relative paths and contents of the files under a directory
+
+    Args:
+        path (str): directory to hash, compiled Python files are ignored
+
+    Returns:
+        hex digest of the directory content
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if name.endswith(".pyc"):
+                continue
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode())
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def list_s3_etags(s3_client, s3_uri):
+    """Lists the ETags of the objects of an S3 URI, which is either an object or a prefix
+
+    Returns:
+        list of (key, ETag) tuples
+    """
+    bucket, _, key = s3_uri[len("s3://") :].partition("/")
+    etags = []
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=key):
+        for obj in page.get("Contents", []):
+            if obj["Key"] == key or obj["Key"].startswith(key.rstrip("/") + "/"):
+                etags.append((obj["Key"], obj["ETag"]))
+    return etags
+
+
+def resolve_parameters(definition, parameters=None):
+    """Returns the values of the parameters of a pipeline definition, their defaults overridden by parameters"""
+    values = {p["Name"]: p.get("DefaultValue") for p in definition.get("Parameters", [])}
+    values.update(parameters or {})
+    return values
+
+
+def list_input_etags(s3_client, values):
+    """Lists the ETags of the input data, the objects under the S3 URIs among pipeline parameter values
+
+    Returns:
+        dict of the (key, ETag) tuples of every parameter whose value is an S3 URI
+    """
+    return {
+        name: list_s3_etags(s3_client, value)
+        for name, value in values.items()
+        if isinstance(value, str) and value.startswith("s3://")
+    }
+
+
+def list_definition_inputs(definition):
+    """Lists the S3 URIs of the input data of the steps given as strings in a pipeline definition
+
+    The ML_PIPELINES_CACHE_KEY of the steps reading them covers their ETags when the definition is
+    rendered, so a definition rendered before is outdated once they change.
+
+    Returns:
+        sorted list of the S3 URIs of the processing, training and transform inputs
+    """
+    uris = set()
+    for step in definition.get("Steps", []):
+        arguments = step.get("Arguments", {})
+        sources = [i.get("S3Input", {}).get("S3Uri") for i in arguments.get("ProcessingInputs", [])]
+        sources += [
+            c.get("DataSource", {}).get("S3DataSource", {}).get("S3Uri") for c in arguments.get("InputDataConfig", [])
+        ]
+        sources.append(arguments.get("TransformInput", {}).get("DataSource", {}).get("S3DataSource", {}).get("S3Uri"))
+        uris.update(uri for uri in sources if isinstance(uri, str) and uri.startswith("s3://"))
+    return sorted(uris)
+
+
+def get_pipeline_fingerprint(definition, source_dir, s3_client, parameters=None):
+    """Computes a fingerprint of everything a pipeline execution depends on
+
+    The fingerprint covers the pipeline definition, with job name timestamps removed, the content of
+    source_dir and the ETags of the input data, that is the objects under the S3 URIs given as values
+    of the pipeline parameters.
+
+    Args:
+        definition (dict): the parsed pipeline definition
+        source_dir (str): directory of the scripts run by the pipeline steps
+        s3_client: boto3 S3 client used to list the input data
+        parameters (dict, optional): pipeline parameter values overriding their defaults
+
+    Returns:
+        hex digest of the pipeline inputs
+    """
+    values = resolve_parameters(definition, parameters)
+    input_etags = list_input_etags(s3_client, values)
+    fingerprint = {
+        "definition": JOB_NAME_TIMESTAMP.sub("", json.dumps(definition, sort_keys=True)),
+        "parameters": values,
+        "source_scripts": hash_directory(source_dir) if os.path.isdir(source_dir) else None,
+        "input_etags": input_etags,
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def find_execution_with_fingerprint(
+    sagemaker_client, pipeline_name, fingerprint, max_executions=MAX_FINGERPRINT_EXECUTIONS
+):
+    """Finds the most recent successful execution of a pipeline started with a fingerprint
+
+    Executions record their fingerprint in their description, see get_pipeline_fingerprint. They are
+    listed newest first, and the listing stops at the first match or after max_executions, so that the
+    lookup does not page through the whole history of pipelines which ran many times.
+
+    Returns:
+        the summary of the execution, None if there is none or the pipeline does not exist yet
+    """
+    from botocore.exceptions import ClientError  # pylint: disable=C0415
+
+    paginator = sagemaker_client.get_paginator("list_pipeline_executions")
+    try:
+        for page in paginator.paginate(
+            PipelineName=pipeline_name,
+            SortBy="CreationTime",
+            SortOrder="Descending",
+            PaginationConfig={"MaxItems": max_executions, "PageSize": min(max_executions, 100)},
+        ):
+            for summary in page["PipelineExecutionSummaries"]:
+                if (
+                    summary["PipelineExecutionStatus"] == "Succeeded"
+                    and summary.get("PipelineExecutionDescription") == f"{FINGERPRINT_PREFIX}{fingerprint}"
+                ):
+                    return summary
+    except ClientError as e:
+        # the pipeline is created by the first run
+        if e.response["Error"]["Code"] not in ("ResourceNotFound", "ValidationException"):
+            raise
+    return None
+
+
+def get_definition_cache_key(module_name, passed_args=None, source_dir="source_scripts"):
+    """Computes the cache key of a pipeline definition, without importing the pipeline module
+
+    The key covers the module name, its keyword arguments, the content of the package holding the module
+    and the content of source_dir. It also covers the image URIs cached by ImageUriResolver, so that a new
+    image version renders the definition again once that cache is refreshed. The ETags of the input data
+    the ML_PIPELINES_CACHE_KEY of the steps cover are only known once rendered, see list_definition_inputs.
+
+    Args:
+        module_name (str): The module name of your pipeline.
+        passed_args (str, optional): Optional passed arguments that your pipeline may be templated by.
+        source_dir (str, optional): directory of the scripts run by the pipeline steps
+
+    Returns:
+        hex digest of the pipeline definition inputs
+    """
+    package = importlib.util.find_spec(module_name.split(".")[0])
+    digest = hashlib.sha256()
+    digest.update(module_name.encode())
+    digest.update(repr(sorted(convert_struct(passed_args).items())).encode())
+    digest.update(hash_directory(os.path.dirname(package.origin)).encode())
+    if os.path.isdir(source_dir):
+        digest.update(hash_directory(source_dir).encode())
+    from ml_pipelines.image_uris import list_cached_image_uris  # pylint: disable=C0415
+
+    digest.update(json.dumps(list_cached_image_uris(), sort_keys=True).encode())
+    return digest.hexdigest()
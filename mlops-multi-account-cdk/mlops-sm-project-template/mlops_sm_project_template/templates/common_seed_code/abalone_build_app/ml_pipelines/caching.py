@@ -0,0 +1,220 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Step caching keyed on the data, code and hyperparameters the steps depend on."""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from ml_pipelines._utils import hash_directory, list_input_etags, list_s3_etags, resolve_parameters
+
+# Environment variable of the processing and training jobs holding their cache key, which makes the
+# step arguments, and so the SageMaker step cache, change with the key.
+CACHE_KEY_ENV = "ML_PIPELINES_CACHE_KEY"
+# ISO 8601 duration after which the cached results of a step are not reused anymore.
+DEFAULT_EXPIRE_AFTER = "P30D"
+# Pipeline parameter holding a digest of the ETags of the input data an execution is started with,
+# which the cache keys of the steps reading parameterised inputs depend on, see with_input_etags.
+INPUT_ETAGS_PARAMETER = "InputDataETags"
+# Metadata of the steps which run a job and can be cached, see ListPipelineExecutionSteps.
+CACHEABLE_JOBS = ("ProcessingJob", "TrainingJob", "TransformJob", "TuningJob")
+
+
+def get_cache_config(expire_after=DEFAULT_EXPIRE_AFTER):
+    """Gets the cache configuration of the pipeline steps.
+
+    Args:
+        expire_after: ISO 8601 duration the results of a step are reused for, caching is disabled if empty
+
+    Returns:
+        a CacheConfig, or None if caching is disabled
+    """
+    if not expire_after:
+        return None
+    from sagemaker.workflow.steps import CacheConfig  # pylint: disable=C0415
+
+    return CacheConfig(enable_caching=True, expire_after=expire_after)
+
+
+def get_input_etags_parameter():
+    """Gets the pipeline parameter set to the digest of the ETags of the input data of an execution.
+
+    Pipelines whose steps read parameterised inputs declare it, see compute_cache_key.
+    """
+    from sagemaker.workflow.parameters import ParameterString  # pylint: disable=C0415
+
+    return ParameterString(name=INPUT_ETAGS_PARAMETER, default_value="")
+
+
+def with_input_etags(s3_client, definition, parameters=None):
+    """Sets the INPUT_ETAGS_PARAMETER of the parameters an execution is started with.
+
+    The digest covers the ETags of the objects under the S3 URIs among the parameter values, defaults
+    included, so that the steps are cached on the data the parameters resolve to at execution time.
+
+    Args:
+        s3_client: boto3 S3 client used to list the input data
+        definition: the parsed pipeline definition
+        parameters: pipeline parameter values overriding their defaults
+
+    Returns:
+        a copy of parameters, with the digest if the pipeline declares the parameter and it is not set
+    """
+    parameters = dict(parameters or {})
+    declared = any(p["Name"] == INPUT_ETAGS_PARAMETER for p in definition.get("Parameters", []))
+    if declared and INPUT_ETAGS_PARAMETER not in parameters:
+        values = resolve_parameters(definition, parameters)
+        values.pop(INPUT_ETAGS_PARAMETER, None)
+        input_etags = list_input_etags(s3_client, values)
+        parameters[INPUT_ETAGS_PARAMETER] = hashlib.sha256(json.dumps(input_etags, sort_keys=True).encode()).hexdigest()
+    return parameters
+
+
+def _expression(value):
+    """Serializes the pipeline variables of hyperparameters to the expression they are rendered as."""
+    return value.expr if hasattr(value, "expr") else str(value)
+
+
+def compute_cache_key(s3_client=None, source_dir=None, inputs=(), hyperparameters=None):
+    """Computes the cache key of a step.
+
+    SageMaker reuses the results of a cached step as long as its arguments do not change, which
+    misses new data uploaded under the same S3 URIs. The key covers the ETags of the input data,
+    the code of the step and its hyperparameters or job arguments, and is passed to the job in the
+    CACHE_KEY_ENV environment variable so that it is part of the step arguments.
+
+    The ETags of the S3 URIs given as strings are listed when the pipeline is rendered. Pipeline
+    parameters may be overridden when an execution is started, so the ETags of the data they resolve
+    to are only known then: the key is joined with the INPUT_ETAGS_PARAMETER, which run-pipeline sets,
+    see with_input_etags.
+
+    Args:
+        s3_client: boto3 S3 client used to list the input data
+        source_dir: directory of the code run by the step
+        inputs: S3 URIs of the input data, strings or pipeline parameters, other pipeline variables are
+            ignored as they change with the steps they refer to
+        hyperparameters: hyperparameters or job arguments of the step, pipeline variables included
+
+    Returns:
+        hex digest of the step inputs, joined with the INPUT_ETAGS_PARAMETER for parameterised inputs
+    """
+    input_etags = {}
+    parameterised = False
+    for uri in inputs:
+        if isinstance(uri, str) and uri.startswith("s3://"):
+            input_etags[uri] = list_s3_etags(s3_client, uri)
+        elif hasattr(uri, "default_value"):
+            parameterised = True
+    key = {
+        "source_dir": hash_directory(source_dir) if source_dir else None,
+        "input_etags": input_etags,
+        "hyperparameters": hyperparameters,
+    }
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True, default=_expression).encode()).hexdigest()
+    if not parameterised:
+        return digest
+    from sagemaker.workflow.functions import Join  # pylint: disable=C0415
+
+    return Join(on="-", values=[digest, get_input_etags_parameter()])
+
+
+def get_output_destination(base_uri, output_name, cache_key, variables=()):
+    """Gets the S3 destination of an output of a cached step.
+
+    SageMaker only reuses the results of a step whose arguments, output destinations included, are
+    the same as those of the cached execution, which the default destinations under the execution ID
+    never are. The destination is made of the cache key and of the pipeline variables the output
+    depends on, such as parameters and the name of the job which produced its input, so that it is
+    the same whenever the step can be reused, and differs when the step runs again with other inputs,
+    which would otherwise overwrite the outputs of earlier executions.
+
+    Args:
+        base_uri: S3 URI under which the output is written, e.g. of the step
+        output_name: name of the output, the last part of the destination
+        cache_key: cache key of the step, see compute_cache_key
+        variables: pipeline variables the output depends on which the cache key does not cover
+
+    Returns:
+        a Join of the S3 URI
+    """
+    from sagemaker.workflow.functions import Join  # pylint: disable=C0415
+
+    key_values = cache_key.values if isinstance(cache_key, Join) else [cache_key]
+    return Join(on="/", values=[base_uri.rstrip("/"), *key_values, *variables, output_name])
+
+
+def stage_source_dir(source_dir, file_names):
+    """Copies the files of a step out of a source directory shared with other steps.
+
+    The code uploaded for a step, and so its arguments and cache, then only change with its own
+    files rather than with every file of the source directory. The SageMaker SDK hashes the path of
+    the code as well, so the files are copied to a directory named after their content.
+
+    Args:
+        source_dir: directory of the code of several steps
+        file_names: paths of the files of the step, relative to source_dir
+
+    Returns:
+        path of a directory holding only the files of the step
+    """
+    digest = hashlib.sha256()
+    for name in sorted(file_names):
+        digest.update(name.encode())
+        with open(os.path.join(source_dir, name), "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    parent = os.path.join(tempfile.gettempdir(), "ml_pipelines", "step_sources")
+    staging_dir = os.path.join(parent, digest.hexdigest())
+    if os.path.isdir(staging_dir):
+        return staging_dir
+
+    os.makedirs(parent, exist_ok=True)
+    # copied to a temporary directory first, so that concurrent renders never see a partial copy
+    partial_dir = tempfile.mkdtemp(dir=parent)
+    for name in file_names:
+        target = os.path.join(partial_dir, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(os.path.join(source_dir, name), target)
+    try:
+        os.rename(partial_dir, staging_dir)
+    except OSError:
+        # staged by a concurrent render in the meantime
+        shutil.rmtree(partial_dir)
+    return staging_dir
+
+
+def count_cache_hits(steps):
+    """Counts the steps of a pipeline execution reused from the cache and the ones which ran a job.
+
+    Args:
+        steps: the steps of the execution, as returned by ListPipelineExecutionSteps
+
+    Returns:
+        tuple of the number of cache hits and cache misses
+    """
+    hits = misses = 0
+    for step in steps:
+        if step.get("CacheHitResult"):
+            hits += 1
+        elif step["StepStatus"] in ("Succeeded", "Failed") and any(
+            job in step.get("Metadata", {}) for job in CACHEABLE_JOBS
+        ):
+            misses += 1
+    return hits, misses
@@ -19,25 +19,259 @@
 from __future__ import absolute_import
 
 import argparse
+import concurrent.futures
+import contextlib
+import io
 import json
 import sys
 
-from ml_pipelines._utils import get_pipeline_driver, convert_struct, get_pipeline_custom_tags
+from ml_pipelines._utils import (
+    FINGERPRINT_PREFIX,
+    convert_struct,
+    find_execution_with_fingerprint,
+    get_pipeline_custom_tags,
+    get_pipeline_driver,
+    get_pipeline_fingerprint,
+)
+
+DEFAULT_MAX_WORKERS = 4
+
+# Options of a pipeline which default to the command line arguments of the same name.
+SPEC_OPTIONS = ("kwargs", "pipeline_inputs", "role_arn", "description", "tags")
+
+
+def load_pipeline_specs(module_names=None, manifest=None, **defaults):
+    """Lists the pipelines to create or update and run.
+
+    Args:
+        module_names: module names of pipelines which all take the default options
+        manifest: path of a JSON list of pipelines, objects with a module_name and any of the options
+        defaults: default value of every option, see SPEC_OPTIONS
+
+    Returns:
+        list of dict with the module_name and the options of every pipeline, options passed as strings
+    """
+    entries = [{"module_name": module_name} for module_name in module_names or []]
+    if manifest:
+        with open(manifest) as f:
+            entries.extend(json.load(f))
+
+    specs = []
+    for entry in entries:
+        spec = {"module_name": entry["module_name"]}
+        for option in SPEC_OPTIONS:
+            value = entry.get(option, defaults.get(option))
+            # structures of the manifest are passed on like the dict strings of the command line
+            spec[option] = repr(value) if isinstance(value, (dict, list)) else value
+        specs.append(spec)
+    return specs
+
+
+def upsert_and_start(spec, source_dir="source_scripts", force=False):
+    """Creates or updates a pipeline and starts an execution of it.
+
+    The execution is skipped if a previous successful execution already ran the same definition,
+    source scripts and input data.
+
+    Args:
+        spec: the pipeline, see load_pipeline_specs
+        source_dir: directory of the scripts run by the pipeline steps
+        force: start an execution even if a previous one succeeded with the same fingerprint
+
+    Returns:
+        dict with the pipeline name, region, fingerprint, status (Started or Skipped) and execution ARN
+    """
+    from ml_pipelines.caching import with_input_etags  # pylint: disable=C0415
+    from ml_pipelines.sessions import get_client  # pylint: disable=C0415
+
+    pipeline = get_pipeline_driver(spec["module_name"], spec["kwargs"])
+    print("###### Creating/updating a SageMaker Pipeline with the following definition:")
+    parsed = json.loads(pipeline.definition())
+    print(json.dumps(parsed, indent=2, sort_keys=True))
+
+    region = pipeline.sagemaker_session.boto_region_name
+    # the cache keys of the steps cover the data the parameters resolve to for this execution
+    pipeline_inputs_dict = with_input_etags(get_client("s3", region), parsed, convert_struct(spec["pipeline_inputs"]))
+    fingerprint = get_pipeline_fingerprint(
+        parsed, source_dir, get_client("s3", region), parameters=pipeline_inputs_dict
+    )
+    print(f"\n###### Execution fingerprint: {fingerprint}")
+    result = {"pipeline_name": pipeline.name, "region": region, "fingerprint": fingerprint}
+    previous = None
+    if not force:
+        previous = find_execution_with_fingerprint(get_client("sagemaker", region), pipeline.name, fingerprint)
+    if previous is not None:
+        print(f"Nothing changed since execution {previous['PipelineExecutionArn']}, skipping the run.")
+        return dict(result, status="Skipped", execution_arn=previous["PipelineExecutionArn"])
+
+    all_tags = get_pipeline_custom_tags(spec["module_name"], spec["kwargs"], convert_struct(spec["tags"]))
+
+    upsert_response = pipeline.upsert(role_arn=spec["role_arn"], description=spec["description"], tags=all_tags)
+
+    upsert_response = pipeline.upsert(
+        role_arn=spec["role_arn"], description=spec["description"]
+    )  # , tags=tags) # Removing tag momentaneously
+    print("\n###### Created/Updated SageMaker Pipeline: Response received:")
+    print(upsert_response)
+
+    execution = pipeline.start(
+        parameters=pipeline_inputs_dict, execution_description=f"{FINGERPRINT_PREFIX}{fingerprint}"
+    )
+    print(f"\n###### Execution started with PipelineExecutionArn: {execution.arn}")
+    return dict(result, status="Started", execution_arn=execution.arn)
+
+
+def _upsert_and_start_quietly(spec, source_dir, force):
+    """Runs upsert_and_start in a worker process, returning its output rather than interleaving it."""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            result = upsert_and_start(spec, source_dir, force)
+        except Exception as e:  # pylint: disable=W0703
+            print(f"Exception: {e}")
+            result = {"status": "Failed", "error": str(e)}
+    return dict(result, module_name=spec["module_name"]), output.getvalue()
+
+
+def upsert_and_start_all(specs, source_dir="source_scripts", force=False, max_workers=DEFAULT_MAX_WORKERS):
+    """Creates or updates and starts several pipelines concurrently.
+
+    Every pipeline is rendered, created or updated and started in its own process, at most
+    max_workers at a time, and its output is printed in one block once it is started. A single
+    pipeline runs in the current process.
+
+    Returns:
+        list of the results of upsert_and_start, in the order of specs, with a Failed status and the
+        error for the pipelines which could not be started
+    """
+    if len(specs) == 1:
+        try:
+            result = upsert_and_start(specs[0], source_dir, force)
+        except Exception as e:  # pylint: disable=W0703
+            print(f"Exception: {e}")
+            result = {"status": "Failed", "error": str(e)}
+        return [dict(result, module_name=specs[0]["module_name"])]
+
+    results = [None] * len(specs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(max_workers, len(specs))) as pool:
+        futures = {pool.submit(_upsert_and_start_quietly, spec, source_dir, force): i for i, spec in enumerate(specs)}
+        for future in concurrent.futures.as_completed(futures):
+            result, output = future.result()
+            print(f"\n############ {result['module_name']}\n{output}", end="")
+            results[futures[future]] = result
+    return results
+
+
+def wait_for_results(results):
+    """Waits for the executions started by upsert_and_start_all, updating their status in results.
+
+    Executions are monitored concurrently, per region, until they all succeed or one of them fails.
+    The executions which are still running when one fails keep the Started status. The number of
+    steps reused from the cache and run again is added to the results as cache_hits and cache_misses.
+
+    Returns:
+        dict of the step statuses of every succeeded execution, by execution ARN
+    """
+    # imported on demand, boto3 and asyncio take most of the startup time
+    from ml_pipelines.caching import count_cache_hits  # pylint: disable=C0415
+    from ml_pipelines.monitor_pipeline import (  # pylint: disable=C0415
+        PipelineExecutionFailed,
+        list_execution_steps,
+        wait_for_executions,
+    )
+    from ml_pipelines.sessions import get_client  # pylint: disable=C0415
+
+    started = {}
+    for result in results:
+        if result["status"] == "Started":
+            started.setdefault(result["region"], {})[result["execution_arn"]] = result
+
+    step_statuses = {}
+    for region, region_results in started.items():
+        sagemaker_client = get_client("sagemaker", region)
+        failed = False
+        try:
+            step_statuses.update(wait_for_executions(sagemaker_client, list(region_results)))
+            for result in region_results.values():
+                result["status"] = "Succeeded"
+        except PipelineExecutionFailed as e:
+            region_results[e.execution_arn].update(status="Failed", error=str(e))
+            failed = True
+        for execution_arn, result in region_results.items():
+            steps = list_execution_steps(sagemaker_client, execution_arn)
+            result["cache_hits"], result["cache_misses"] = count_cache_hits(steps)
+        if failed:
+            break
+    return step_statuses
+
+
+def export_results_telemetry(results, output_dir=None, emf_namespace=None):
+    """Prints and optionally writes the step telemetry of the executions which completed, see telemetry.
+
+    Args:
+        results: results of upsert_and_start_all, after wait_for_results
+        output_dir: local directory or S3 URI prefix the JSON and CSV files are written to, if any
+        emf_namespace: CloudWatch namespace of the embedded metric format documents printed, if any
+    """
+    from ml_pipelines.sessions import get_client  # pylint: disable=C0415
+    from ml_pipelines.telemetry import export_telemetry  # pylint: disable=C0415
+
+    for result in results:
+        # executions still running when another one failed keep the Started status
+        if result["status"] in ("Succeeded", "Failed") and result.get("execution_arn"):
+            region = result["region"]
+            s3_client = get_client("s3", region) if output_dir else None
+            export_telemetry(
+                get_client("sagemaker", region), [result["execution_arn"]], output_dir, s3_client, emf_namespace
+            )
+
+
+def format_summary(results):
+    """Formats the results of upsert_and_start_all as a table, one line per pipeline."""
+    rows = [("MODULE", "PIPELINE", "STATUS", "CACHE HITS", "EXECUTION")]
+    for result in results:
+        detail = result.get("error") if result["status"] == "Failed" else None
+        cache = "-"
+        if "cache_hits" in result:
+            cache = f"{result['cache_hits']}/{result['cache_hits'] + result['cache_misses']}"
+        rows.append(
+            (
+                result["module_name"],
+                result.get("pipeline_name", "-"),
+                result["status"],
+                cache,
+                detail or result.get("execution_arn", "-"),
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(4)]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths + [0])).rstrip() for row in rows)
 
 
 def main():  # pragma: no cover
-    """The main harness that creates or updates and runs the pipeline.
+    """The main harness that creates or updates and runs the pipelines.
 
-    Creates or updates the pipeline and runs it.
+    Creates or updates the pipelines and runs them, unless a previous successful execution already ran
+    the same definition, source scripts and input data. Several pipelines are rendered and started
+    concurrently and monitored together, and a summary of all of them is printed at the end.
     """
-    parser = argparse.ArgumentParser("Creates or updates and runs the pipeline for the pipeline script.")
+    parser = argparse.ArgumentParser("Creates or updates and runs the pipelines for the pipeline scripts.")
 
     parser.add_argument(
         "-n",
         "--module-name",
-        dest="module_name",
+        dest="module_names",
         type=str,
-        help="The module name of the pipeline to import.",
+        nargs="+",
+        help="The module names of the pipelines to import, which all get the same arguments.",
+    )
+    parser.add_argument(
+        "-manifest",
+        "--manifest",
+        dest="manifest",
+        type=str,
+        default=None,
+        help="""JSON file of '[{"module_name": "string", "kwargs": {..}, "pipeline_inputs": {..}}, ..]', """
+        "the other arguments are the defaults of its pipelines.",
     )
     parser.add_argument(
         "-kwargs",
@@ -46,6 +280,13 @@ def main():  # pragma: no cover
         default=None,
         help="Dict string of keyword arguments for the pipeline generation (if supported)",
     )
+    parser.add_argument(
+        "-pipeline-inputs",
+        "--pipeline-inputs",
+        dest="pipeline_inputs",
+        default=None,
+        help="Dict string of keyword arguments for the pipeline execution (if supported)",
+    )
     parser.add_argument(
         "-role-arn",
         "--role-arn",
@@ -68,40 +309,88 @@ def main():  # pragma: no cover
         default=None,
         help="""List of dict strings of '[{"Key": "string", "Value": "string"}, ..]'""",
     )
+    parser.add_argument(
+        "-source-dir",
+        "--source-dir",
+        dest="source_dir",
+        type=str,
+        default="source_scripts",
+        help="Directory of the scripts run by the pipeline steps, part of the execution fingerprint.",
+    )
+    parser.add_argument(
+        "-force",
+        "--force",
+        dest="force",
+        action="store_true",
+        help="Start an execution even if a previous one succeeded with the same fingerprint.",
+    )
+    parser.add_argument(
+        "-detach",
+        "--detach",
+        dest="detach",
+        action="store_true",
+        help="Return as soon as the execution is started instead of waiting for it to complete.",
+    )
+    parser.add_argument(
+        "-telemetry-dir",
+        "--telemetry-dir",
+        dest="telemetry_dir",
+        type=str,
+        default=None,
+        help="Local directory or S3 URI the JSON and CSV step telemetry of every execution is written to.",
+    )
+    parser.add_argument(
+        "-emf-namespace",
+        "--emf-namespace",
+        dest="emf_namespace",
+        type=str,
+        default=None,
+        help="Print the step metrics in the CloudWatch embedded metric format, in this namespace.",
+    )
+    parser.add_argument(
+        "-max-workers",
+        "--max-workers",
+        dest="max_workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="The maximum number of pipelines rendered and started at the same time.",
+    )
     args = parser.parse_args()
 
-    if args.module_name is None or args.role_arn is None:
+    try:
+        specs = load_pipeline_specs(
+            args.module_names,
+            args.manifest,
+            **{option: getattr(args, option) for option in SPEC_OPTIONS},
+        )
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Invalid manifest {args.manifest}: {e}")
+        sys.exit(2)
+    if not specs or any(spec["role_arn"] is None for spec in specs):
         parser.print_help()
         sys.exit(2)
-    tags = convert_struct(args.tags)
-
-    try:
-        pipeline = get_pipeline_driver(args.module_name, args.kwargs)
-        print("###### Creating/updating a SageMaker Pipeline with the following definition:")
-        parsed = json.loads(pipeline.definition())
-        print(json.dumps(parsed, indent=2, sort_keys=True))
-
-        all_tags = get_pipeline_custom_tags(args.module_name, args.kwargs, tags)
-
-        upsert_response = pipeline.upsert(role_arn=args.role_arn, description=args.description, tags=all_tags)
-
-        upsert_response = pipeline.upsert(
-            role_arn=args.role_arn, description=args.description
-        )  # , tags=tags) # Removing tag momentaneously
-        print("\n###### Created/Updated SageMaker Pipeline: Response received:")
-        print(upsert_response)
 
-        execution = pipeline.start()
-        print(f"\n###### Execution started with PipelineExecutionArn: {execution.arn}")
+    results = upsert_and_start_all(specs, args.source_dir, args.force, args.max_workers)
 
-        #         TODO removiong wait time as training can take some time
-        print("Waiting for the execution to finish...")
-        execution.wait()
-        print("\n#####Execution completed. Execution step details:")
+    started = [result["execution_arn"] for result in results if result["status"] == "Started"]
+    if started and args.detach:
+        print(f"Detached, run `monitor-pipeline --execution-arns {' '.join(started)}` to follow the executions.")
+    elif started:
+        print("Waiting for the executions to finish...")
+        try:
+            wait_for_results(results)
+        except Exception as e:  # pylint: disable=W0703
+            print(f"Exception: {e}")
+            sys.exit(1)
+        try:
+            export_results_telemetry(results, args.telemetry_dir, args.emf_namespace)
+        except Exception as e:  # pylint: disable=W0703
+            # the telemetry does not change the outcome of the executions
+            print(f"Could not export the step telemetry: {e}")
 
-        print(execution.list_steps())
-    except Exception as e:  # pylint: disable=W0703
-        print(f"Exception: {e}")
+    print("\n###### Summary")
+    print(format_summary(results))
+    if any(result["status"] == "Failed" for result in results):
         sys.exit(1)
 
 
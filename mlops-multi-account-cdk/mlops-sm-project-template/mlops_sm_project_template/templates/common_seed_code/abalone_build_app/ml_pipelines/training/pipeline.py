@@ -27,7 +27,6 @@ Implements a get_pipeline(**kwargs) method.
 """
 import os
 
-import boto3
 import logging
 import sagemaker
 import sagemaker.session
@@ -49,6 +48,7 @@ from sagemaker.workflow.condition_step import (
     ConditionStep,
 )
 from sagemaker.workflow.functions import (
+    Join,
     JsonGet,
 )
 from sagemaker.workflow.parameters import (
@@ -56,6 +56,7 @@ from sagemaker.workflow.parameters import (
     ParameterString,
 )
 from sagemaker.workflow.pipeline import Pipeline
+from sagemaker.workflow.pipeline_context import PipelineSession
 from sagemaker.workflow.properties import PropertyFile
 from sagemaker.workflow.steps import (
     ProcessingStep,
@@ -66,6 +67,16 @@ from sagemaker.workflow.step_collections import RegisterModel
 from botocore.exceptions import ClientError
 from sagemaker.network import NetworkConfig
 
+from ml_pipelines.caching import (
+    CACHE_KEY_ENV,
+    compute_cache_key,
+    get_cache_config,
+    get_input_etags_parameter,
+    get_output_destination,
+)
+from ml_pipelines.image_uris import ImageUriResolver
+from ml_pipelines.sessions import get_boto_session, get_client
+
 
 # BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -73,24 +84,25 @@ logger = logging.getLogger(__name__)
 
 
 def get_session(region, default_bucket):
-    """Gets the sagemaker session based on the region.
+    """Gets the pipeline session based on the region.
+
+    The steps are built from the step arguments of the processors and estimators of a PipelineSession,
+    which uploads their code under a hash of its content rather than of the time it is rendered at.
 
     Args:
         region: the aws region to start the session
         default_bucket: the bucket to use for storing the artifacts
 
     Returns:
-        `sagemaker.session.Session instance
+        PipelineSession instance
     """
 
-    boto_session = boto3.Session(region_name=region)
+    boto_session = get_boto_session(region)
 
-    sagemaker_client = boto_session.client("sagemaker")
-    runtime_client = boto_session.client("sagemaker-runtime")
-    session = sagemaker.session.Session(
+    sagemaker_client = get_client("sagemaker", region)
+    session = PipelineSession(
         boto_session=boto_session,
         sagemaker_client=sagemaker_client,
-        sagemaker_runtime_client=runtime_client,
         default_bucket=default_bucket,
     )
 
@@ -106,6 +118,11 @@ def get_pipeline(
     pipeline_name="AbalonePipeline",
     base_job_prefix="Abalone",
     project_id="SageMakerProjectId",
+    sharded_preprocessing=False,
+    split_key=None,
+    inplace_predict=False,
+    gate_on_mse_upper_bound=False,
+    cache_expire_after="",
 ):
     """Gets a SageMaker ML Pipeline instance working with on abalone data.
 
@@ -113,6 +130,18 @@ def get_pipeline(
         region: AWS region to create and run the pipeline.
         role: IAM role to create and run steps and pipeline.
         default_bucket: the bucket to use for storing the artifacts
+        sharded_preprocessing: shard the objects under InputDataUrl across the
+            ProcessingInstanceCount preprocessing instances
+        split_key: comma-separated columns hashed to assign rows to the train, validation
+            and test splits, the whole row content is hashed if not set
+        inplace_predict: evaluate with xgboost's multithreaded inplace_predict, which needs
+            a training image with xgboost 1.1 or later
+        gate_on_mse_upper_bound: register the model only if the upper bound of the bootstrap
+            confidence interval of the MSE, rather than its point estimate, is within the threshold
+        cache_expire_after: ISO 8601 duration the results of the processing and training steps are
+            reused for by later executions with the same input data, code and hyperparameters,
+            caching is disabled if empty, the default: the steps reading InputDataUrl are keyed on the
+            InputDataETags parameter, which only run-pipeline sets, see compute_cache_key
 
     Returns:
         an instance of a pipeline
@@ -125,6 +154,14 @@ def get_pipeline(
     # parameters for pipeline execution
     processing_instance_count = ParameterInteger(name="ProcessingInstanceCount", default_value=1)
     processing_instance_type = ParameterString(name="ProcessingInstanceType", default_value="ml.m5.xlarge")
+    # rows per chunk for the streaming preprocessing mode, 0 keeps the whole dataset in memory
+    preprocessing_chunk_size = ParameterInteger(name="PreprocessingChunkSize", default_value=0)
+    # format of the train/validation/test splits, Parquet avoids formatting and parsing floats as text
+    split_content_type = ParameterString(
+        name="SplitContentType",
+        default_value="text/csv",
+        enum_values=["text/csv", "application/x-parquet"],
+    )
     training_instance_type = ParameterString(name="TrainingInstanceType", default_value="ml.m5.xlarge")
     inference_instance_type = ParameterString(name="InferenceInstanceType", default_value="ml.m5.xlarge")
     model_approval_status = ParameterString(name="ModelApprovalStatus", default_value="PendingManualApproval")
@@ -135,6 +172,17 @@ def get_pipeline(
     processing_image_name = "sagemaker-{0}-processingimagebuild".format(project_id)
     training_image_name = "sagemaker-{0}-trainingimagebuild".format(project_id)
     inference_image_name = "sagemaker-{0}-inferenceimagebuild".format(project_id)
+    # the built-in XGBoost image is used for the images not built for the project
+    image_uris = ImageUriResolver(sagemaker_session.sagemaker_client, region, project_id).resolve(
+        [processing_image_name, training_image_name, inference_image_name],
+        default=sagemaker.image_uris.retrieve(
+            framework="xgboost",
+            region=region,
+            version="1.0-1",
+            py_version="py3",
+            instance_type="ml.m5.xlarge",
+        ),
+    )
 
     # network_config = NetworkConfig(
     #     enable_network_isolation=True,
@@ -143,19 +191,32 @@ def get_pipeline(
     #     encrypt_inter_container_traffic=True,
     # )
 
+    # the steps are cached if enabled, keyed on the ETags of their input data, their code and hyperparameters
+    cache_config = get_cache_config(cache_expire_after)
+    s3_client = get_client("s3", region)
+
     # processing step for feature engineering
-    try:
-        processing_image_uri = sagemaker_session.sagemaker_client.describe_image_version(
-            ImageName=processing_image_name
-        )["ContainerImage"]
-    except (sagemaker_session.sagemaker_client.exceptions.ResourceNotFound):
-        processing_image_uri = sagemaker.image_uris.retrieve(
-            framework="xgboost",
-            region=region,
-            version="1.0-1",
-            py_version="py3",
-            instance_type="ml.m5.xlarge",
+    # the outputs of the cached steps are written under their cache key, see get_output_destination
+    outputs_uri = f"s3://{sagemaker_session.default_bucket()}/{base_job_prefix}"
+    split_arguments = ["--split-key", split_key] if split_key else []
+    preprocessing_key = compute_cache_key(
+        s3_client,
+        "source_scripts/preprocessing/prepare_abalone_data",
+        inputs=[input_data],
+        hyperparameters={"split_arguments": split_arguments, "sharded_preprocessing": sharded_preprocessing},
+    )
+
+    def preprocessing_output(step_name, output_name, variables):
+        destination = None
+        if cache_config:
+            destination = get_output_destination(
+                f"{outputs_uri}/{step_name}", output_name, preprocessing_key, variables
+            )
+        return ProcessingOutput(
+            output_name=output_name, source=f"/opt/ml/processing/{output_name}", destination=destination
         )
+
+    processing_image_uri = image_uris[processing_image_name]
     script_processor = ScriptProcessor(
         image_uri=processing_image_uri,
         instance_type=processing_instance_type,
@@ -165,35 +226,104 @@ def get_pipeline(
         sagemaker_session=sagemaker_session,
         role=role,
         output_kms_key=bucket_kms_id,
+        env={CACHE_KEY_ENV: preprocessing_key} if cache_config else None,
     )
-    step_process = ProcessingStep(
-        name="PreprocessAbaloneData",
-        processor=script_processor,
-        outputs=[
-            ProcessingOutput(output_name="train", source="/opt/ml/processing/train"),
-            ProcessingOutput(output_name="validation", source="/opt/ml/processing/validation"),
-            ProcessingOutput(output_name="test", source="/opt/ml/processing/test"),
-        ],
-        code="source_scripts/preprocessing/prepare_abalone_data/main.py",  # we must figure out this path to get it from step_source directory
-        job_arguments=["--input-data", input_data],
-    )
+    preprocessing_variables = [processing_instance_count, preprocessing_chunk_size, split_content_type]
+    preprocessing_outputs = [
+        preprocessing_output("PreprocessAbaloneData", output_name, preprocessing_variables)
+        for output_name in ("train", "validation", "test", "preprocessor")
+    ]
+    if sharded_preprocessing:
+        # Every instance receives its own subset of the input objects. A first job writes the partial
+        # statistics of each shard, a second one merges them into the same fitted transformer on every
+        # instance and writes the splits of each shard.
+        sharded_input = ProcessingInput(
+            source=input_data,
+            destination="/opt/ml/processing/input/data",
+            s3_data_distribution_type="ShardedByS3Key",
+        )
+        step_statistics = ProcessingStep(
+            name="ComputeAbaloneStatistics",
+            step_args=script_processor.run(
+                inputs=[sharded_input],
+                outputs=[
+                    preprocessing_output(
+                        "ComputeAbaloneStatistics",
+                        "statistics",
+                        [processing_instance_count, preprocessing_chunk_size],
+                    ),
+                ],
+                code="source_scripts/preprocessing/prepare_abalone_data/main.py",
+                arguments=[
+                    "--input-dir",
+                    "/opt/ml/processing/input/data",
+                    "--statistics-only",
+                    "--chunk-size",
+                    preprocessing_chunk_size.to_string(),
+                ],
+            ),
+            cache_config=cache_config,
+        )
+        step_process = ProcessingStep(
+            name="PreprocessAbaloneData",
+            step_args=script_processor.run(
+                inputs=[
+                    sharded_input,
+                    ProcessingInput(
+                        source=step_statistics.properties.ProcessingOutputConfig.Outputs["statistics"].S3Output.S3Uri,
+                        destination="/opt/ml/processing/statistics",
+                    ),
+                ],
+                outputs=preprocessing_outputs,
+                code="source_scripts/preprocessing/prepare_abalone_data/main.py",
+                arguments=[
+                    "--input-dir",
+                    "/opt/ml/processing/input/data",
+                    "--chunk-size",
+                    preprocessing_chunk_size.to_string(),
+                    "--content-type",
+                    split_content_type,
+                ]
+                + split_arguments,
+            ),
+            cache_config=cache_config,
+        )
+        preprocessing_steps = [step_statistics, step_process]
+    else:
+        step_process = ProcessingStep(
+            name="PreprocessAbaloneData",
+            step_args=script_processor.run(
+                outputs=preprocessing_outputs,
+                code="source_scripts/preprocessing/prepare_abalone_data/main.py",
+                arguments=[
+                    "--input-data",
+                    input_data,
+                    "--chunk-size",
+                    preprocessing_chunk_size.to_string(),
+                    "--content-type",
+                    split_content_type,
+                ]
+                + split_arguments,
+            ),
+            cache_config=cache_config,
+        )
+        preprocessing_steps = [step_process]
 
     # training step for generating model artifacts
     model_path = f"s3://{default_bucket}/{base_job_prefix}/AbaloneTrain"
 
-    try:
-        training_image_uri = sagemaker_session.sagemaker_client.describe_image_version(ImageName=training_image_name)[
-            "ContainerImage"
-        ]
-    except (sagemaker_session.sagemaker_client.exceptions.ResourceNotFound):
-        training_image_uri = sagemaker.image_uris.retrieve(
-            framework="xgboost",
-            region=region,
-            version="1.0-1",
-            py_version="py3",
-            instance_type="ml.m5.xlarge",
-        )
+    training_image_uri = image_uris[training_image_name]
 
+    hyperparameters = dict(
+        objective="reg:linear",
+        num_round=50,
+        max_depth=5,
+        eta=0.2,
+        gamma=4,
+        min_child_weight=6,
+        subsample=0.7,
+        silent=0,
+    )
     xgb_train = Estimator(
         image_uri=training_image_uri,
         instance_type=training_instance_type,
@@ -203,33 +333,30 @@ def get_pipeline(
         sagemaker_session=sagemaker_session,
         role=role,
         output_kms_key=bucket_kms_id,
+        environment={CACHE_KEY_ENV: compute_cache_key(hyperparameters=hyperparameters)} if cache_config else None,
     )
-    xgb_train.set_hyperparameters(
-        objective="reg:linear",
-        num_round=50,
-        max_depth=5,
-        eta=0.2,
-        gamma=4,
-        min_child_weight=6,
-        subsample=0.7,
-        silent=0,
-    )
+    xgb_train.set_hyperparameters(**hyperparameters)
     step_train = TrainingStep(
         name="TrainAbaloneModel",
-        estimator=xgb_train,
-        inputs={
-            "train": TrainingInput(
-                s3_data=step_process.properties.ProcessingOutputConfig.Outputs["train"].S3Output.S3Uri,
-                content_type="text/csv",
-            ),
-            "validation": TrainingInput(
-                s3_data=step_process.properties.ProcessingOutputConfig.Outputs["validation"].S3Output.S3Uri,
-                content_type="text/csv",
-            ),
-        },
+        step_args=xgb_train.fit(
+            inputs={
+                "train": TrainingInput(
+                    s3_data=step_process.properties.ProcessingOutputConfig.Outputs["train"].S3Output.S3Uri,
+                    content_type=split_content_type,
+                ),
+                "validation": TrainingInput(
+                    s3_data=step_process.properties.ProcessingOutputConfig.Outputs["validation"].S3Output.S3Uri,
+                    content_type=split_content_type,
+                ),
+            }
+        ),
+        cache_config=cache_config,
     )
 
     # processing step for evaluation
+    evaluation_key = compute_cache_key(
+        s3_client, "source_scripts/evaluate/evaluate_xgboost", hyperparameters={"inplace_predict": inplace_predict}
+    )
     script_eval = ScriptProcessor(
         image_uri=training_image_uri,
         command=["python3"],
@@ -239,7 +366,29 @@ def get_pipeline(
         sagemaker_session=sagemaker_session,
         role=role,
         output_kms_key=bucket_kms_id,
+        env={CACHE_KEY_ENV: evaluation_key} if cache_config else None,
     )
+    # the outputs depend on the model, which the name of the training job, reused when it is a cache hit,
+    # identifies, and on the test split, under the destination of the preprocessing step
+    evaluation_variables = [step_train.properties.TrainingJobName, split_content_type]
+    evaluation_outputs = [
+        ProcessingOutput(
+            output_name=output_name,
+            source=source,
+            destination=(
+                get_output_destination(
+                    f"{outputs_uri}/EvaluateAbaloneModel", output_name, evaluation_key, evaluation_variables
+                )
+                if cache_config
+                else None
+            ),
+        )
+        for output_name, source in (
+            ("evaluation", "/opt/ml/processing/evaluation"),
+            # the trained model packaged with the fitted preprocessor, for batch inference to reuse it
+            ("model", "/opt/ml/processing/packaged_model"),
+        )
+    ]
     evaluation_report = PropertyFile(
         name="AbaloneEvaluationReport",
         output_name="evaluation",
@@ -247,51 +396,52 @@ def get_pipeline(
     )
     step_eval = ProcessingStep(
         name="EvaluateAbaloneModel",
-        processor=script_eval,
-        inputs=[
-            ProcessingInput(
-                source=step_train.properties.ModelArtifacts.S3ModelArtifacts,
-                destination="/opt/ml/processing/model",
-            ),
-            ProcessingInput(
-                source=step_process.properties.ProcessingOutputConfig.Outputs["test"].S3Output.S3Uri,
-                destination="/opt/ml/processing/test",
-            ),
-        ],
-        outputs=[
-            ProcessingOutput(output_name="evaluation", source="/opt/ml/processing/evaluation"),
-        ],
-        code="source_scripts/evaluate/evaluate_xgboost/main.py",
+        step_args=script_eval.run(
+            inputs=[
+                ProcessingInput(
+                    source=step_train.properties.ModelArtifacts.S3ModelArtifacts,
+                    destination="/opt/ml/processing/model",
+                ),
+                ProcessingInput(
+                    source=step_process.properties.ProcessingOutputConfig.Outputs["test"].S3Output.S3Uri,
+                    destination="/opt/ml/processing/test",
+                ),
+                ProcessingInput(
+                    source=step_process.properties.ProcessingOutputConfig.Outputs["preprocessor"].S3Output.S3Uri,
+                    destination="/opt/ml/processing/preprocessor",
+                ),
+            ],
+            outputs=evaluation_outputs,
+            code="source_scripts/evaluate/evaluate_xgboost/main.py",
+            arguments=["--content-type", split_content_type] + (["--inplace-predict"] if inplace_predict else []),
+        ),
         property_files=[evaluation_report],
+        cache_config=cache_config,
     )
 
     # register model step that will be conditionally executed
     model_metrics = ModelMetrics(
         model_statistics=MetricsSource(
-            s3_uri="{}/evaluation.json".format(
-                step_eval.arguments["ProcessingOutputConfig"]["Outputs"][0]["S3Output"]["S3Uri"]
+            s3_uri=Join(
+                on="/",
+                values=[
+                    step_eval.properties.ProcessingOutputConfig.Outputs["evaluation"].S3Output.S3Uri,
+                    "evaluation.json",
+                ],
             ),
             content_type="application/json",
         )
     )
 
-    try:
-        inference_image_uri = sagemaker_session.sagemaker_client.describe_image_version(ImageName=inference_image_name)[
-            "ContainerImage"
-        ]
-    except (sagemaker_session.sagemaker_client.exceptions.ResourceNotFound):
-        inference_image_uri = sagemaker.image_uris.retrieve(
-            framework="xgboost",
-            region=region,
-            version="1.0-1",
-            py_version="py3",
-            instance_type="ml.m5.xlarge",
-        )
+    inference_image_uri = image_uris[inference_image_name]
     step_register = RegisterModel(
         name="RegisterAbaloneModel",
         estimator=xgb_train,
         image_uri=inference_image_uri,
-        model_data=step_train.properties.ModelArtifacts.S3ModelArtifacts,
+        model_data=Join(
+            on="/",
+            values=[step_eval.properties.ProcessingOutputConfig.Outputs["model"].S3Output.S3Uri, "model.tar.gz"],
+        ),
         content_types=["text/csv"],
         response_types=["text/csv"],
         inference_instances=["ml.t2.medium", "ml.m5.large"],
@@ -302,10 +452,11 @@ def get_pipeline(
     )
 
     # condition step for evaluating model quality and branching execution
+    mse_json_path = "regression_metrics.mse.value"
+    if gate_on_mse_upper_bound:
+        mse_json_path = "regression_metrics.mse.confidence_interval.upper"
     cond_lte = ConditionLessThanOrEqualTo(
-        left=JsonGet(
-            step_name=step_eval.name, property_file=evaluation_report, json_path="regression_metrics.mse.value"
-        ),
+        left=JsonGet(step_name=step_eval.name, property_file=evaluation_report, json_path=mse_json_path),
         right=6.0,
     )
     step_cond = ConditionStep(
@@ -321,11 +472,15 @@ def get_pipeline(
         parameters=[
             processing_instance_type,
             processing_instance_count,
+            preprocessing_chunk_size,
+            split_content_type,
             training_instance_type,
             model_approval_status,
             input_data,
+            # set by run-pipeline, see compute_cache_key
+            get_input_etags_parameter(),
         ],
-        steps=[step_process, step_train, step_eval, step_cond],
+        steps=preprocessing_steps + [step_train, step_eval, step_cond],
         sagemaker_session=sagemaker_session,
     )
     return pipeline
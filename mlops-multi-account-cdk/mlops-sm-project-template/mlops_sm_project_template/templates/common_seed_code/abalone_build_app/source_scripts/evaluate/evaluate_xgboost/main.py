@@ -15,9 +15,11 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-"""Evaluation script for measuring mean squared error."""
+"""Evaluation script for measuring regression metrics on the test split in a single streaming pass."""
+import argparse
 import json
 import logging
+import os
 import pathlib
 import pickle
 import tarfile
@@ -26,15 +28,305 @@ import numpy as np
 import pandas as pd
 import xgboost
 
-from sklearn.metrics import mean_squared_error
-
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
+# Supported content types of the test split and their file extension.
+CONTENT_TYPE_EXTENSIONS = {
+    "text/csv": "csv",
+    "application/x-parquet": "parquet",
+}
+
+# Upper bound on the number of residuals kept to estimate the residual quantiles. Below this
+# many test rows the quantiles are exact.
+RESIDUAL_SAMPLE_SIZE = 100000
+
+# Residual quantiles written to the evaluation report.
+RESIDUAL_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+# Upper bound on the number of entries of the bootstrap index matrix drawn at a time.
+BOOTSTRAP_BATCH_SIZE = 5000000
+
+# Location of the fitted preprocessor inside model.tar.gz, kept in sync with PREPROCESSOR_PATH in the
+# preprocessing script.
+PREPROCESSOR_PATH = "preprocessor/preprocessor.pkl"
+
+
+def iter_test_data(test_dir, content_type="text/csv", chunk_size=100000):
+    """Reads every file of the test split in chunks, with the label in the first column.
+
+    Args:
+        test_dir: local directory holding the test split
+        content_type: content type the split was written with
+        chunk_size: number of rows held in memory at a time
+
+    Yields:
+        DataFrames of at most chunk_size rows
+    """
+    paths = sorted(pathlib.Path(test_dir).glob(f"*.{CONTENT_TYPE_EXTENSIONS[content_type]}"))
+    for path in paths:
+        if content_type == "application/x-parquet":
+            import pyarrow.parquet as pq
+
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(path, header=None, chunksize=chunk_size)
+
+
+def finite_or_none(value):
+    """Returns value as a float, or None for the NaN and infinite values of undefined metrics, which JSON cannot hold."""
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+class StreamingRegressionMetrics:
+    """Accumulates regression metrics one chunk of labels and predictions at a time.
+
+    Means and sums of squared deviations are combined with Chan's parallel update, which is
+    numerically stable. Residual quantiles come from a bounded uniform sample of the residuals.
+
+    Bootstrap confidence intervals resample every chunk with replacement. For each resample it
+    keeps the sums the metrics are derived from (row count, squared and absolute errors, shifted
+    label and squared shifted label), drawn for a batch of resamples at once from a matrix of row
+    indices.
+    """
+
+    def __init__(self, sample_size=RESIDUAL_SAMPLE_SIZE, n_resamples=0, seed=0):
+        self.sample_size = sample_size
+        self.n_resamples = n_resamples
+        self.count = 0
+        self.label_mean = 0.0
+        self.label_m2 = 0.0
+        self.residual_mean = 0.0
+        self.residual_m2 = 0.0
+        self.squared_error_mean = 0.0
+        self.absolute_error_mean = 0.0
+        self.residual_sample = np.empty(0)
+        self.residual_priorities = np.empty(0)
+        self.bootstrap_sums = np.zeros((n_resamples, 5))
+        self.label_shift = None
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, y_true, y_pred):
+        """Folds one chunk of labels and predictions into the metrics.
+
+        Args:
+            y_true: numpy array of labels
+            y_pred: numpy array of predictions
+        """
+        y_true = np.asarray(y_true, dtype=np.float64)
+        residuals = y_true - np.asarray(y_pred, dtype=np.float64)
+        count = len(y_true)
+        if count == 0:
+            return
+        total = self.count + count
+        weight = count / total
+
+        self.label_mean, self.label_m2 = self._combine(self.label_mean, self.label_m2, y_true, weight)
+        self.residual_mean, self.residual_m2 = self._combine(self.residual_mean, self.residual_m2, residuals, weight)
+        self.squared_error_mean += (np.mean(residuals**2) - self.squared_error_mean) * weight
+        self.absolute_error_mean += (np.mean(np.abs(residuals)) - self.absolute_error_mean) * weight
+        self.count = total
+
+        values = np.concatenate((self.residual_sample, residuals))
+        priorities = np.concatenate((self.residual_priorities, self._rng.random(count)))
+        if len(values) > self.sample_size:
+            keep = np.argpartition(priorities, self.sample_size)[: self.sample_size]
+            values, priorities = values[keep], priorities[keep]
+        self.residual_sample = values
+        self.residual_priorities = priorities
+
+        if self.n_resamples:
+            self._bootstrap(y_true, residuals)
+
+    def _bootstrap(self, y_true, residuals):
+        # Shifting the labels by the mean of the first chunk keeps the R2 denominator accurate.
+        if self.label_shift is None:
+            self.label_shift = np.mean(y_true)
+        shifted = y_true - self.label_shift
+        terms = np.column_stack((np.ones_like(shifted), residuals**2, np.abs(residuals), shifted, shifted**2))
+        count = len(terms)
+        batch = max(1, BOOTSTRAP_BATCH_SIZE // count)
+        for start in range(0, self.n_resamples, batch):
+            size = min(batch, self.n_resamples - start)
+            indices = self._rng.integers(0, count, size=(size, count))
+            indices += np.arange(size)[:, None] * count
+            counts = np.bincount(indices.ravel(), minlength=size * count).reshape(size, count)
+            self.bootstrap_sums[start : start + size] += counts @ terms
+
+    def confidence_intervals(self, level=0.95):
+        """Returns the bootstrap percentile intervals of the metrics.
+
+        Args:
+            level: confidence level of the intervals
+
+        Returns:
+            dict mapping mse, rmse, mae and r2 to their lower and upper bounds
+        """
+        weight, squared_error, absolute_error, label, label_squared = self.bootstrap_sums.T
+        mse = squared_error / weight
+        # R2 is infinite on the resamples of constant labels, and so are its bounds
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r2 = 1.0 - squared_error / (label_squared - label**2 / weight)
+            resampled = {"mse": mse, "rmse": np.sqrt(mse), "mae": absolute_error / weight, "r2": r2}
+            percentiles = [50 * (1 - level), 50 * (1 + level)]
+            return {metric: np.percentile(values, percentiles) for metric, values in resampled.items()}
+
+    def _combine(self, mean, m2, values, weight):
+        chunk_mean = np.mean(values)
+        delta = chunk_mean - mean
+        chunk_m2 = np.sum((values - chunk_mean) ** 2)
+        return mean + delta * weight, m2 + chunk_m2 + delta**2 * self.count * weight
+
+    def report(self, confidence_level=0.95):
+        """Returns the metrics in the evaluation report format.
+
+        The metrics which are undefined, every one of them on an empty test split and R2 on constant
+        labels, are None, written as null.
+
+        Args:
+            confidence_level: level of the bootstrap confidence intervals, written when the
+                metrics were accumulated with resamples
+        """
+        mse = self.squared_error_mean if self.count else np.nan
+        quantiles = np.full(len(RESIDUAL_QUANTILES), np.nan)
+        if self.count:
+            quantiles = np.quantile(self.residual_sample, RESIDUAL_QUANTILES)
+        r2 = 1.0 - mse * self.count / self.label_m2 if self.label_m2 > 0 else np.nan
+        metrics = {
+            "mse": {
+                "value": finite_or_none(mse),
+                "standard_deviation": finite_or_none(np.sqrt(self.residual_m2 / self.count) if self.count else np.nan),
+            },
+            "rmse": {"value": finite_or_none(np.sqrt(mse))},
+            "mae": {"value": finite_or_none(self.absolute_error_mean if self.count else np.nan)},
+            "r2": {"value": finite_or_none(r2)},
+        }
+        if self.n_resamples and self.count:
+            for metric, (lower, upper) in self.confidence_intervals(confidence_level).items():
+                metrics[metric]["confidence_interval"] = {
+                    "lower": finite_or_none(lower),
+                    "upper": finite_or_none(upper),
+                    "level": confidence_level,
+                    "resamples": self.n_resamples,
+                }
+        metrics["residual_quantiles"] = {
+            f"p{int(q * 100)}": finite_or_none(v) for q, v in zip(RESIDUAL_QUANTILES, quantiles)
+        }
+        metrics["count"] = {"value": self.count}
+        return {"regression_metrics": metrics}
+
+
+def predict(model, chunk, inplace=False):
+    """Predicts one chunk of the test split.
+
+    Args:
+        model: the trained xgboost Booster
+        chunk: DataFrame with the label in the first column
+        inplace: predict straight from a contiguous float32 array with `inplace_predict`
+            rather than building a DMatrix
+
+    Returns:
+        a tuple of numpy arrays holding the labels and the predictions
+    """
+    y = chunk.iloc[:, 0].to_numpy(dtype=np.float64)
+    if inplace:
+        features = np.ascontiguousarray(chunk.iloc[:, 1:].to_numpy(dtype=np.float32))
+        return y, model.inplace_predict(features)
+    return y, model.predict(xgboost.DMatrix(chunk.iloc[:, 1:].to_numpy(dtype=np.float64)))
+
+
+def evaluate(
+    model, test_dir, content_type="text/csv", chunk_size=100000, inplace=False, nthread=None, n_resamples=0
+):
+    """Predicts the test split chunk by chunk and accumulates the regression metrics.
+
+    Args:
+        model: the trained xgboost Booster
+        test_dir: local directory holding the test split
+        content_type: content type the split was written with
+        chunk_size: number of rows held in memory at a time
+        inplace: use the `inplace_predict` fast path, which needs xgboost 1.1 or later
+        nthread: number of prediction threads, every core of the instance if not set
+        n_resamples: number of bootstrap resamples of the confidence intervals, 0 skips them
+
+    Returns:
+        a StreamingRegressionMetrics
+    """
+    if inplace:
+        model.set_param({"nthread": nthread or os.cpu_count()})
+    metrics = StreamingRegressionMetrics(n_resamples=n_resamples)
+    for chunk in iter_test_data(test_dir, content_type, chunk_size):
+        metrics.update(*predict(model, chunk, inplace))
+    return metrics
+
+
+def package_model(model_path, preprocessor_dir, output_dir):
+    """Writes a model.tar.gz holding the trained model and its fitted preprocessor.
+
+    The preprocessor goes into a sub-directory, so that the XGBoost serving container, which loads
+    the first regular file at the root of the model directory, keeps picking up the model.
+
+    Args:
+        model_path: path of the model.tar.gz written by the training job
+        preprocessor_dir: directory holding the preprocessor output of the preprocessing step
+        output_dir: directory to write the packaged model.tar.gz to
+
+    Returns:
+        path of the packaged model.tar.gz
+    """
+    pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+    packaged_path = f"{output_dir}/model.tar.gz"
+    with tarfile.open(model_path) as src, tarfile.open(packaged_path, "w:gz") as dst:
+        for member in src.getmembers():
+            dst.addfile(member, src.extractfile(member) if member.isfile() else None)
+        dst.add(os.path.join(preprocessor_dir, os.path.basename(PREPROCESSOR_PATH)), arcname=PREPROCESSOR_PATH)
+    return packaged_path
+
 
 if __name__ == "__main__":
     logger.debug("Starting evaluation.")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--content-type",
+        type=str,
+        default="text/csv",
+        choices=sorted(CONTENT_TYPE_EXTENSIONS),
+        help="Content type of the test split.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100000,
+        help="Rows of the test split held in memory at a time.",
+    )
+    parser.add_argument(
+        "--inplace-predict",
+        action="store_true",
+        help="Predict with inplace_predict on float32 arrays instead of building a DMatrix (xgboost >= 1.1).",
+    )
+    parser.add_argument(
+        "--nthread",
+        type=int,
+        default=0,
+        help="With --inplace-predict, number of prediction threads. 0 uses every core of the instance.",
+    )
+    parser.add_argument(
+        "--bootstrap-resamples",
+        type=int,
+        default=1000,
+        help="Number of bootstrap resamples of the metric confidence intervals. 0 skips them.",
+    )
+    parser.add_argument(
+        "--confidence-level",
+        type=float,
+        default=0.95,
+        help="Level of the bootstrap confidence intervals.",
+    )
+    args = parser.parse_args()
+
     model_path = "/opt/ml/processing/model/model.tar.gz"
     with tarfile.open(model_path) as tar:
         tar.extractall(path="")
@@ -42,31 +334,27 @@ if __name__ == "__main__":
     logger.debug("Loading xgboost model.")
     model = pickle.load(open("xgboost-model", "rb"))
 
-    logger.debug("Reading test data.")
-    test_path = "/opt/ml/processing/test/test.csv"
-    df = pd.read_csv(test_path, header=None)
-
-    logger.debug("Reading test data.")
-    y_test = df.iloc[:, 0].to_numpy()
-    df.drop(df.columns[0], axis=1, inplace=True)
-    X_test = xgboost.DMatrix(df.values)
-
     logger.info("Performing predictions against test data.")
-    predictions = model.predict(X_test)
-
-    logger.debug("Calculating mean squared error.")
-    mse = mean_squared_error(y_test, predictions)
-    std = np.std(y_test - predictions)
-    report_dict = {
-        "regression_metrics": {
-            "mse": {"value": mse, "standard_deviation": std},
-        },
-    }
+    metrics = evaluate(
+        model,
+        "/opt/ml/processing/test",
+        args.content_type,
+        args.chunk_size,
+        args.inplace_predict,
+        args.nthread,
+        args.bootstrap_resamples,
+    )
+    report_dict = metrics.report(args.confidence_level)
 
     output_dir = "/opt/ml/processing/evaluation"
     pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
 
-    logger.info("Writing out evaluation report with mse: %f", mse)
+    mse = report_dict["regression_metrics"]["mse"]["value"]
+    logger.info("Writing out evaluation report with mse: %s over %d rows", mse, metrics.count)
     evaluation_path = f"{output_dir}/evaluation.json"
     with open(evaluation_path, "w") as f:
-        f.write(json.dumps(report_dict))
+        # the undefined metrics are null, NaN is not valid JSON
+        f.write(json.dumps(report_dict, allow_nan=False))
+
+    logger.info("Packaging the model with its fitted preprocessor.")
+    package_model(model_path, "/opt/ml/processing/preprocessor", "/opt/ml/processing/packaged_model")
@@ -0,0 +1,85 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Micro-benchmark of the DMatrix and inplace_predict paths of the evaluation script.
+
+Run from this folder with `python benchmark_predict.py [--rows 1000000]`. The synthetic test split has as many
+columns as the preprocessed abalone data and the model is trained with the pipeline's hyperparameters.
+"""
+import argparse
+import importlib.util
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost
+
+_spec = importlib.util.spec_from_file_location(
+    "evaluate_xgboost", os.path.join(os.path.dirname(__file__), "..", "main.py")
+)
+main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(main)
+
+# 7 scaled numeric features and the one-hot encoded sex column.
+N_FEATURES = 10
+HYPERPARAMETERS = {
+    "objective": "reg:squarederror",
+    "max_depth": 5,
+    "eta": 0.2,
+    "gamma": 4,
+    "min_child_weight": 6,
+    "subsample": 0.7,
+}
+
+
+def make_test_split(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, N_FEATURES))
+    y = X[:, :7] @ rng.normal(size=7) + 10.0 + rng.normal(size=n_rows)
+    return pd.DataFrame(np.column_stack((y, X)))
+
+
+def best_of(repeats, fn):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    chunk = make_test_split(args.rows)
+    train = chunk.sample(n=min(args.rows, 100000), random_state=0).to_numpy()
+    model = xgboost.train(HYPERPARAMETERS, xgboost.DMatrix(train[:, 1:], label=train[:, 0]), num_boost_round=50)
+
+    _, expected = main.predict(model, chunk)
+    baseline = best_of(args.repeats, lambda: main.predict(model, chunk))
+    model.set_param({"nthread": os.cpu_count()})
+    _, actual = main.predict(model, chunk, inplace=True)
+    fast = best_of(args.repeats, lambda: main.predict(model, chunk, inplace=True))
+
+    np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-5)
+    print(f"{args.rows} rows, {os.cpu_count()} cores")
+    print(f"DMatrix predict: {baseline:.3f}s")
+    print(f"inplace_predict: {fast:.3f}s ({baseline / fast:.1f}x)")
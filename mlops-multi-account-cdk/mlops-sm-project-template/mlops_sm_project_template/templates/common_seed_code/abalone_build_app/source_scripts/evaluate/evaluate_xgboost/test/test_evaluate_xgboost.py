@@ -0,0 +1,131 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import importlib.util
+import json
+import os
+import tarfile
+
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+_spec = importlib.util.spec_from_file_location(
+    "evaluate_xgboost", os.path.join(os.path.dirname(__file__), "..", "main.py")
+)
+main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(main)
+
+
+@pytest.fixture
+def test_split(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(3000, 5))
+    y = X @ rng.normal(size=5) + rng.normal(scale=0.5, size=3000) + 10.0
+    data = np.column_stack((y, X))
+    pd.DataFrame(data[:2000]).to_csv(tmp_path / "test-algo-1.csv", header=False, index=False)
+    pd.DataFrame(data[2000:]).to_csv(tmp_path / "test-algo-2.csv", header=False, index=False)
+    model = xgboost.train({"max_depth": 3}, xgboost.DMatrix(X, label=y), num_boost_round=10)
+    return tmp_path, model, data
+
+
+def test_streaming_metrics_match_in_memory_metrics(test_split):
+    test_dir, model, data = test_split
+    y, predictions = data[:, 0], model.predict(xgboost.DMatrix(data[:, 1:]))
+
+    report = main.evaluate(model, test_dir, chunk_size=700).report()["regression_metrics"]
+
+    assert report["count"]["value"] == len(data)
+    assert report["mse"]["value"] == pytest.approx(mean_squared_error(y, predictions), rel=1e-9)
+    assert report["mse"]["standard_deviation"] == pytest.approx(np.std(y - predictions), rel=1e-9)
+    assert report["rmse"]["value"] == pytest.approx(np.sqrt(mean_squared_error(y, predictions)), rel=1e-9)
+    assert report["mae"]["value"] == pytest.approx(mean_absolute_error(y, predictions), rel=1e-9)
+    assert report["r2"]["value"] == pytest.approx(r2_score(y, predictions), rel=1e-9)
+    assert report["residual_quantiles"]["p50"] == pytest.approx(np.median(y - predictions), rel=1e-9)
+
+
+def test_residual_quantiles_are_estimated_beyond_the_sample_size():
+    rng = np.random.default_rng(1)
+    metrics = main.StreamingRegressionMetrics(sample_size=5000)
+    residuals = rng.normal(size=50000)
+    for chunk in np.array_split(residuals, 17):
+        metrics.update(chunk, np.zeros_like(chunk))
+
+    quantiles = metrics.report()["regression_metrics"]["residual_quantiles"]
+    assert len(metrics.residual_sample) == 5000
+    assert quantiles["p5"] == pytest.approx(np.quantile(residuals, 0.05), abs=0.1)
+    assert quantiles["p95"] == pytest.approx(np.quantile(residuals, 0.95), abs=0.1)
+
+
+def test_inplace_predict_matches_dmatrix_predict(test_split):
+    test_dir, model, _ = test_split
+
+    expected = main.evaluate(model, test_dir, chunk_size=700).report()["regression_metrics"]
+    actual = main.evaluate(model, test_dir, chunk_size=700, inplace=True, nthread=2).report()["regression_metrics"]
+
+    for metric in ["mse", "rmse", "mae", "r2"]:
+        assert actual[metric]["value"] == pytest.approx(expected[metric]["value"], rel=1e-5)
+
+
+def test_bootstrap_confidence_intervals_cover_the_sampling_error():
+    rng = np.random.default_rng(2)
+    n_rows = 20000
+    y = rng.normal(loc=10.0, size=n_rows)
+    residuals = rng.normal(size=n_rows)
+    metrics = main.StreamingRegressionMetrics(n_resamples=500)
+    for start in range(0, n_rows, 3000):
+        metrics.update(y[start : start + 3000], y[start : start + 3000] - residuals[start : start + 3000])
+
+    report = metrics.report(confidence_level=0.95)["regression_metrics"]
+    for metric in ["mse", "rmse", "mae", "r2"]:
+        interval = report[metric]["confidence_interval"]
+        assert interval["lower"] < report[metric]["value"] < interval["upper"]
+    # The MSE of standard normal residuals has a standard error of sqrt(2 / n).
+    width = report["mse"]["confidence_interval"]["upper"] - report["mse"]["confidence_interval"]["lower"]
+    assert width == pytest.approx(2 * 1.96 * np.sqrt(2 / n_rows), rel=0.2)
+
+
+@pytest.mark.parametrize("labels", [[], [5.0] * 100])
+def test_undefined_metrics_are_written_as_null(labels):
+    metrics = main.StreamingRegressionMetrics(n_resamples=10)
+    metrics.update(labels, np.arange(len(labels), dtype=np.float64))
+
+    report = json.loads(json.dumps(metrics.report(), allow_nan=False))["regression_metrics"]
+
+    assert report["r2"]["value"] is None
+    if labels:
+        assert report["mse"]["value"] == pytest.approx(np.mean((5.0 - np.arange(100)) ** 2))
+        assert report["r2"]["confidence_interval"]["lower"] is None
+    else:
+        assert report["mse"]["value"] is None
+        assert set(report["residual_quantiles"].values()) == {None}
+
+
+def test_package_model_adds_the_preprocessor_next_to_the_model(tmp_path):
+    (tmp_path / "xgboost-model").write_bytes(b"model")
+    with tarfile.open(tmp_path / "model.tar.gz", "w:gz") as tar:
+        tar.add(tmp_path / "xgboost-model", arcname="xgboost-model")
+    (tmp_path / "preprocessor").mkdir()
+    (tmp_path / "preprocessor" / "preprocessor.pkl").write_bytes(b"preprocessor")
+
+    path = main.package_model(tmp_path / "model.tar.gz", tmp_path / "preprocessor", tmp_path / "packaged")
+
+    with tarfile.open(path) as tar:
+        assert tar.getnames() == ["xgboost-model", main.PREPROCESSOR_PATH]
+        assert tar.extractfile("xgboost-model").read() == b"model"
+        assert tar.extractfile(main.PREPROCESSOR_PATH).read() == b"preprocessor"
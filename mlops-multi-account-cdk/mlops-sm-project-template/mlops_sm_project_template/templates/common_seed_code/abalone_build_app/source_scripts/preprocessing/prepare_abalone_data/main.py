@@ -14,13 +14,28 @@
 # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
-"""Feature engineers the abalone dataset."""
+"""Feature engineers the abalone dataset.
+
+By default the whole dataset is loaded into memory. When `--chunk-size` is set the script
+runs in streaming mode instead: a first pass reads the input chunk by chunk to fit the
+preprocessor, and a second pass transforms each chunk and appends it to the output splits.
+Peak memory is then bounded by the chunk size rather than the dataset size.
+
+The splits are written as headerless CSV by default, or as Parquet with `--content-type
+application/x-parquet`. In both cases the label is the first column.
+
+With `--input-dir` the script runs as one instance of a multi-instance job whose input is
+sharded by S3 key. It is then run twice: with `--statistics-only` every instance writes the
+partial statistics of its shard, then with `--statistics-dir` every instance merges all the
+partial statistics into the same fitted transformer and writes the splits of its own shard.
+"""
 import argparse
+import json
 import logging
 import os
 import pathlib
-import requests
-import tempfile
+import pickle
+import zlib
 
 import boto3
 import numpy as np
@@ -61,6 +76,26 @@ feature_columns_dtype = {
 }
 label_column_dtype = {"rings": np.float64}
 
+numeric_features = [c for c in feature_columns_names if c != "sex"]
+categorical_features = ["sex"]
+
+# Upper bound on the number of values per numeric column kept to estimate the median in
+# streaming mode. Below this many rows the median is exact.
+MEDIAN_SAMPLE_SIZE = 100000
+
+# Upper bounds of the train and validation partitions on the [0, 1) hash scale, i.e. a 70/15/15 split.
+SPLIT_BOUNDARIES = [0.7, 0.85]
+
+# Supported content types of the output splits and their file extension.
+CONTENT_TYPE_EXTENSIONS = {
+    "text/csv": "csv",
+    "application/x-parquet": "parquet",
+}
+
+# Location of the fitted preprocessor, in the preprocessor output and inside model.tar.gz, where
+# the evaluation script packages it next to the model.
+PREPROCESSOR_PATH = "preprocessor/preprocessor.pkl"
+
 
 def merge_two_dicts(x, y):
     """Merges two dicts, returning a new copy."""
@@ -69,38 +104,47 @@ def merge_two_dicts(x, y):
     return z
 
 
-if __name__ == "__main__":
-    logger.debug("Starting preprocessing.")
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--input-data", type=str, required=True)
-    args = parser.parse_args()
-
-    base_dir = "/opt/ml/processing"
-    pathlib.Path(f"{base_dir}/data").mkdir(parents=True, exist_ok=True)
-    input_data = args.input_data
-    bucket = input_data.split("/")[2]
-    key = "/".join(input_data.split("/")[3:])
+def read_abalone_csv(path, chunk_size=None):
+    """Reads the headerless abalone CSV.
 
-    logger.info("Downloading data from bucket: %s, key: %s", bucket, key)
-    fn = f"{base_dir}/data/abalone-dataset.csv"
-    s3 = boto3.resource("s3")
-    s3.Bucket(bucket).download_file(key, fn)
+    Args:
+        path: local path of the CSV file
+        chunk_size: if set, number of rows per chunk
 
-    logger.debug("Reading downloaded data.")
-    df = pd.read_csv(
-        fn,
+    Returns:
+        a DataFrame, or an iterator of DataFrames when chunk_size is set
+    """
+    return pd.read_csv(
+        path,
         header=None,
         names=feature_columns_names + [label_column],
         dtype=merge_two_dicts(feature_columns_dtype, label_column_dtype),
+        chunksize=chunk_size or None,
     )
-    os.unlink(fn)
 
-    logger.debug("Defining transformers.")
-    numeric_features = list(feature_columns_names)
-    numeric_features.remove("sex")
+
+def assign_splits(df, split_key=None):
+    """Assigns each row to train (0), validation (1) or test (2) from a stable hash of its key.
+
+    A given key always lands in the same partition, whichever chunk or instance reads it, so re-runs on the same
+    data give identical splits.
+
+    Args:
+        df: raw rows, including the label
+        split_key: columns identifying a row, the whole row content is hashed if not set
+
+    Returns:
+        numpy array holding the partition of each row
+    """
+    keys = df[split_key] if split_key else df
+    hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+    return np.digitize(hashes / np.float64(2**64), SPLIT_BOUNDARIES)
+
+
+def build_preprocessor():
+    """Defines the (unfitted) feature transformer."""
     numeric_transformer = Pipeline(steps=[("imputer", SimpleImputer(strategy="median")), ("scaler", StandardScaler())])
 
-    categorical_features = ["sex"]
     categorical_transformer = Pipeline(
         steps=[
             ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
@@ -108,25 +152,468 @@ if __name__ == "__main__":
         ]
     )
 
-    preprocess = ColumnTransformer(
+    return ColumnTransformer(
         transformers=[
             ("num", numeric_transformer, numeric_features),
             ("cat", categorical_transformer, categorical_features),
         ]
     )
 
+
+class StreamingFeatureStatistics:
+    """Accumulates the statistics needed to fit the preprocessor one chunk at a time.
+
+    For every numeric column it keeps the count, mean and sum of squared deviations of the
+    observed values (combined with Chan's parallel update, which is numerically stable), the
+    number of missing values and a bounded uniform sample used to estimate the median. For the
+    categorical column it keeps the set of observed values.
+    """
+
+    def __init__(self, sample_size=MEDIAN_SAMPLE_SIZE, seed=0):
+        n_features = len(numeric_features)
+        self.sample_size = sample_size
+        self.count = np.zeros(n_features)
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+        self.missing = np.zeros(n_features)
+        self.categories = set()
+        self.categories_missing = False
+        # The sample keeps the values holding the smallest random priorities seen so far, which
+        # is a uniform sample without replacement of everything observed.
+        self.sample_values = [np.empty(0) for _ in numeric_features]
+        self.sample_priorities = [np.empty(0) for _ in numeric_features]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, df):
+        """Folds one chunk of features into the statistics.
+
+        Args:
+            df: DataFrame holding the feature columns
+        """
+        values = df[numeric_features].to_numpy(dtype=np.float64)
+        observed = ~np.isnan(values)
+        count = observed.sum(axis=0)
+        total = np.where(observed, values, 0.0).sum(axis=0)
+        mean = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+        m2 = np.where(observed, (values - mean) ** 2, 0.0).sum(axis=0)
+        self._combine(count, mean, m2)
+        self.missing += (~observed).sum(axis=0)
+
+        for i in range(len(numeric_features)):
+            column = values[observed[:, i], i]
+            self._sample(i, column, self._rng.random(len(column)))
+
+        categories = df[categorical_features[0]]
+        self.categories.update(categories.dropna().unique())
+        self.categories_missing |= bool(categories.isna().any())
+
+    def merge(self, other):
+        """Folds the statistics accumulated by another instance into these ones.
+
+        Args:
+            other: a StreamingFeatureStatistics
+        """
+        self._combine(other.count, other.mean, other.m2)
+        self.missing = self.missing + other.missing
+        for i in range(len(numeric_features)):
+            self._sample(i, other.sample_values[i], other.sample_priorities[i])
+        self.categories.update(other.categories)
+        self.categories_missing |= other.categories_missing
+
+    def save(self, path):
+        """Saves the statistics to a `.npz` file."""
+        samples = {}
+        for i, c in enumerate(numeric_features):
+            samples[f"sample_values_{c}"] = self.sample_values[i]
+            samples[f"sample_priorities_{c}"] = self.sample_priorities[i]
+        np.savez(
+            path,
+            count=self.count,
+            mean=self.mean,
+            m2=self.m2,
+            missing=self.missing,
+            categories=np.array(sorted(self.categories), dtype=str),
+            categories_missing=self.categories_missing,
+            **samples,
+        )
+
+    @classmethod
+    def load(cls, path, sample_size=MEDIAN_SAMPLE_SIZE):
+        """Loads statistics saved with `save`."""
+        stats = cls(sample_size=sample_size)
+        with np.load(path) as data:
+            stats.count = data["count"]
+            stats.mean = data["mean"]
+            stats.m2 = data["m2"]
+            stats.missing = data["missing"]
+            stats.categories = set(data["categories"].tolist())
+            stats.categories_missing = bool(data["categories_missing"])
+            stats.sample_values = [data[f"sample_values_{c}"] for c in numeric_features]
+            stats.sample_priorities = [data[f"sample_priorities_{c}"] for c in numeric_features]
+        return stats
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        safe_total = np.where(total > 0, total, 1.0)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / safe_total
+        self.m2 = self.m2 + m2 + delta**2 * self.count * count / safe_total
+        self.count = total
+
+    def _sample(self, i, values, priorities):
+        values = np.concatenate((self.sample_values[i], values))
+        priorities = np.concatenate((self.sample_priorities[i], priorities))
+        if len(values) > self.sample_size:
+            keep = np.argpartition(priorities, self.sample_size)[: self.sample_size]
+            values, priorities = values[keep], priorities[keep]
+        self.sample_values[i] = values
+        self.sample_priorities[i] = priorities
+
+    def medians(self):
+        """Returns the (estimated) median of every numeric column."""
+        return np.array([np.median(v) if len(v) else np.nan for v in self.sample_values])
+
+    def fit_preprocessor(self):
+        """Builds a preprocessor fitted from the accumulated statistics.
+
+        The result is equivalent to calling `build_preprocessor().fit(df)` on the full data,
+        except that the medians are estimated from a sample once a column holds more than
+        `sample_size` values.
+
+        Returns:
+            a fitted ColumnTransformer
+        """
+        medians = self.medians()
+        categories = sorted(self.categories)
+        if self.categories_missing:
+            categories.append("missing")
+        if not categories:
+            categories = ["missing"]
+
+        # Fitting on a small frame gives every transformer its fitted structure (feature names,
+        # one-hot categories, imputer medians); the scaler moments are then set from the stream.
+        seed_frame = pd.DataFrame({c: [medians[i]] * len(categories) for i, c in enumerate(numeric_features)})
+        seed_frame.insert(0, categorical_features[0], categories)
+        preprocess = build_preprocessor().fit(seed_frame)
+
+        # Missing values are imputed with the median before scaling, so the scaler sees them as
+        # extra observations equal to the median.
+        total = self.count + self.missing
+        delta = medians - self.mean
+        mean = self.mean + delta * self.missing / total
+        m2 = self.m2 + delta**2 * self.count * self.missing / total
+        var = m2 / total
+
+        scaler = preprocess.named_transformers_["num"].named_steps["scaler"]
+        scaler.mean_ = mean
+        scaler.var_ = var
+        scaler.scale_ = np.where(var > np.finfo(np.float64).eps, np.sqrt(var), 1.0)
+        scaler.n_samples_seen_ = int(total[0])
+        return preprocess
+
+
+class SplitWriter:
+    """Appends rows of floats to one output file, as headerless CSV or Parquet."""
+
+    def __init__(self, path, content_type="text/csv"):
+        self.path = path
+        self.content_type = content_type
+        self.rows = 0
+        self._file = None
+        self._parquet_writer = None
+
+    def write(self, rows):
+        """Appends a 2D array of rows to the file."""
+        if self.content_type == "application/x-parquet":
+            # pyarrow is only needed, and only imported, for Parquet output.
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_arrays(
+                [pa.array(rows[:, i]) for i in range(rows.shape[1])],
+                names=[str(i) for i in range(rows.shape[1])],
+            )
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            if self._file is None:
+                self._file = open(self.path, "w")
+            pd.DataFrame(rows).to_csv(self._file, header=False, index=False)
+        self.rows += len(rows)
+
+    def close(self):
+        """Flushes and closes the file."""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def write_split(rows, path, content_type="text/csv"):
+    """Writes a 2D array of rows to a single file."""
+    writer = SplitWriter(path, content_type)
+    try:
+        writer.write(rows)
+    finally:
+        writer.close()
+
+
+def preprocess_in_memory(input_path, base_dir, content_type="text/csv", split_key=None):
+    """Fits the transformer on the whole dataset at once and writes the splits.
+
+    Args:
+        input_path: local path of the raw CSV file
+        base_dir: processing directory holding the train, validation and test folders
+        content_type: content type of the output splits
+        split_key: columns hashed to assign rows to splits, the whole row if not set
+    """
+    logger.debug("Reading downloaded data.")
+    df = read_abalone_csv(input_path)
+    assignment = assign_splits(df, split_key)
+
     logger.info("Applying transforms.")
+    preprocess = build_preprocessor()
     y = df.pop("rings")
     X_pre = preprocess.fit_transform(df)
     y_pre = y.to_numpy().reshape(len(y), 1)
 
     X = np.concatenate((y_pre, X_pre), axis=1)
+    save_preprocessor(preprocess, base_dir)
 
     logger.info("Splitting %d rows of data into train, validation, test datasets.", len(X))
-    np.random.shuffle(X)
-    train, validation, test = np.split(X, [int(0.7 * len(X)), int(0.85 * len(X))])
-
     logger.info("Writing out datasets to %s.", base_dir)
-    pd.DataFrame(train).to_csv(f"{base_dir}/train/train.csv", header=False, index=False)
-    pd.DataFrame(validation).to_csv(f"{base_dir}/validation/validation.csv", header=False, index=False)
-    pd.DataFrame(test).to_csv(f"{base_dir}/test/test.csv", header=False, index=False)
+    extension = CONTENT_TYPE_EXTENSIONS[content_type]
+    for i, split in enumerate(["train", "validation", "test"]):
+        write_split(X[assignment == i], f"{base_dir}/{split}/{split}.{extension}", content_type)
+
+
+def save_preprocessor(preprocess, base_dir):
+    """Pickles the fitted preprocessor, for the evaluation step to package it with the model."""
+    path = pathlib.Path(base_dir, PREPROCESSOR_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump(preprocess, f)
+
+
+def iter_chunks(input_paths, chunk_size=None):
+    """Yields the rows of several CSV files as DataFrames.
+
+    Args:
+        input_paths: local paths of the raw CSV files
+        chunk_size: if set, number of rows per DataFrame, otherwise one DataFrame per file
+    """
+    for path in input_paths:
+        if chunk_size:
+            yield from read_abalone_csv(path, chunk_size)
+        else:
+            yield read_abalone_csv(path)
+
+
+def compute_statistics(input_paths, chunk_size=None, seed=0):
+    """Accumulates the preprocessor statistics over the raw CSV files.
+
+    Args:
+        input_paths: local paths of the raw CSV files
+        chunk_size: if set, number of rows held in memory at a time
+        seed: seed of the median sample, must differ between instances of a sharded job
+
+    Returns:
+        a StreamingFeatureStatistics
+    """
+    stats = StreamingFeatureStatistics(seed=seed)
+    for chunk in iter_chunks(input_paths, chunk_size):
+        stats.update(chunk.drop(columns=[label_column]))
+    return stats
+
+
+def transform_and_write(
+    preprocess, input_paths, base_dir, chunk_size=None, content_type="text/csv", part=None, split_key=None
+):
+    """Transforms the raw CSV files with a fitted preprocessor and appends them to the splits.
+
+    Rows are assigned to train, validation and test with 70/15/15 probabilities from a hash of their key.
+
+    Args:
+        preprocess: the fitted ColumnTransformer
+        input_paths: local paths of the raw CSV files
+        base_dir: processing directory holding the train, validation and test folders
+        chunk_size: if set, number of rows held in memory at a time
+        content_type: content type of the output splits
+        part: suffix of the output file names, so that several instances can write to the same prefix
+        split_key: columns hashed to assign rows to splits, the whole row if not set
+    """
+    logger.info("Applying transforms and writing out datasets to %s.", base_dir)
+    extension = CONTENT_TYPE_EXTENSIONS[content_type]
+    splits = ["train", "validation", "test"]
+    suffix = f"-{part}" if part else ""
+    save_preprocessor(preprocess, base_dir)
+    writers = {
+        split: SplitWriter(f"{base_dir}/{split}/{split}{suffix}.{extension}", content_type) for split in splits
+    }
+    try:
+        for chunk in iter_chunks(input_paths, chunk_size):
+            assignment = assign_splits(chunk, split_key)
+            y = chunk.pop(label_column).to_numpy()
+            X = np.column_stack((y, preprocess.transform(chunk)))
+            for i, split in enumerate(splits):
+                part = X[assignment == i]
+                if len(part):
+                    writers[split].write(part)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    logger.info("Wrote %s rows.", {split: writer.rows for split, writer in writers.items()})
+
+
+def preprocess_streaming(input_path, base_dir, chunk_size, content_type="text/csv", split_key=None):
+    """Fits the transformer and writes the splits in two passes over chunks of the input.
+
+    Args:
+        input_path: local path of the raw CSV file
+        base_dir: processing directory holding the train, validation and test folders
+        chunk_size: number of rows held in memory at a time
+        content_type: content type of the output splits
+        split_key: columns hashed to assign rows to splits, the whole row if not set
+    """
+    logger.info("Fitting transforms on chunks of %d rows.", chunk_size)
+    stats = compute_statistics([input_path], chunk_size)
+    preprocess = stats.fit_preprocessor()
+    logger.info("Fitted transforms on %d rows.", stats.count[0] + stats.missing[0])
+
+    transform_and_write(preprocess, [input_path], base_dir, chunk_size, content_type, split_key=split_key)
+
+
+def get_current_host():
+    """Returns the name of this instance of the processing job."""
+    try:
+        with open("/opt/ml/config/resourceconfig.json") as f:
+            return json.load(f)["current_host"]
+    except (OSError, KeyError, ValueError):
+        return "algo-1"
+
+
+def list_input_files(input_dir):
+    """Lists the files of this instance's input shard."""
+    return sorted(str(p) for p in pathlib.Path(input_dir).rglob("*") if p.is_file())
+
+
+def preprocess_shard_statistics(input_dir, statistics_dir, host, chunk_size=None):
+    """Writes the partial preprocessor statistics of this instance's shard.
+
+    Args:
+        input_dir: local directory holding this instance's input shard
+        statistics_dir: directory to write the statistics to
+        host: name of this instance
+        chunk_size: if set, number of rows held in memory at a time
+    """
+    input_paths = list_input_files(input_dir)
+    logger.info("Computing statistics of %d input files on %s.", len(input_paths), host)
+    stats = compute_statistics(input_paths, chunk_size, seed=zlib.crc32(host.encode()))
+    pathlib.Path(statistics_dir).mkdir(parents=True, exist_ok=True)
+    stats.save(f"{statistics_dir}/{host}.npz")
+
+
+def merge_statistics(statistics_dir):
+    """Merges the partial statistics written by every instance.
+
+    The files are merged in name order, so every instance builds the same transformer.
+
+    Args:
+        statistics_dir: local directory holding the partial statistics
+
+    Returns:
+        a StreamingFeatureStatistics
+    """
+    paths = sorted(pathlib.Path(statistics_dir).glob("*.npz"))
+    logger.info("Merging statistics of %d instances.", len(paths))
+    stats = StreamingFeatureStatistics()
+    for path in paths:
+        stats.merge(StreamingFeatureStatistics.load(path))
+    return stats
+
+
+def preprocess_shard(
+    input_dir, statistics_dir, base_dir, host, chunk_size=None, content_type="text/csv", split_key=None
+):
+    """Fits the transformer from the merged statistics and writes the splits of this instance's shard.
+
+    Args:
+        input_dir: local directory holding this instance's input shard
+        statistics_dir: local directory holding the partial statistics of every instance
+        base_dir: processing directory holding the train, validation and test folders
+        host: name of this instance, used to name its output files
+        chunk_size: if set, number of rows held in memory at a time
+        content_type: content type of the output splits
+        split_key: columns hashed to assign rows to splits, the whole row if not set
+    """
+    preprocess = merge_statistics(statistics_dir).fit_preprocessor()
+    transform_and_write(
+        preprocess, list_input_files(input_dir), base_dir, chunk_size, content_type, part=host, split_key=split_key
+    )
+
+
+if __name__ == "__main__":
+    logger.debug("Starting preprocessing.")
+    parser = argparse.ArgumentParser()
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument("--input-data", type=str, help="S3 URI of the raw CSV file.")
+    input_group.add_argument("--input-dir", type=str, help="Local directory holding this instance's input shard.")
+    parser.add_argument(
+        "--statistics-only",
+        action="store_true",
+        help="With --input-dir, only write the partial statistics of the shard to --statistics-dir.",
+    )
+    parser.add_argument(
+        "--statistics-dir",
+        type=str,
+        default="/opt/ml/processing/statistics",
+        help="With --input-dir, directory holding the partial statistics of every instance.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=0,
+        help="Rows per chunk in streaming mode. 0 loads the whole dataset in memory.",
+    )
+    parser.add_argument(
+        "--content-type",
+        type=str,
+        default="text/csv",
+        choices=sorted(CONTENT_TYPE_EXTENSIONS),
+        help="Content type of the output splits.",
+    )
+    parser.add_argument(
+        "--split-key",
+        type=str,
+        default="",
+        help="Comma-separated columns hashed to assign rows to splits. Empty hashes the whole row.",
+    )
+    args = parser.parse_args()
+    split_key = [c for c in args.split_key.split(",") if c]
+
+    base_dir = "/opt/ml/processing"
+    if args.input_dir:
+        host = get_current_host()
+        if args.statistics_only:
+            preprocess_shard_statistics(args.input_dir, args.statistics_dir, host, args.chunk_size)
+        else:
+            preprocess_shard(
+                args.input_dir, args.statistics_dir, base_dir, host, args.chunk_size, args.content_type, split_key
+            )
+    else:
+        pathlib.Path(f"{base_dir}/data").mkdir(parents=True, exist_ok=True)
+        input_data = args.input_data
+        bucket = input_data.split("/")[2]
+        key = "/".join(input_data.split("/")[3:])
+
+        logger.info("Downloading data from bucket: %s, key: %s", bucket, key)
+        fn = f"{base_dir}/data/abalone-dataset.csv"
+        s3 = boto3.resource("s3")
+        s3.Bucket(bucket).download_file(key, fn)
+
+        if args.chunk_size > 0:
+            preprocess_streaming(fn, base_dir, args.chunk_size, args.content_type, split_key)
+        else:
+            preprocess_in_memory(fn, base_dir, args.content_type, split_key)
+        os.unlink(fn)
@@ -0,0 +1,135 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "prepare_abalone_data", os.path.join(os.path.dirname(__file__), "..", "main.py")
+)
+main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(main)
+
+
+def make_abalone_frame(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({c: rng.gamma(2.0, 0.5, n_rows) for c in main.numeric_features})
+    df.insert(0, "sex", rng.choice(["M", "F", "I"], n_rows))
+    df[main.label_column] = rng.integers(1, 30, n_rows).astype(np.float64)
+    for c in ["length", "height"]:
+        df.loc[rng.random(n_rows) < 0.05, c] = np.nan
+    df.loc[rng.random(n_rows) < 0.01, "sex"] = np.nan
+    return df
+
+
+def write_csv(df, path):
+    df.to_csv(path, header=False, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def base_dir(tmp_path):
+    for split in ["train", "validation", "test"]:
+        (tmp_path / split).mkdir()
+    return tmp_path
+
+
+def test_streaming_fit_matches_in_memory_fit(tmp_path):
+    df = make_abalone_frame(5000)
+    path = write_csv(df, tmp_path / "abalone.csv")
+
+    stats = main.StreamingFeatureStatistics()
+    for chunk in main.read_abalone_csv(path, chunk_size=700):
+        stats.update(chunk.drop(columns=[main.label_column]))
+    streamed = stats.fit_preprocessor()
+
+    features = main.read_abalone_csv(path).drop(columns=[main.label_column])
+    expected = main.build_preprocessor().fit_transform(features)
+    np.testing.assert_allclose(streamed.transform(features), expected, rtol=1e-9, atol=1e-9)
+
+
+def test_streaming_writes_every_row_once(tmp_path, base_dir):
+    df = make_abalone_frame(2000)
+    path = write_csv(df, tmp_path / "abalone.csv")
+
+    main.preprocess_streaming(path, base_dir, chunk_size=300)
+
+    splits = [pd.read_csv(base_dir / s / f"{s}.csv", header=None) for s in ["train", "validation", "test"]]
+    assert sum(len(s) for s in splits) == len(df)
+    assert sorted(pd.concat(splits)[0]) == sorted(df[main.label_column])
+    assert all(s.shape[1] == splits[0].shape[1] for s in splits)
+
+
+def test_streaming_splits_match_in_memory_splits(tmp_path, base_dir):
+    df = make_abalone_frame(2000)
+    path = write_csv(df, tmp_path / "abalone.csv")
+    splits = ["train", "validation", "test"]
+
+    main.preprocess_in_memory(path, base_dir)
+    in_memory = [pd.read_csv(base_dir / s / f"{s}.csv", header=None) for s in splits]
+    main.preprocess_streaming(path, base_dir, chunk_size=300)
+    streamed = [pd.read_csv(base_dir / s / f"{s}.csv", header=None) for s in splits]
+
+    for expected, actual in zip(in_memory, streamed):
+        np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy(), rtol=1e-9, atol=1e-9)
+    assert [len(s) / len(df) for s in in_memory] == pytest.approx([0.7, 0.15, 0.15], abs=0.03)
+
+
+def test_split_key_keeps_rows_sharing_a_key_together():
+    df = make_abalone_frame(1000)
+    df["sex"] = df["sex"].fillna("I")
+    assignment = main.assign_splits(df, ["sex"])
+
+    assert (pd.Series(assignment).groupby(df["sex"].to_numpy()).nunique() == 1).all()
+    np.testing.assert_array_equal(assignment[:500], main.assign_splits(df.iloc[:500], ["sex"]))
+
+
+def test_parquet_splits_match_csv_splits(tmp_path, base_dir):
+    df = make_abalone_frame(1000)
+    path = write_csv(df, tmp_path / "abalone.csv")
+
+    main.preprocess_in_memory(path, base_dir, content_type="text/csv")
+    main.preprocess_in_memory(path, base_dir, content_type="application/x-parquet")
+
+    for split in ["train", "validation", "test"]:
+        csv = pd.read_csv(base_dir / split / f"{split}.csv", header=None)
+        parquet = pd.read_parquet(base_dir / split / f"{split}.parquet")
+        np.testing.assert_allclose(parquet.to_numpy(), csv.to_numpy())
+
+
+def test_sharded_preprocessing_matches_single_instance(tmp_path, base_dir):
+    df = make_abalone_frame(3000)
+    statistics_dir = tmp_path / "statistics"
+    hosts = ["algo-1", "algo-2", "algo-3"]
+    for i, host in enumerate(hosts):
+        shard_dir = tmp_path / "input" / host
+        shard_dir.mkdir(parents=True)
+        write_csv(df.iloc[i::3], shard_dir / "part.csv")
+        main.preprocess_shard_statistics(shard_dir, statistics_dir, host, chunk_size=400)
+
+    merged = main.merge_statistics(statistics_dir).fit_preprocessor()
+    features = df.drop(columns=[main.label_column])
+    expected = main.build_preprocessor().fit_transform(features)
+    np.testing.assert_allclose(merged.transform(features), expected, rtol=1e-9, atol=1e-9)
+
+    for host in hosts:
+        main.preprocess_shard(tmp_path / "input" / host, statistics_dir, base_dir, host, chunk_size=400)
+    written = sum(len(pd.read_csv(p, header=None)) for p in base_dir.glob("*/*-algo-*.csv"))
+    assert written == len(df)
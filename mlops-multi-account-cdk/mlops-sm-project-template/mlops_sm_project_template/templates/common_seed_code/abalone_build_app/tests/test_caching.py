@@ -0,0 +1,142 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+
+import boto3
+from botocore.stub import Stubber
+from sagemaker.workflow.parameters import ParameterInteger, ParameterString
+
+from ml_pipelines.caching import (
+    INPUT_ETAGS_PARAMETER,
+    compute_cache_key,
+    count_cache_hits,
+    get_cache_config,
+    stage_source_dir,
+    with_input_etags,
+)
+
+INPUT_DATA_URI = "s3://bucket/dataset/abalone-dataset.csv"
+INPUT_DATA = ParameterString(name="InputDataUrl", default_value=INPUT_DATA_URI)
+DEFINITION = {
+    "Parameters": [
+        {"Name": "InputDataUrl", "Type": "String", "DefaultValue": INPUT_DATA_URI},
+        {"Name": "TrainingInstanceType", "Type": "String", "DefaultValue": "ml.m5.xlarge"},
+        {"Name": INPUT_ETAGS_PARAMETER, "Type": "String", "DefaultValue": ""},
+    ]
+}
+
+
+def s3_client(*etags):
+    client = boto3.client("s3", region_name="eu-west-1", aws_access_key_id="x", aws_secret_access_key="x")
+    stubber = Stubber(client)
+    for etag in etags:
+        stubber.add_response(
+            "list_objects_v2",
+            {"Contents": [{"Key": "dataset/abalone-dataset.csv", "ETag": etag}]},
+            {"Bucket": "bucket", "Prefix": "dataset/abalone-dataset.csv"},
+        )
+    stubber.activate()
+    return client
+
+
+def test_cache_key_changes_with_the_input_data_code_and_hyperparameters(tmp_path):
+    (tmp_path / "main.py").write_text("print(1)")
+    client = s3_client('"a"', '"a"', '"b"', '"a"', '"a"')
+    key = compute_cache_key(client, str(tmp_path), inputs=[INPUT_DATA_URI], hyperparameters={"eta": 0.2})
+
+    assert key == compute_cache_key(client, str(tmp_path), inputs=[INPUT_DATA_URI], hyperparameters={"eta": 0.2})
+    assert key != compute_cache_key(client, str(tmp_path), inputs=[INPUT_DATA_URI], hyperparameters={"eta": 0.2})
+    assert key != compute_cache_key(client, str(tmp_path), inputs=[INPUT_DATA_URI], hyperparameters={"eta": 0.3})
+    (tmp_path / "main.py").write_text("print(2)")
+    assert key != compute_cache_key(client, str(tmp_path), inputs=[INPUT_DATA_URI], hyperparameters={"eta": 0.2})
+
+
+def test_cache_key_of_parameterised_inputs_is_joined_with_the_etags_of_the_execution(tmp_path):
+    (tmp_path / "main.py").write_text("print(1)")
+
+    # the default value of the parameter is not listed, as executions may override it
+    key = compute_cache_key(s3_client(), str(tmp_path), inputs=[INPUT_DATA])
+
+    digest, parameter = key.expr["Std:Join"]["Values"]
+    assert key.expr["Std:Join"]["On"] == "-"
+    assert digest == compute_cache_key(source_dir=str(tmp_path))
+    assert parameter == {"Get": f"Parameters.{INPUT_ETAGS_PARAMETER}"}
+
+
+def test_input_etags_cover_the_data_the_parameters_resolve_to():
+    client = s3_client('"a"', '"a"', '"b"')
+    parameters = with_input_etags(client, DEFINITION, {"TrainingInstanceType": "ml.m5.large"})
+
+    assert parameters["TrainingInstanceType"] == "ml.m5.large"
+    assert with_input_etags(client, DEFINITION)[INPUT_ETAGS_PARAMETER] == parameters[INPUT_ETAGS_PARAMETER]
+    assert with_input_etags(client, DEFINITION)[INPUT_ETAGS_PARAMETER] != parameters[INPUT_ETAGS_PARAMETER]
+
+
+def test_input_etags_are_only_set_for_pipelines_declaring_them():
+    definition = {"Parameters": DEFINITION["Parameters"][:2]}
+
+    assert with_input_etags(s3_client(), definition, {"InputDataUrl": "s3://bucket/other/"}) == {
+        "InputDataUrl": "s3://bucket/other/"
+    }
+    assert with_input_etags(s3_client(), DEFINITION, {INPUT_ETAGS_PARAMETER: "given"}) == {
+        INPUT_ETAGS_PARAMETER: "given"
+    }
+
+
+def test_cache_key_ignores_inputs_produced_by_other_steps():
+    epochs = ParameterInteger(name="Epochs", default_value=2)
+
+    key = compute_cache_key(inputs=[object()], hyperparameters={"epochs": epochs})
+
+    assert key == compute_cache_key(hyperparameters={"epochs": ParameterInteger(name="Epochs", default_value=3)})
+    assert key != compute_cache_key(hyperparameters={"epochs": ParameterInteger(name="Steps", default_value=2)})
+
+
+def test_caching_is_disabled_without_expiry():
+    assert get_cache_config("P7D").config == {"CacheConfig": {"Enabled": True, "ExpireAfter": "P7D"}}
+    assert get_cache_config("") is None
+    assert get_cache_config(None) is None
+
+
+def test_staged_source_dir_only_has_and_changes_with_the_files_of_the_step(tmp_path):
+    (tmp_path / "helpers").mkdir()
+    for name in ("train.py", "evaluate.py", os.path.join("helpers", "data.py")):
+        (tmp_path / name).write_text(name)
+    file_names = ["train.py", os.path.join("helpers", "data.py")]
+
+    staged = stage_source_dir(str(tmp_path), file_names)
+
+    staged_files = [
+        os.path.relpath(os.path.join(root, name), staged) for root, _, names in os.walk(staged) for name in names
+    ]
+    assert sorted(staged_files) == [os.path.join("helpers", "data.py"), "train.py"]
+    (tmp_path / "evaluate.py").write_text("changed")
+    assert stage_source_dir(str(tmp_path), file_names) == staged
+    (tmp_path / "train.py").write_text("changed")
+    assert stage_source_dir(str(tmp_path), file_names) != staged
+
+
+def test_counts_the_cache_hits_of_the_steps_running_jobs():
+    steps = [
+        {"StepName": "Process", "StepStatus": "Succeeded", "CacheHitResult": {"SourcePipelineExecutionArn": "arn"}},
+        {"StepName": "Train", "StepStatus": "Succeeded", "Metadata": {"TrainingJob": {"Arn": "arn"}}},
+        {"StepName": "Evaluate", "StepStatus": "Executing", "Metadata": {"ProcessingJob": {"Arn": "arn"}}},
+        {"StepName": "Check", "StepStatus": "Succeeded", "Metadata": {"Condition": {"Outcome": "True"}}},
+    ]
+
+    assert count_cache_hits(steps) == (1, 1)
@@ -0,0 +1,74 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import boto3
+
+from ml_pipelines.image_uris import ImageUriResolver
+
+EXCEPTIONS = boto3.client("sagemaker", region_name="eu-west-1").exceptions
+
+
+class FakeSageMakerClient:
+    exceptions = EXCEPTIONS
+
+    def __init__(self, images):
+        self.images = images
+        self.calls = []
+
+    def describe_image_version(self, ImageName):
+        self.calls.append(ImageName)
+        if ImageName not in self.images:
+            error = {"Error": {"Code": "ResourceNotFound", "Message": "Image not found"}}
+            raise self.exceptions.ResourceNotFound(error, "DescribeImageVersion")
+        return {"ContainerImage": self.images[ImageName]}
+
+
+def test_resolves_images_once_per_ttl_across_resolvers(tmp_path):
+    client = FakeSageMakerClient({"processing": "processing:1", "training": "training:1"})
+
+    first = ImageUriResolver(client, "eu-west-1", "p-1", cache_dir=tmp_path).resolve(
+        ["processing", "training", "inference"], default="xgboost:1.0-1"
+    )
+    second = ImageUriResolver(client, "eu-west-1", "p-1", cache_dir=tmp_path).resolve(
+        ["processing", "training", "inference"], default="xgboost:1.0-1"
+    )
+
+    assert first == second == {"processing": "processing:1", "training": "training:1", "inference": "xgboost:1.0-1"}
+    assert sorted(client.calls) == ["inference", "processing", "training"]
+
+
+def test_cache_is_keyed_by_region_and_project_and_expires(tmp_path):
+    client = FakeSageMakerClient({"processing": "processing:1"})
+    ImageUriResolver(client, "eu-west-1", "p-1", cache_dir=tmp_path).resolve(["processing"])
+
+    ImageUriResolver(client, "eu-west-1", "p-2", cache_dir=tmp_path).resolve(["processing"])
+    ImageUriResolver(client, "us-east-1", "p-1", cache_dir=tmp_path).resolve(["processing"])
+    ImageUriResolver(client, "eu-west-1", "p-1", cache_dir=tmp_path, ttl=0).resolve(["processing"])
+
+    assert client.calls == ["processing"] * 4
+
+
+def test_prewarm_refreshes_cached_images(tmp_path):
+    client = FakeSageMakerClient({})
+    assert ImageUriResolver(client, "eu-west-1", "p-1", cache_dir=tmp_path).resolve(["training"]) == {"training": None}
+
+    client.images["training"] = "training:2"
+    ImageUriResolver(client, "eu-west-1", "p-1", cache_dir=tmp_path).prewarm(["training"])
+
+    resolver = ImageUriResolver(client, "eu-west-1", "p-1", cache_dir=tmp_path)
+    assert resolver.resolve(["training"]) == {"training": "training:2"}
+    assert client.calls == ["training", "training"]
@@ -0,0 +1,100 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Import-time budget of the CLIs.
+
+Run as a script to print the slowest imports of each CLI: python tests/test_import_time.py
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time of a CLI module, in microseconds, as reported by python -X importtime.
+IMPORT_TIME_BUDGET = 100000
+# Modules which must not be imported before a pipeline is actually rendered or run.
+HEAVY_MODULES = ["sagemaker", "boto3", "botocore", "sklearn", "pandas", "numpy", "asyncio"]
+CLIS = ["ml_pipelines.run_pipeline", "ml_pipelines.get_pipeline_definition"]
+
+
+def import_times(module_name, *argv):
+    """Runs the main function of a CLI module with python -X importtime.
+
+    Returns:
+        dict of the cumulative import time of every imported module, in microseconds
+    """
+    code = f"import sys, {module_name} as cli; sys.argv = ['cli', *{list(argv)!r}]; cli.main()"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=APP_DIR,
+        env=dict(os.environ, PYTHONPATH=APP_DIR),
+        capture_output=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:") :].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module_name", CLIS)
+@pytest.mark.parametrize("argv", [["--help"], []])
+def test_cli_starts_without_heavy_imports(module_name, argv):
+    times = import_times(module_name, *argv)
+
+    assert module_name in times
+    assert [m for m in times if m.split(".")[0] in HEAVY_MODULES] == []
+    assert times[module_name] < IMPORT_TIME_BUDGET
+
+
+def test_cached_definition_is_returned_without_importing_the_sdk(tmp_path):
+    sys.path.insert(0, APP_DIR)
+    from ml_pipelines._utils import get_definition_cache_key
+
+    kwargs = '{"region": "eu-west-1"}'
+    cwd = os.getcwd()
+    os.chdir(APP_DIR)
+    try:
+        cache_key = get_definition_cache_key("ml_pipelines.training.pipeline", kwargs)
+    finally:
+        os.chdir(cwd)
+    (tmp_path / f"{cache_key}.json").write_text('{"Version": "2020-12-01"}')
+    (tmp_path / f"{cache_key}.etags.json").write_text("{}")
+    output = tmp_path / "definition.json"
+
+    times = import_times(
+        "ml_pipelines.get_pipeline_definition",
+        *["-n", "ml_pipelines.training.pipeline", "--kwargs", kwargs, "--cache-dir", str(tmp_path), "-f", str(output)],
+    )
+
+    assert output.read_text() == '{"Version": "2020-12-01"}'
+    assert [m for m in times if m.split(".")[0] in HEAVY_MODULES] == []
+
+
+if __name__ == "__main__":
+    for module_name in CLIS:
+        times = import_times(module_name, "--help")
+        print(f"{module_name}: {times[module_name] / 1000:.1f} ms")
+        for name, cumulative in sorted(times.items(), key=lambda item: -item[1])[:10]:
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
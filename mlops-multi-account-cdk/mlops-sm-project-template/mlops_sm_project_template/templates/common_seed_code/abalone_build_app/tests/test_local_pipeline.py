@@ -0,0 +1,160 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+
+from ml_pipelines.local_pipeline import LocalPipelineRunner
+
+SCRIPT = """
+import glob
+import json
+import os
+
+with open("/opt/ml/config/resourceconfig.json") as f:
+    host = json.load(f)["current_host"]
+files = sorted(os.path.basename(p) for p in glob.glob("/opt/ml/processing/input/*.csv"))
+with open(f"/opt/ml/processing/output/{host}.json", "w") as f:
+    json.dump({"files": files, "count": len(files)}, f)
+"""
+
+
+def processing_step(name, instance_count):
+    return {
+        "Name": name,
+        "Type": "Processing",
+        "Arguments": {
+            "ProcessingResources": {"ClusterConfig": {"InstanceCount": instance_count}},
+            "AppSpecification": {
+                "ContainerEntrypoint": ["python3", "/opt/ml/processing/input/code/script.py"],
+            },
+            "ProcessingInputs": [
+                {
+                    "InputName": "input-1",
+                    "S3Input": {
+                        "S3Uri": {"Get": "Parameters.InputDataUrl"},
+                        "LocalPath": "/opt/ml/processing/input",
+                        "S3DataDistributionType": "ShardedByS3Key",
+                    },
+                },
+                {
+                    "InputName": "code",
+                    "S3Input": {
+                        "S3Uri": "s3://bucket/code/script.py",
+                        "LocalPath": "/opt/ml/processing/input/code",
+                        "S3DataDistributionType": "FullyReplicated",
+                    },
+                },
+            ],
+            "ProcessingOutputConfig": {
+                "Outputs": [
+                    {
+                        "OutputName": "report",
+                        "S3Output": {
+                            "S3Uri": {
+                                "Std:Join": {
+                                    "On": "/",
+                                    "Values": ["s3://bucket", {"Get": "Execution.PipelineExecutionId"}, name],
+                                }
+                            },
+                            "LocalPath": "/opt/ml/processing/output",
+                        },
+                    }
+                ]
+            },
+        },
+    }
+
+
+def definition(threshold):
+    condition = {
+        "Name": "CheckCount",
+        "Type": "Condition",
+        "Arguments": {
+            "Conditions": [
+                {
+                    "Type": "GreaterThanOrEqualTo",
+                    "LeftValue": {
+                        "Std:JsonGet": {
+                            "PropertyFile": {"Get": "Steps.Shard.PropertyFiles.Report"},
+                            "Path": "count",
+                        }
+                    },
+                    "RightValue": {"Get": "Parameters.Threshold"},
+                }
+            ],
+            "IfSteps": [
+                {
+                    "Name": "Register",
+                    "Type": "RegisterModel",
+                    "Arguments": {
+                        "ModelPackageGroupName": "Group",
+                        "ModelMetrics": {
+                            "S3Uri": {"Get": "Steps.Shard.ProcessingOutputConfig.Outputs['report'].S3Output.S3Uri"}
+                        },
+                    },
+                }
+            ],
+            "ElseSteps": [{"Name": "Stop", "Type": "Fail", "Arguments": {"ErrorMessage": "Too few files"}}],
+        },
+    }
+    shard = processing_step("Shard", 2)
+    shard["PropertyFiles"] = [{"PropertyFileName": "Report", "OutputName": "report", "FilePath": "algo-1.json"}]
+    return {
+        "Parameters": [
+            {"Name": "InputDataUrl", "Type": "String", "DefaultValue": "s3://bucket/input"},
+            {"Name": "Threshold", "Type": "Integer", "DefaultValue": threshold},
+        ],
+        "Steps": [shard, processing_step("Replicate", 1), condition],
+    }
+
+
+def seed(tmp_path):
+    (tmp_path / "s3" / "bucket" / "code").mkdir(parents=True)
+    (tmp_path / "s3" / "bucket" / "code" / "script.py").write_text(SCRIPT)
+    (tmp_path / "s3" / "bucket" / "input").mkdir()
+    for name in ["a.csv", "b.csv", "c.csv"]:
+        (tmp_path / "s3" / "bucket" / "input" / name).write_text("1,2,3\n")
+
+
+def test_runs_steps_with_sharded_inputs_and_registers_the_model(tmp_path):
+    seed(tmp_path)
+    runner = LocalPipelineRunner(definition(threshold=2), tmp_path)
+
+    statuses = runner.run()
+
+    assert statuses == {
+        "Shard": "Succeeded",
+        "Replicate": "Succeeded",
+        "CheckCount": "Succeeded",
+        "Register": "Succeeded",
+    }
+    outputs = tmp_path / "s3" / "bucket" / runner.execution_id
+    assert json.loads((outputs / "Shard" / "algo-1.json").read_text())["files"] == ["a.csv", "c.csv"]
+    assert json.loads((outputs / "Shard" / "algo-2.json").read_text())["files"] == ["b.csv"]
+    assert json.loads((outputs / "Replicate" / "algo-1.json").read_text())["count"] == 3
+    registered = json.loads((tmp_path / "model-registry" / "Group" / "1.json").read_text())
+    assert registered["ModelMetrics"]["S3Uri"] == f"s3://bucket/{runner.execution_id}/Shard"
+
+
+def test_fails_when_the_condition_takes_the_else_branch(tmp_path):
+    seed(tmp_path)
+
+    statuses = LocalPipelineRunner(definition(threshold=2), tmp_path, parameters={"Threshold": 3}).run()
+
+    assert statuses["CheckCount"] == "Succeeded"
+    assert statuses["Stop"] == "Failed"
+    assert not (tmp_path / "model-registry").exists()
@@ -0,0 +1,102 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+
+import pytest
+
+from ml_pipelines import monitor_pipeline
+from ml_pipelines.monitor_pipeline import PipelineExecutionFailed, monitor_executions
+
+
+class FakeSageMakerClient:
+    """Replays a sequence of (execution status, step statuses) polls per execution."""
+
+    def __init__(self, polls):
+        self.polls = polls
+        self.current = {}
+
+    def describe_pipeline_execution(self, PipelineExecutionArn):
+        status, steps = (
+            self.polls[PipelineExecutionArn].pop(0) if self.polls[PipelineExecutionArn] else ("Executing", {})
+        )
+        self.current[PipelineExecutionArn] = steps
+        return {"PipelineExecutionStatus": status}
+
+    def get_paginator(self, operation_name):
+        client = self
+
+        class Paginator:
+            def paginate(self, PipelineExecutionArn, SortOrder):
+                steps = client.current[PipelineExecutionArn]
+                yield {"PipelineExecutionSteps": [{"StepName": k, "StepStatus": v} for k, v in steps.items()]}
+
+        return Paginator()
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(monitor_pipeline.asyncio, "sleep", sleep)
+    return delays
+
+
+def test_streams_step_changes_and_backs_off_while_nothing_changes(delays):
+    client = FakeSageMakerClient(
+        {
+            "arn/a": [
+                ("Executing", {"Process": "Executing"}),
+                ("Executing", {"Process": "Executing"}),
+                ("Executing", {"Process": "Executing"}),
+                ("Executing", {"Process": "Succeeded", "Train": "Executing"}),
+                ("Succeeded", {"Process": "Succeeded", "Train": "Succeeded"}),
+            ]
+        }
+    )
+    messages = []
+
+    statuses = asyncio.run(monitor_executions(client, ["arn/a"], min_delay=1, max_delay=2, log=messages.append))
+
+    assert statuses == {"arn/a": {"Process": "Succeeded", "Train": "Succeeded"}}
+    assert messages == [
+        "[a] Process Executing",
+        "[a] Process Succeeded",
+        "[a] Train Executing",
+        "[a] Train Succeeded",
+        "[a] Succeeded",
+    ]
+    assert delays == [1, 1.5, 2, 1]
+
+
+def test_fails_as_soon_as_one_execution_has_a_failed_step(delays):
+    client = FakeSageMakerClient(
+        {
+            "arn/a": [("Executing", {"Process": "Executing"})] * 100,
+            "arn/b": [("Executing", {"Process": "Executing"}), ("Executing", {"Process": "Failed"})],
+        }
+    )
+
+    with pytest.raises(PipelineExecutionFailed, match="Process of arn/b failed") as error:
+        asyncio.run(monitor_executions(client, ["arn/a", "arn/b"], min_delay=0, log=lambda message: None))
+
+    assert error.value.execution_arn == "arn/b"
+
+    assert len(client.polls["arn/a"]) > 90
@@ -0,0 +1,104 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+
+from ml_pipelines import monitor_pipeline, sessions
+from ml_pipelines.monitor_pipeline import PipelineExecutionFailed
+from ml_pipelines.run_pipeline import format_summary, load_pipeline_specs, wait_for_results
+
+
+def test_manifest_entries_override_the_command_line_arguments(tmp_path):
+    manifest = tmp_path / "pipelines.json"
+    manifest.write_text(
+        json.dumps(
+            [
+                {"module_name": "ml_pipelines.inference.pipeline", "kwargs": {"region": "us-east-1", "flag": True}},
+                {"module_name": "ml_pipelines.monitoring.pipeline", "role_arn": "arn:role/other"},
+            ]
+        )
+    )
+
+    specs = load_pipeline_specs(
+        ["ml_pipelines.training.pipeline"], str(manifest), kwargs='{"region": "eu-west-1"}', role_arn="arn:role/r"
+    )
+
+    assert [spec["module_name"] for spec in specs] == [
+        "ml_pipelines.training.pipeline",
+        "ml_pipelines.inference.pipeline",
+        "ml_pipelines.monitoring.pipeline",
+    ]
+    assert [spec["role_arn"] for spec in specs] == ["arn:role/r", "arn:role/r", "arn:role/other"]
+    assert specs[0]["kwargs"] == '{"region": "eu-west-1"}'
+    assert specs[1]["kwargs"] == "{'region': 'us-east-1', 'flag': True}"
+    assert specs[2]["pipeline_inputs"] is None
+
+
+def test_waits_for_the_started_executions_until_one_fails(monkeypatch):
+    def wait_for_executions(sagemaker_client, execution_arns):
+        if "arn/failing" in execution_arns:
+            raise PipelineExecutionFailed("arn/failing", "Step Train of arn/failing failed")
+        return {arn: {"Train": "Succeeded"} for arn in execution_arns}
+
+    monkeypatch.setattr(monitor_pipeline, "wait_for_executions", wait_for_executions)
+    monkeypatch.setattr(sessions, "get_client", lambda service, region: region)
+    monkeypatch.setattr(
+        monitor_pipeline,
+        "list_execution_steps",
+        lambda sagemaker_client, execution_arn: [
+            {"StepName": "Process", "StepStatus": "Succeeded", "CacheHitResult": {"SourcePipelineExecutionArn": "x"}},
+            {"StepName": "Train", "StepStatus": "Failed", "Metadata": {"TrainingJob": {"Arn": "y"}}},
+        ],
+    )
+    results = [
+        {"module_name": "a", "status": "Started", "region": "eu-west-1", "execution_arn": "arn/a"},
+        {"module_name": "b", "status": "Skipped", "region": "eu-west-1", "execution_arn": "arn/previous"},
+        {"module_name": "c", "status": "Started", "region": "us-east-1", "execution_arn": "arn/failing"},
+    ]
+
+    step_statuses = wait_for_results(results)
+
+    assert step_statuses == {"arn/a": {"Train": "Succeeded"}}
+    assert [result["status"] for result in results] == ["Succeeded", "Skipped", "Failed"]
+    assert results[2]["error"] == "Step Train of arn/failing failed"
+    assert [(result.get("cache_hits"), result.get("cache_misses")) for result in results] == [
+        (1, 1),
+        (None, None),
+        (1, 1),
+    ]
+
+
+def test_summary_has_one_aligned_line_per_pipeline():
+    summary = format_summary(
+        [
+            {
+                "module_name": "ml_pipelines.training.pipeline",
+                "pipeline_name": "p",
+                "status": "Succeeded",
+                "execution_arn": "arn/a",
+                "cache_hits": 2,
+                "cache_misses": 1,
+            },
+            {"module_name": "b", "status": "Failed", "error": "No module named 'b'"},
+        ]
+    )
+
+    assert summary.splitlines() == [
+        "MODULE                          PIPELINE  STATUS     CACHE HITS  EXECUTION",
+        "ml_pipelines.training.pipeline  p         Succeeded  2/3         arn/a",
+        "b                               -         Failed     -           No module named 'b'",
+    ]
@@ -0,0 +1,50 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from ml_pipelines import sessions
+
+
+def test_clients_are_shared_per_service_and_region():
+    client = sessions.get_client("sagemaker", "eu-west-1")
+
+    assert sessions.get_client("sagemaker", "eu-west-1") is client
+    assert sessions.get_client("sagemaker", "us-east-1") is not client
+    assert sessions.get_client("s3", "eu-west-1") is not client
+    assert sessions.get_boto_session("eu-west-1") is sessions.get_boto_session("eu-west-1")
+
+
+def test_clients_use_a_larger_pool_and_adaptive_retries(monkeypatch):
+    monkeypatch.delenv("AWS_RETRY_MODE", raising=False)
+    monkeypatch.setenv("ML_PIPELINES_MAX_POOL_CONNECTIONS", "20")
+    sessions.configure()
+
+    config = sessions.get_client("sagemaker", "eu-west-1").meta.config
+
+    assert config.max_pool_connections == 20
+    assert config.retries["mode"] == "adaptive"
+
+
+def test_configure_drops_the_cached_clients():
+    client = sessions.get_client("sagemaker", "eu-west-1")
+
+    sessions.configure(max_pool_connections=5, retry_mode="standard", max_attempts=3)
+    config = sessions.get_client("sagemaker", "eu-west-1").meta.config
+    sessions.configure()
+
+    assert sessions.get_client("sagemaker", "eu-west-1") is not client
+    assert config.max_pool_connections == 5
+    assert config.retries == {"mode": "standard", "total_max_attempts": 3}
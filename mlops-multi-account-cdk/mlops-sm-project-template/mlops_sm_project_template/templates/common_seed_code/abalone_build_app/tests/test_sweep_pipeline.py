@@ -0,0 +1,234 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import datetime
+import io
+import json
+
+import pytest
+
+from ml_pipelines import monitor_pipeline
+from ml_pipelines.sweep_pipeline import RateLimiter, comparison_table, expand_parameter_sets, flatten_metrics, run_sweep
+
+
+class FakeSageMakerClient:
+    """Runs every execution for four polls, failing the ones with an ml.t3.medium training instance."""
+
+    def __init__(self):
+        self.parameters = {}
+        self.polls = {}
+        self.running = 0
+        self.max_running = 0
+
+    def start_pipeline_execution(self, PipelineName, PipelineParameters, **kwargs):
+        arn = f"arn:aws:sagemaker:eu-west-1:123456789012:pipeline/{PipelineName}/execution/{len(self.parameters)}"
+        self.parameters[arn] = {p["Name"]: p["Value"] for p in PipelineParameters}
+        self.polls[arn] = 0
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        return {"PipelineExecutionArn": arn}
+
+    def describe_pipeline_execution(self, PipelineExecutionArn):
+        self.polls[PipelineExecutionArn] += 1
+        if self.polls[PipelineExecutionArn] < 4:
+            return {"PipelineExecutionStatus": "Executing"}
+        self.running -= 1
+        failed = self.parameters[PipelineExecutionArn]["TrainingInstanceType"] == "ml.t3.medium"
+        return {"PipelineExecutionStatus": "Failed" if failed else "Succeeded"}
+
+    def get_paginator(self, operation_name):
+        class Paginator:
+            def paginate(self, PipelineExecutionArn, SortOrder):
+                execution_id = PipelineExecutionArn.split("/")[-1]
+                yield {
+                    "PipelineExecutionSteps": [
+                        {
+                            "StepName": "Train",
+                            "StepStatus": "Succeeded",
+                            "Metadata": {"TrainingJob": {"Arn": f"arn:training-job/train-{execution_id}"}},
+                        },
+                        {
+                            "StepName": "Evaluate",
+                            "StepStatus": "Succeeded",
+                            "Metadata": {"ProcessingJob": {"Arn": f"arn:processing-job/eval-{execution_id}"}},
+                        },
+                    ]
+                }
+
+        return Paginator()
+
+    def describe_training_job(self, TrainingJobName):
+        arn = next(arn for arn in self.parameters if arn.endswith(f"/{TrainingJobName.split('-')[-1]}"))
+        instance_type = self.parameters[arn]["TrainingInstanceType"]
+        return {"BillableTimeInSeconds": 1800, "ResourceConfig": {"InstanceType": instance_type, "InstanceCount": 2}}
+
+    def describe_processing_job(self, ProcessingJobName):
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        return {
+            "ProcessingStartTime": start,
+            "ProcessingEndTime": start + datetime.timedelta(minutes=30),
+            "ProcessingResources": {"ClusterConfig": {"InstanceType": "ml.m5.large", "InstanceCount": 1}},
+            "ProcessingOutputConfig": {
+                "Outputs": [{"OutputName": "evaluation", "S3Output": {"S3Uri": f"s3://bucket/{ProcessingJobName}/"}}]
+            },
+        }
+
+
+class FakeS3Client:
+    def get_object(self, Bucket, Key):
+        mse = 2.0 if "eval-0" in Key else 3.0
+        return {"Body": io.BytesIO(json.dumps({"regression_metrics": {"mse": {"value": mse}}, "ok": True}).encode())}
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    delays = []
+    yield_control = asyncio.sleep
+
+    async def sleep(delay):
+        delays.append(delay)
+        await yield_control(0)
+
+    monkeypatch.setattr(monitor_pipeline.asyncio, "sleep", sleep)
+    return delays
+
+
+def test_grid_combinations_come_before_the_parameter_sets():
+    parameter_sets = expand_parameter_sets(
+        {"TrainingInstanceType": ["ml.m5.xlarge", "ml.c5.xlarge"], "ProcessingInstanceCount": [1, 2]},
+        [{"TrainingInstanceType": "ml.g4dn.xlarge"}],
+    )
+
+    assert parameter_sets == [
+        {"TrainingInstanceType": "ml.m5.xlarge", "ProcessingInstanceCount": 1},
+        {"TrainingInstanceType": "ml.m5.xlarge", "ProcessingInstanceCount": 2},
+        {"TrainingInstanceType": "ml.c5.xlarge", "ProcessingInstanceCount": 1},
+        {"TrainingInstanceType": "ml.c5.xlarge", "ProcessingInstanceCount": 2},
+        {"TrainingInstanceType": "ml.g4dn.xlarge"},
+    ]
+
+
+def test_only_numeric_metrics_are_kept():
+    assert flatten_metrics({"regression_metrics": {"mse": {"value": 2.0, "standard_deviation": 1}}, "ok": True}) == {
+        "regression_metrics.mse.value": 2.0,
+        "regression_metrics.mse.standard_deviation": 1,
+    }
+
+
+def test_rate_limiter_spaces_out_the_calls(delays):
+    async def calls():
+        limiter = RateLimiter(0.5)
+        for _ in range(3):
+            await limiter.wait()
+
+    asyncio.run(calls())
+
+    # delays until 2 and 4 seconds after the first call, as the fake sleep returns right away
+    assert delays == [pytest.approx(2, abs=0.1), pytest.approx(4, abs=0.1)]
+
+
+def test_sweep_compares_the_cost_and_metrics_of_the_executions(delays):
+    client = FakeSageMakerClient()
+    parameter_sets = expand_parameter_sets({"TrainingInstanceType": ["ml.m5.xlarge", "ml.t3.medium", "ml.c5.xlarge"]})
+
+    results = asyncio.run(
+        run_sweep(
+            client,
+            FakeS3Client(),
+            "pipeline",
+            parameter_sets,
+            max_concurrent_executions=2,
+            starts_per_second=0.5,
+            prices={"ml.m5.xlarge": 0.23, "ml.m5.large": 0.115},
+            min_delay=1,
+            log=lambda message: None,
+        )
+    )
+
+    assert client.max_running == 2
+    assert comparison_table(results) == [
+        ["TrainingInstanceType", "status", "instance_hours", "cost", "regression_metrics.mse.value"],
+        ["ml.m5.xlarge", "Succeeded", "1.5", "0.2875", "2.0"],
+        ["ml.t3.medium", "Failed", "1.5", "", "3.0"],
+        ["ml.c5.xlarge", "Succeeded", "1.5", "", "3.0"],
+    ]
+
+
+class CachingSageMakerClient(FakeSageMakerClient):
+    """Reuses the preprocessing of the first execution in the others."""
+
+    def get_paginator(self, operation_name):
+        paginator = super().get_paginator(operation_name)
+
+        class Paginator:
+            def paginate(self, PipelineExecutionArn, SortOrder):
+                for page in paginator.paginate(PipelineExecutionArn, SortOrder):
+                    step = {
+                        "StepName": "Preprocess",
+                        "StepStatus": "Succeeded",
+                        "Metadata": {"ProcessingJob": {"Arn": "arn:processing-job/preprocess-0"}},
+                    }
+                    if not PipelineExecutionArn.endswith("/0"):
+                        step["CacheHitResult"] = {"SourcePipelineExecutionArn": PipelineExecutionArn[:-1] + "0"}
+                    page["PipelineExecutionSteps"].insert(0, step)
+                    yield page
+
+        return Paginator()
+
+
+class ListingS3Client(FakeS3Client):
+    def get_paginator(self, operation_name):
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {"Contents": [{"Key": f"{Prefix}/data.csv", "ETag": f'"{Bucket}"'}]}
+
+        return Paginator()
+
+
+def test_sweep_sets_the_input_etags_and_does_not_charge_cache_hits(delays):
+    client = CachingSageMakerClient()
+    definition = {
+        "Parameters": [
+            {"Name": "InputDataUrl", "Type": "String", "DefaultValue": "s3://bucket-a/abalone"},
+            {"Name": "InputDataETags", "Type": "String", "DefaultValue": ""},
+            {"Name": "TrainingInstanceType", "Type": "String", "DefaultValue": "ml.m5.xlarge"},
+        ]
+    }
+    parameter_sets = [
+        {"TrainingInstanceType": "ml.m5.xlarge"},
+        {"TrainingInstanceType": "ml.m5.xlarge", "InputDataUrl": "s3://bucket-b/abalone"},
+    ]
+
+    results = asyncio.run(
+        run_sweep(
+            client,
+            ListingS3Client(),
+            "pipeline",
+            parameter_sets,
+            definition=definition,
+            min_delay=1,
+            log=lambda message: None,
+        )
+    )
+
+    etags = [parameters["InputDataETags"] for parameters in client.parameters.values()]
+    assert len(set(etags)) == 2 and all(etags)
+    # the parameters of the results are the ones of the sweep
+    assert [result["parameters"] for result in results] == parameter_sets
+    # 1 hour of training and 0.5 hour of evaluation, plus 0.5 hour of preprocessing for the first execution
+    assert [result["instance_hours"] for result in results] == [2.0, 1.5]
@@ -0,0 +1,178 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import csv
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+from ml_pipelines.telemetry import collect_execution_telemetry, format_step_table, get_step_dependencies, to_csv, to_emf
+
+EXECUTION_ARN = "arn:aws:sagemaker:eu-west-1:123456789012:pipeline/abalone/execution/abc123"
+T0 = datetime(2024, 1, 31, 10, 0, tzinfo=timezone.utc)
+
+DEFINITION = {
+    "Steps": [
+        {"Name": "Preprocess", "Type": "Processing", "Arguments": {}},
+        {"Name": "Baseline", "Type": "Processing", "Arguments": {}},
+        {
+            "Name": "Train",
+            "Type": "Training",
+            "Arguments": {"S3Uri": {"Get": "Steps.Preprocess.ProcessingOutputConfig.Outputs['train'].S3Output.S3Uri"}},
+        },
+        {
+            "Name": "Evaluate",
+            "Type": "Processing",
+            "DependsOn": ["Baseline"],
+            "Arguments": {"S3Uri": {"Get": "Steps.Train.ModelArtifacts.S3ModelArtifacts"}},
+        },
+        {
+            "Name": "Check",
+            "Type": "Condition",
+            "Arguments": {
+                "Conditions": [
+                    {"LeftValue": {"Std:JsonGet": {"PropertyFile": {"Get": "Steps.Evaluate.PropertyFiles.E"}}}}
+                ],
+                "IfSteps": [
+                    {
+                        "Name": "Register",
+                        "Type": "RegisterModel",
+                        "Arguments": {"ModelDataUrl": {"Get": "Steps.Train.ModelArtifacts.S3ModelArtifacts"}},
+                    }
+                ],
+                "ElseSteps": [],
+            },
+        },
+    ]
+}
+CACHE_HIT = {"CacheHitResult": {"SourcePipelineExecutionArn": "arn:previous"}}
+
+
+def minutes(start, end):
+    return T0 + timedelta(minutes=start), T0 + timedelta(minutes=end)
+
+
+class FakeSageMakerClient:
+    def __init__(self):
+        self.described = []
+
+    def describe_pipeline_execution(self, PipelineExecutionArn):
+        return {
+            "PipelineArn": "arn:aws:sagemaker:eu-west-1:123456789012:pipeline/abalone",
+            "PipelineExecutionStatus": "Succeeded",
+            "CreationTime": T0,
+            "LastModifiedTime": T0 + timedelta(minutes=40),
+        }
+
+    def describe_pipeline_definition_for_execution(self, PipelineExecutionArn):
+        return {"PipelineDefinition": json.dumps(DEFINITION)}
+
+    def get_paginator(self, operation_name):
+        steps = []
+        for name, (start, end), metadata, extra in [
+            ("Preprocess", minutes(0, 10), {"ProcessingJob": {"Arn": "arn:processing-job/preprocess"}}, {}),
+            ("Baseline", minutes(0, 30), {"ProcessingJob": {"Arn": "arn:processing-job/old"}}, CACHE_HIT),
+            ("Train", minutes(10, 25), {"TrainingJob": {"Arn": "arn:training-job/train"}}, {"AttemptCount": 2}),
+            ("Evaluate", minutes(30, 35), {"ProcessingJob": {"Arn": "arn:processing-job/evaluate"}}, {}),
+            ("Check", minutes(35, 35), {"Condition": {"Outcome": "True"}}, {}),
+            ("Register", minutes(35, 36), {"RegisterModel": {"Arn": "arn:model-package/1"}}, {}),
+        ]:
+            step = {"StepName": name, "StepStatus": "Succeeded", "StartTime": start, "EndTime": end}
+            steps.append(dict(step, Metadata=metadata, **extra))
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                return [{"PipelineExecutionSteps": steps}]
+
+        return Paginator()
+
+    def describe_processing_job(self, ProcessingJobName):
+        self.described.append(ProcessingJobName)
+        return {
+            "ProcessingResources": {"ClusterConfig": {"InstanceType": "ml.m5.xlarge", "InstanceCount": 1}},
+            "ProcessingStartTime": T0 + timedelta(minutes=3) if ProcessingJobName == "preprocess" else T0,
+        }
+
+    def describe_training_job(self, TrainingJobName):
+        self.described.append(TrainingJobName)
+        return {
+            "ResourceConfig": {"InstanceType": "ml.c5.xlarge", "InstanceCount": 2},
+            "TrainingStartTime": T0 + timedelta(minutes=12),
+        }
+
+
+def test_dependencies_include_property_references_and_condition_steps():
+    assert get_step_dependencies(DEFINITION) == {
+        "Preprocess": [],
+        "Baseline": [],
+        "Train": ["Preprocess"],
+        "Evaluate": ["Baseline", "Train"],
+        "Check": ["Evaluate"],
+        "Register": ["Check", "Train"],
+    }
+
+
+def test_collects_step_timings_instances_and_the_critical_path():
+    client = FakeSageMakerClient()
+
+    telemetry = collect_execution_telemetry(client, EXECUTION_ARN)
+
+    steps = {step["step_name"]: step for step in telemetry["steps"]}
+    assert telemetry["pipeline_name"] == "abalone"
+    assert telemetry["duration_seconds"] == 2400
+    assert (steps["Preprocess"]["duration_seconds"], steps["Preprocess"]["queue_seconds"]) == (600, 180)
+    assert steps["Train"]["queue_seconds"] == 120
+    assert (steps["Train"]["instance_type"], steps["Train"]["instance_count"], steps["Train"]["attempts"]) == (
+        "ml.c5.xlarge",
+        2,
+        2,
+    )
+    assert steps["Baseline"]["cache_hit"] and steps["Baseline"]["queue_seconds"] is None
+    assert steps["Register"]["step_type"] == "RegisterModel" and steps["Register"]["instance_type"] is None
+    # Evaluate waited for the cached Baseline step, which ended after Train
+    assert telemetry["critical_path"] == ["Baseline", "Evaluate", "Check", "Register"]
+    assert telemetry["critical_path_seconds"] == 2160
+    assert [step["critical"] for step in telemetry["steps"]] == [False, True, False, True, True, True]
+    assert steps["Register"]["start_time"] == "2024-01-31T10:35:00+00:00"
+    assert sorted(client.described) == ["evaluate", "old", "preprocess", "train"]
+
+    table = format_step_table(telemetry).splitlines()
+    assert table[0].split() == ["STEP", "STATUS", "DURATION", "QUEUE", "INSTANCES", "ATTEMPTS", "CACHE", "HIT"]
+    assert table[3].split() == ["Train", "Succeeded", "900s", "120s", "2", "x", "ml.c5.xlarge", "2", "no"]
+    assert table[-1] == "Critical path (2160s): Baseline -> Evaluate -> Check -> Register"
+
+
+def test_csv_and_emf_exports():
+    telemetry = collect_execution_telemetry(FakeSageMakerClient(), EXECUTION_ARN)
+
+    rows = list(csv.DictReader(io.StringIO(to_csv(telemetry))))
+    assert [row["step_name"] for row in rows] == ["Preprocess", "Baseline", "Train", "Evaluate", "Check", "Register"]
+    assert rows[3]["depends_on"] == "Baseline Train"
+
+    documents = [json.loads(document) for document in to_emf(telemetry, "Tests")]
+    assert len(documents) == 7
+    check = documents[4]
+    assert check["_aws"]["Timestamp"] == int((T0 + timedelta(minutes=40)).timestamp() * 1000)
+    assert check["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["PipelineName", "StepName"]]
+    # the condition step runs no job, so it has no queue time
+    assert [metric["Name"] for metric in check["_aws"]["CloudWatchMetrics"][0]["Metrics"]] == [
+        "StepDuration",
+        "StepAttempts",
+        "StepCacheHit",
+    ]
+    assert (check["StepName"], check["StepDuration"], check["StepAttempts"]) == ("Check", 0, 1)
+    assert documents[-1]["CriticalPathDuration"] == 2160
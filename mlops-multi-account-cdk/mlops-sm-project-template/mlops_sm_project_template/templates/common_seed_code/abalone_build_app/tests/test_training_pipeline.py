@@ -0,0 +1,68 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+
+import botocore.client
+import pytest
+
+from ml_pipelines.training.pipeline import get_pipeline
+
+KWARGS = dict(
+    region="eu-west-1",
+    role="arn:aws:iam::123456789012:role/role",
+    default_bucket="bucket",
+    model_package_group_name="group",
+    pipeline_name="pipeline",
+    base_job_prefix="prefix",
+    project_id="project",
+)
+
+
+@pytest.fixture
+def offline(monkeypatch, tmp_path):
+    """Answers the AWS calls made while rendering, without uploading anything."""
+
+    def make_api_call(client, operation_name, params):
+        if operation_name == "DescribeImageVersion":
+            error = {"Error": {"Code": "ResourceNotFound", "Message": "not found"}}
+            raise client.exceptions.ResourceNotFound(error, operation_name)
+        if operation_name == "GetCallerIdentity":
+            return {"Account": "123456789012"}
+        if operation_name == "ListBuckets":
+            return {"Buckets": [{"Name": "bucket"}]}
+        return {}
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "x")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "x")
+    monkeypatch.setenv("ML_PIPELINES_IMAGE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(botocore.client.BaseClient, "_make_api_call", make_api_call)
+
+
+def step_arguments(**kwargs):
+    definition = json.loads(get_pipeline(**KWARGS, **kwargs).definition())
+    return {step["Name"]: step["Arguments"] for step in definition["Steps"]}
+
+
+@pytest.mark.parametrize("sharded_preprocessing", [False, True])
+def test_renders_the_same_step_arguments_every_time(offline, sharded_preprocessing):
+    first = step_arguments(cache_expire_after="P30D", sharded_preprocessing=sharded_preprocessing)
+    second = step_arguments(cache_expire_after="P30D", sharded_preprocessing=sharded_preprocessing)
+
+    assert first == second
+    outputs = first["PreprocessAbaloneData"]["ProcessingOutputConfig"]["Outputs"]
+    assert "Execution.PipelineExecutionId" not in json.dumps(outputs)
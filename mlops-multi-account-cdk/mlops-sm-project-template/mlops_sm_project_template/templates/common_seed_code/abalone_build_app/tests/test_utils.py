@@ -0,0 +1,183 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+
+import boto3
+from botocore.stub import Stubber
+
+from ml_pipelines._utils import (
+    FINGERPRINT_PREFIX,
+    find_execution_with_fingerprint,
+    get_definition_cache_key,
+    get_pipeline_fingerprint,
+    list_definition_inputs,
+)
+
+DEFINITION = {
+    "Parameters": [
+        {"Name": "InputDataUrl", "Type": "String", "DefaultValue": "s3://bucket/dataset/abalone-dataset.csv"},
+        {"Name": "ProcessingInstanceCount", "Type": "Integer", "DefaultValue": 1},
+    ],
+    "Steps": [{"Name": "Evaluate", "Arguments": {"S3Uri": "s3://bucket/script-eval-2024-01-31-10-20-30-123/output"}}],
+}
+
+
+def s3_client(etag, calls=1):
+    client = boto3.client("s3", region_name="eu-west-1", aws_access_key_id="x", aws_secret_access_key="x")
+    stubber = Stubber(client)
+    for _ in range(calls):
+        stubber.add_response(
+            "list_objects_v2",
+            {
+                "Contents": [
+                    {"Key": "dataset/abalone-dataset.csv", "ETag": etag},
+                    {"Key": "dataset/abalone-dataset.csv.bak", "ETag": '"other"'},
+                ]
+            },
+            {"Bucket": "bucket", "Prefix": "dataset/abalone-dataset.csv"},
+        )
+    stubber.activate()
+    return client
+
+
+def source_dir(tmp_path, content):
+    (tmp_path / "preprocessing").mkdir(exist_ok=True)
+    (tmp_path / "preprocessing" / "main.py").write_text(content)
+    return str(tmp_path)
+
+
+def test_fingerprint_ignores_job_name_timestamps(tmp_path):
+    rerendered = {
+        "Parameters": DEFINITION["Parameters"],
+        "Steps": [{"Name": "Evaluate", "Arguments": {"S3Uri": "s3://bucket/script-eval-2024-02-01-08-00-00-7/output"}}],
+    }
+    source = source_dir(tmp_path, "print(1)")
+
+    assert get_pipeline_fingerprint(DEFINITION, source, s3_client('"a"')) == get_pipeline_fingerprint(
+        rerendered, source, s3_client('"a"')
+    )
+
+
+def test_fingerprint_changes_with_scripts_data_and_parameters(tmp_path):
+    fingerprint = get_pipeline_fingerprint(DEFINITION, source_dir(tmp_path, "print(1)"), s3_client('"a"'))
+
+    assert fingerprint != get_pipeline_fingerprint(DEFINITION, source_dir(tmp_path, "print(2)"), s3_client('"a"'))
+    assert fingerprint != get_pipeline_fingerprint(DEFINITION, source_dir(tmp_path, "print(1)"), s3_client('"b"'))
+    assert fingerprint != get_pipeline_fingerprint(
+        DEFINITION, source_dir(tmp_path, "print(1)"), s3_client('"a"'), {"ProcessingInstanceCount": 2}
+    )
+
+
+def test_finds_the_last_successful_execution_with_the_fingerprint():
+    client = boto3.client("sagemaker", region_name="eu-west-1", aws_access_key_id="x", aws_secret_access_key="x")
+    stubber = Stubber(client)
+    summaries = [
+        ("arn:3", "Failed", "abc"),
+        ("arn:2", "Succeeded", "def"),
+        ("arn:1", "Succeeded", "abc"),
+    ]
+    stubber.add_response(
+        "list_pipeline_executions",
+        {
+            "PipelineExecutionSummaries": [
+                {
+                    "PipelineExecutionArn": arn,
+                    "PipelineExecutionStatus": status,
+                    "PipelineExecutionDescription": f"{FINGERPRINT_PREFIX}{fingerprint}",
+                }
+                for arn, status, fingerprint in summaries
+            ]
+        },
+        {"PipelineName": "pipeline", "SortBy": "CreationTime", "SortOrder": "Descending", "MaxResults": 50},
+    )
+    stubber.add_client_error("list_pipeline_executions", "ResourceNotFound")
+    stubber.activate()
+
+    assert find_execution_with_fingerprint(client, "pipeline", "abc")["PipelineExecutionArn"] == "arn:1"
+    assert find_execution_with_fingerprint(client, "missing", "abc") is None
+
+
+def test_searches_the_most_recent_executions_only():
+    client = boto3.client("sagemaker", region_name="eu-west-1", aws_access_key_id="x", aws_secret_access_key="x")
+    stubber = Stubber(client)
+    pages = [["arn:4", "arn:3"], ["arn:2", "arn:1"]]
+    for arns in [pages[0]] + pages:
+        stubber.add_response(
+            "list_pipeline_executions",
+            {
+                "PipelineExecutionSummaries": [
+                    {
+                        "PipelineExecutionArn": arn,
+                        "PipelineExecutionStatus": "Succeeded",
+                        "PipelineExecutionDescription": f"{FINGERPRINT_PREFIX}{'abc' if arn == 'arn:1' else 'def'}",
+                    }
+                    for arn in arns
+                ],
+                "NextToken": "next",
+            },
+        )
+    stubber.activate()
+
+    assert find_execution_with_fingerprint(client, "pipeline", "abc", max_executions=2) is None
+    assert find_execution_with_fingerprint(client, "pipeline", "abc", max_executions=4)["PipelineExecutionArn"] == "arn:1"
+    stubber.assert_no_pending_responses()
+
+
+def test_definition_cache_key_changes_with_arguments_and_scripts(tmp_path):
+    key = get_definition_cache_key(
+        "ml_pipelines.training.pipeline", '{"region": "eu-west-1"}', source_dir(tmp_path, "1")
+    )
+
+    assert key == get_definition_cache_key("ml_pipelines.training.pipeline", "{'region':'eu-west-1'}", str(tmp_path))
+    assert key != get_definition_cache_key("ml_pipelines.training.pipeline", '{"region": "us-east-1"}', str(tmp_path))
+    assert key != get_definition_cache_key(
+        "ml_pipelines.training.pipeline", '{"region": "eu-west-1"}', source_dir(tmp_path, "2")
+    )
+
+
+def test_definition_cache_key_changes_with_image_uris(tmp_path, monkeypatch):
+    monkeypatch.setenv("ML_PIPELINES_IMAGE_CACHE_DIR", str(tmp_path / "images"))
+    cache_file = tmp_path / "images" / "eu-west-1" / "pid.json"
+    cache_file.parent.mkdir(parents=True)
+    cache_file.write_text(json.dumps({"xgboost": {"uri": "image:1", "resolved_at": 1}}))
+    key = get_definition_cache_key("ml_pipelines.training.pipeline", "{}", str(tmp_path / "scripts"))
+
+    cache_file.write_text(json.dumps({"xgboost": {"uri": "image:1", "resolved_at": 2}}))
+    assert key == get_definition_cache_key("ml_pipelines.training.pipeline", "{}", str(tmp_path / "scripts"))
+    cache_file.write_text(json.dumps({"xgboost": {"uri": "image:2", "resolved_at": 3}}))
+    assert key != get_definition_cache_key("ml_pipelines.training.pipeline", "{}", str(tmp_path / "scripts"))
+
+
+def test_lists_the_input_data_of_the_definition():
+    definition = {
+        "Steps": [
+            {
+                "Arguments": {
+                    "ProcessingInputs": [
+                        {"S3Input": {"S3Uri": "s3://bucket/input/"}},
+                        {"S3Input": {"S3Uri": {"Get": "Parameters.InputDataUrl"}}},
+                    ]
+                }
+            },
+            {"Arguments": {"InputDataConfig": [{"DataSource": {"S3DataSource": {"S3Uri": "s3://bucket/train/"}}}]}},
+            {"Arguments": {"TransformInput": {"DataSource": {"S3DataSource": {"S3Uri": "s3://bucket/input/"}}}}},
+            {"Arguments": {}},
+        ]
+    }
+
+    assert list_definition_inputs(definition) == ["s3://bucket/input/", "s3://bucket/train/"]
@@ -0,0 +1,71 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import pytest
+
+from deploy_endpoint.model_registry import ModelRegistryIndex, NoApprovedModelPackageError
+
+
+class FakeSageMakerClient:
+    """Serves pages of approved model packages by group, and counts the calls."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.list_calls = []
+
+    def list_model_packages(self, **kwargs):
+        self.list_calls.append(kwargs)
+        pages = self.pages[kwargs["ModelPackageGroupName"]]
+        page = int(kwargs.get("NextToken", 0))
+        response = {"ModelPackageSummaryList": pages[page]}
+        if page + 1 < len(pages):
+            response["NextToken"] = str(page + 1)
+        return response
+
+
+def test_lists_newest_first_and_stops_at_the_first_approved_package():
+    client = FakeSageMakerClient(
+        {"group": [[], [{"ModelPackageArn": "arn/group/3"}], [{"ModelPackageArn": "arn/group/1"}]]}
+    )
+    registry = ModelRegistryIndex(client)
+
+    packages = registry.latest_approved_packages(["group", "group"])
+    registry.latest_approved_package("group")
+
+    assert packages == {"group": {"ModelPackageArn": "arn/group/3"}}
+    assert len(client.list_calls) == 2
+    assert client.list_calls[0]["SortOrder"] == "Descending"
+
+
+def test_raises_when_a_group_has_no_approved_package():
+    registry = ModelRegistryIndex(FakeSageMakerClient({"empty": [[]]}))
+
+    with pytest.raises(NoApprovedModelPackageError):
+        registry.latest_approved_package("empty")
+
+
+def test_resolves_every_group():
+    client = FakeSageMakerClient(
+        {"group-a": [[{"ModelPackageArn": "arn/group-a/2"}]], "group-b": [[{"ModelPackageArn": "arn/group-b/5"}]]}
+    )
+
+    packages = ModelRegistryIndex(client).latest_approved_packages(["group-a", "group-b"])
+
+    assert {name: package["ModelPackageArn"] for name, package in packages.items()} == {
+        "group-a": "arn/group-a/2",
+        "group-b": "arn/group-b/5",
+    }
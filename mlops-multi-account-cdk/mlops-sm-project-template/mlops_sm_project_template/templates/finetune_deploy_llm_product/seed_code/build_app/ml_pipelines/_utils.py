@@ -45,6 +45,8 @@
 from __future__ import absolute_import
 
 import ast
+import hashlib
+import os
 
 
 def get_pipeline_driver(module_name, passed_args=None):
@@ -89,3 +91,41 @@ def get_pipeline_custom_tags(module_name, args, tags):
     except Exception as e:
         print(f"Error getting project tags: {e}")
     return tags
+
+
+def hash_directory(path):
+    """Hashes the relative paths and contents of the files under a directory
+
+    Args:
+        path (str): directory to hash, compiled Python files are ignored
+
+    Returns:
+        hex digest of the directory content
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if name.endswith(".pyc"):
+                continue
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode())
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def list_s3_etags(s3_client, s3_uri):
+    """Lists the ETags of the objects of an S3 URI, which is either an object or a prefix
+
+    Returns:
+        list of (key, ETag) tuples
+    """
+    bucket, _, key = s3_uri[len("s3://") :].partition("/")
+    etags = []
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=key):
+        for obj in page.get("Contents", []):
+            if obj["Key"] == key or obj["Key"].startswith(key.rstrip("/") + "/"):
+                etags.append((obj["Key"], obj["ETag"]))
+    return etags
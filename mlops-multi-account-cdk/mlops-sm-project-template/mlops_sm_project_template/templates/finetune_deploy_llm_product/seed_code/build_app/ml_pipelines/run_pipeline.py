@@ -23,6 +23,7 @@ import json
 import sys
 
 from ml_pipelines._utils import get_pipeline_driver, convert_struct, get_pipeline_custom_tags
+from ml_pipelines.caching import count_cache_hits
 
 
 def main():  # pragma: no cover
@@ -101,7 +102,10 @@ def main():  # pragma: no cover
         execution.wait(delay=delay_seconds, max_attempts=max_attempts)
         print("\n#####Execution completed. Execution step details:")
 
-        print(execution.list_steps())
+        steps = execution.list_steps()
+        print(steps)
+        cache_hits, cache_misses = count_cache_hits(steps)
+        print(f"\n###### Steps reused from the cache: {cache_hits}/{cache_hits + cache_misses}")
     except Exception as e:  # pylint: disable=W0703
         print(f"Exception: {e}")
         sys.exit(1)
@@ -11,7 +11,6 @@ Implements a get_pipeline(**kwargs) method.
 
 import logging
 
-import boto3
 import sagemaker
 import sagemaker.session
 from sagemaker.huggingface import (
@@ -36,7 +35,14 @@ from sagemaker.workflow.pipeline import Pipeline
 from sagemaker.workflow.pipeline_context import PipelineSession
 from sagemaker.workflow.properties import PropertyFile
 from sagemaker.workflow.steps import ProcessingStep, TrainingStep
-# from sagemaker.workflow.steps import CacheConfig # Enable to debug specific steps if previous steps were succesful
+from ml_pipelines.caching import (
+    CACHE_KEY_ENV,
+    DEFAULT_EXPIRE_AFTER,
+    compute_cache_key,
+    get_cache_config,
+    stage_source_dir,
+)
+from ml_pipelines.sessions import get_boto_session, get_client
 
 
 logging.basicConfig(level=logging.INFO)
@@ -55,9 +61,7 @@ def get_sagemaker_client(region):
     Returns:
         `sagemaker.session.Session instance
     """
-    boto_session = boto3.Session(region_name=region)
-    sagemaker_client = boto_session.client("sagemaker")
-    return sagemaker_client
+    return get_client("sagemaker", region)
 
 
 def get_session(region, default_bucket):
@@ -71,10 +75,10 @@ def get_session(region, default_bucket):
         `sagemaker.session.Session instance
     """
 
-    boto_session = boto3.Session(region_name=region)
+    boto_session = get_boto_session(region)
 
-    sagemaker_client = boto_session.client("sagemaker")
-    runtime_client = boto_session.client("sagemaker-runtime")
+    sagemaker_client = get_client("sagemaker", region)
+    runtime_client = get_client("sagemaker-runtime", region)
     return sagemaker.session.Session(
         boto_session=boto_session,
         sagemaker_client=sagemaker_client,
@@ -94,8 +98,8 @@ def get_pipeline_session(region, default_bucket):
         PipelineSession instance
     """
 
-    boto_session = boto3.Session(region_name=region)
-    sagemaker_client = boto_session.client("sagemaker")
+    boto_session = get_boto_session(region)
+    sagemaker_client = get_client("sagemaker", region)
 
     return PipelineSession(
         boto_session=boto_session,
@@ -134,6 +138,7 @@ def get_pipeline(
     transformers_version="4.28.1",
     pytorch_version="2.0.0",
     py_version="py310",
+    cache_expire_after=DEFAULT_EXPIRE_AFTER,
 ):
     """Gets a SageMaker ML Pipeline instance to fine-tune LLMs with HuggingFace scripts.
 
@@ -152,7 +157,9 @@ def get_pipeline(
         transformers_version: hugging face transformers package version
         pytorch_version: PyTorch version to use
         py_version: Python version to use
-
+        cache_expire_after: ISO 8601 duration the results of the processing and training steps
+            are reused for by later executions with the same code and hyperparameters, so that
+            fixing the evaluation does not fine-tune the model again, caching is disabled if empty
 
     Returns:
         an instance of a pipeline
@@ -194,7 +201,18 @@ def get_pipeline(
     # If set to True, a small data sample will be selected to speed up pipeline execution.
     dry_run = ParameterString(name="DryRun", default_value="True")
 
-    # cache_config = CacheConfig(enable_caching=True, expire_after="P1D") # Enable to debug specific steps if previous steps were succesful
+    # The steps are cached, keyed on their code and hyperparameters. Every step only uploads its own
+    # files from SCRIPTS_DIR_PATH, so that changing the code of a step does not invalidate the others.
+    cache_config = get_cache_config(cache_expire_after)
+    preprocessing_source_dir = stage_source_dir(
+        SCRIPTS_DIR_PATH, ["preprocess.py", "data_processing.py", "requirements.txt"]
+    )
+    training_source_dir = stage_source_dir(
+        SCRIPTS_DIR_PATH, ["train.py", "data_processing.py", "requirements.txt"]
+    )
+    evaluation_source_dir = stage_source_dir(
+        SCRIPTS_DIR_PATH, ["evaluate.py", "requirements.txt"]
+    )
 
     ########################################## PREPROCESSING STEP #################################################
 
@@ -208,6 +226,11 @@ def get_pipeline(
         sagemaker_session=pipeline_session,
         role=role,
         output_kms_key=bucket_kms_id,
+        env=(
+            {CACHE_KEY_ENV: compute_cache_key(source_dir=preprocessing_source_dir)}
+            if cache_config
+            else None
+        ),
     )
 
     step_args = hf_data_processor.run(
@@ -216,7 +239,7 @@ def get_pipeline(
             ProcessingOutput(output_name="test", source="/opt/ml/processing/test"),
         ],
         code="preprocess.py",
-        source_dir=SCRIPTS_DIR_PATH,
+        source_dir=preprocessing_source_dir,
         arguments=[
             "--dataset_name",
             hf_dataset_name,
@@ -228,7 +251,7 @@ def get_pipeline(
     step_process = ProcessingStep(
         name="LoadPreprocessSplitDataset",
         step_args=step_args,
-        # cache_config=cache_config, # Enable to debug specific steps if previous steps were succesful
+        cache_config=cache_config,
     )
 
     ########################################## TRAINING STEP #######################################################
@@ -243,7 +266,7 @@ def get_pipeline(
 
     huggingface_estimator = HuggingFace(
         entry_point="train.py",  # train script
-        source_dir=SCRIPTS_DIR_PATH,  # directory which includes all the files needed for training
+        source_dir=training_source_dir,  # directory which includes all the files needed for training
         instance_type=training_instance_type,  # instances type used for the training job
         instance_count=1,  # the number of instances used for training
         base_job_name=f"{base_job_prefix}/training",  # the name of the training job
@@ -255,8 +278,17 @@ def get_pipeline(
         hyperparameters=hyperparameters,  # the hyperparameters passed to the training job
         sagemaker_session=pipeline_session,
         environment={
-            "HUGGINGFACE_HUB_CACHE": "/tmp/.cache"
-        },  # set env variable to cache models in /tmp
+            "HUGGINGFACE_HUB_CACHE": "/tmp/.cache",  # set env variable to cache models in /tmp
+            **(
+                {
+                    CACHE_KEY_ENV: compute_cache_key(
+                        source_dir=training_source_dir, hyperparameters=hyperparameters
+                    )
+                }
+                if cache_config
+                else {}
+            ),
+        },
         keepAlivePeriod=600,
         output_kms_key=bucket_kms_id,
     )
@@ -274,7 +306,7 @@ def get_pipeline(
     step_train = TrainingStep(
         name="FinetuneLLMSQLModel",
         step_args=step_args,
-        # cache_config=cache_config, # Enable to debug specific steps if previous steps were succesful
+        cache_config=cache_config,
     )
 
     ########################################## Evaluation Step ##########################################################
@@ -289,6 +321,11 @@ def get_pipeline(
         base_job_name=f"{base_job_prefix}/evaluation",
         sagemaker_session=pipeline_session,
         output_kms_key=bucket_kms_id,
+        env=(
+            {CACHE_KEY_ENV: compute_cache_key(source_dir=evaluation_source_dir)}
+            if cache_config
+            else None
+        ),
     )
 
     # The evaluate.py defines several parameters as input args. We are only passing the --dry-run parameter here as an example.
@@ -296,7 +333,7 @@ def get_pipeline(
     # --dry-run parameter.
     step_args = hf_evaluator.run(
         code="evaluate.py",
-        source_dir=SCRIPTS_DIR_PATH,
+        source_dir=evaluation_source_dir,
         arguments=[
             "--dry_run",
             dry_run,
@@ -331,7 +368,7 @@ def get_pipeline(
         name="EvaluateSQLModel",
         step_args=step_args,
         property_files=[evaluation_report],
-        # cache_config=cache_config, # Enable to debug specific steps if previous steps were succesful
+        cache_config=cache_config,
     )
 
     # ########################################## MODEL CREATION & REGISTRATION STEP ######################################
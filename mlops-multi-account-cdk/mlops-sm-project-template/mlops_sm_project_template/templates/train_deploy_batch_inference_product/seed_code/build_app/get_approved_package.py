@@ -22,10 +22,13 @@ import logging
 import boto3
 from botocore.exceptions import ClientError
 
+from model_registry import ModelRegistryIndex, NoApprovedModelPackageError
+
 logger = logging.getLogger(__name__)
 
 """Initialise boto3 SDK resources"""
 sm_client = boto3.client("sagemaker")
+model_registry = ModelRegistryIndex(sm_client)
 
 
 def get_approved_package(model_package_group_name):
@@ -34,34 +37,11 @@ def get_approved_package(model_package_group_name):
         The SageMaker Model Package ARN.
     """
     try:
-        # Get the latest approved model package
-        response = sm_client.list_model_packages(
-            ModelPackageGroupName=model_package_group_name,
-            ModelApprovalStatus="Approved",
-            SortBy="CreationTime",
-            MaxResults=100,
-        )
-        approved_packages = response["ModelPackageSummaryList"]
-        # Fetch more packages if none returned with continuation token
-        while len(approved_packages) == 0 and "NextToken" in response:
-            logger.debug(f"Getting more packages for token: {response['NextToken']}")
-            response = sm_client.list_model_packages(
-                ModelPackageGroupName=model_package_group_name,
-                ModelApprovalStatus="Approved",
-                SortBy="CreationTime",
-                MaxResults=100,
-                NextToken=response["NextToken"],
-            )
-            approved_packages.extend(response["ModelPackageSummaryList"])
-        # Return error if no packages found
-        if len(approved_packages) == 0:
-            error_message = f"No approved ModelPackage found for ModelPackageGroup: {model_package_group_name}"
-            logger.error(error_message)
-            raise Exception(error_message)
-        # Return the pmodel package arn
-        model_package_arn = approved_packages[0]["ModelPackageArn"]
-        logger.info(f"Identified the latest approved model package: {model_package_arn}")
-        return model_package_arn
+        # Get the latest approved model package, newest first
+        return model_registry.latest_approved_package(model_package_group_name)["ModelPackageArn"]
+    except NoApprovedModelPackageError as e:
+        logger.error(str(e))
+        raise
     except ClientError as e:
         error_message = e.response["Error"]["Message"]
         logger.error(error_message)
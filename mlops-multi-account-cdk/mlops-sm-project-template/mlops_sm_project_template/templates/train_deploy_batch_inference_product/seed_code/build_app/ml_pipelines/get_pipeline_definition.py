@@ -20,15 +20,37 @@
 from __future__ import absolute_import
 
 import argparse
+import json
+import os
 import sys
+import time
 
-from ml_pipelines._utils import get_pipeline_driver
+from ml_pipelines._utils import (
+    convert_struct,
+    get_definition_cache_key,
+    get_pipeline_driver,
+    list_definition_inputs,
+    list_input_etags,
+)
+
+
+def list_definition_etags(content, region=None):
+    """Lists the ETags of the input data of a rendered definition, see list_definition_inputs."""
+    uris = list_definition_inputs(json.loads(content))
+    if not uris:
+        return {}
+    from ml_pipelines.sessions import get_client  # pylint: disable=C0415
+
+    return json.loads(json.dumps(list_input_etags(get_client("s3", region), {uri: uri for uri in uris})))
 
 
 def main():  # pragma: no cover
     """The main harness that gets the pipeline definition JSON.
 
-    Prints the json to stdout or saves to file.
+    Prints the json to stdout or saves to file. With --cache-dir, a definition rendered less than
+    --cache-ttl seconds ago from the same pipeline code, source scripts, arguments and image URIs is
+    returned without importing the pipeline module and the SageMaker SDK, as long as the ETags of its
+    input data, which the cache keys of its steps cover, did not change.
     """
     parser = argparse.ArgumentParser("Gets the pipeline definition for the pipeline script.")
 
@@ -54,6 +76,22 @@ def main():  # pragma: no cover
         default=None,
         help="Dict string of keyword arguments for the pipeline generation (if supported)",
     )
+    parser.add_argument(
+        "-cache-dir",
+        "--cache-dir",
+        dest="cache_dir",
+        type=str,
+        default=None,
+        help="The directory to cache the rendered pipeline definitions in, no caching if not set.",
+    )
+    parser.add_argument(
+        "-cache-ttl",
+        "--cache-ttl",
+        dest="cache_ttl",
+        type=int,
+        default=3600,
+        help="The time in seconds a cached pipeline definition is reused for.",
+    )
     args = parser.parse_args()
 
     if args.module_name is None:
@@ -61,8 +99,31 @@ def main():  # pragma: no cover
         sys.exit(2)
 
     try:
-        pipeline = get_pipeline_driver(args.module_name, args.kwargs)
-        content = pipeline.definition()
+        content = None
+        if args.cache_dir:
+            cache_key = get_definition_cache_key(args.module_name, args.kwargs)
+            cache_path = os.path.join(args.cache_dir, f"{cache_key}.json")
+            etags_path = os.path.join(args.cache_dir, f"{cache_key}.etags.json")
+            region = convert_struct(args.kwargs).get("region")
+            if (
+                os.path.exists(cache_path)
+                and os.path.exists(etags_path)
+                and time.time() - os.path.getmtime(cache_path) < args.cache_ttl
+            ):
+                with open(cache_path) as f:
+                    content = f.read()
+                with open(etags_path) as f:
+                    if json.load(f) != list_definition_etags(content, region):
+                        content = None
+        if content is None:
+            pipeline = get_pipeline_driver(args.module_name, args.kwargs)
+            content = pipeline.definition()
+            if args.cache_dir:
+                os.makedirs(args.cache_dir, exist_ok=True)
+                with open(cache_path, "w") as f:
+                    f.write(content)
+                with open(etags_path, "w") as f:
+                    json.dump(list_definition_etags(content, region), f)
         if args.file_name:
             with open(args.file_name, "w") as f:
                 f.write(content)
@@ -0,0 +1,191 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Resolves SageMaker image URIs with an on-disk cache, and a CLI to pre-warm that cache."""
+from __future__ import absolute_import
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import tempfile
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ml_pipelines", "image_uris")
+DEFAULT_TTL = 3600
+
+# Images built for a project by the image build pipelines, see get_pipeline.
+DEFAULT_IMAGE_NAMES = [
+    "sagemaker-{project_id}-processingimagebuild",
+    "sagemaker-{project_id}-trainingimagebuild",
+    "sagemaker-{project_id}-inferenceimagebuild",
+]
+
+
+def get_cache_dir(cache_dir=None):
+    """Returns the directory of the image URI cache, ML_PIPELINES_IMAGE_CACHE_DIR or ~/.cache/ml_pipelines/image_uris."""
+    return cache_dir or os.environ.get("ML_PIPELINES_IMAGE_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+def list_cached_image_uris(cache_dir=None):
+    """Lists the image URIs of the cache, without when they were resolved.
+
+    Returns:
+        dict of the image URI of every image name, by region and project, None for the images which do not exist
+    """
+    cache_dir = get_cache_dir(cache_dir)
+    image_uris = {}
+    for region in sorted(os.listdir(cache_dir)) if os.path.isdir(cache_dir) else []:
+        for file_name in sorted(os.listdir(os.path.join(cache_dir, region))):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(cache_dir, region, file_name)) as f:
+                    cache = json.load(f)
+            except (OSError, ValueError):
+                continue
+            image_uris.setdefault(region, {})[file_name[: -len(".json")]] = {
+                name: entry.get("uri") for name, entry in sorted(cache.items())
+            }
+    return image_uris
+
+
+class ImageUriResolver:
+    """Resolves the container image of SageMaker images, caching the results on disk.
+
+    Results are cached in memory and in a JSON file per region and project, for ttl seconds, so
+    that rendering pipeline definitions does not call DescribeImageVersion every time. Images that
+    do not exist are cached too, as None.
+
+    Args:
+        sagemaker_client: boto3 SageMaker client
+        region: AWS region of the images
+        project_id: SageMaker project the images belong to
+        cache_dir: directory of the cache files, ML_PIPELINES_IMAGE_CACHE_DIR or ~/.cache/ml_pipelines/image_uris
+        ttl: time to live of the cached image URIs in seconds, ML_PIPELINES_IMAGE_CACHE_TTL or one hour
+    """
+
+    def __init__(self, sagemaker_client, region, project_id, cache_dir=None, ttl=None):
+        self.sagemaker_client = sagemaker_client
+        cache_dir = get_cache_dir(cache_dir)
+        self.ttl = ttl if ttl is not None else int(os.environ.get("ML_PIPELINES_IMAGE_CACHE_TTL", DEFAULT_TTL))
+        self.cache_path = os.path.join(cache_dir, region, f"{project_id}.json")
+        self._cache = None
+
+    def _load(self):
+        if self._cache is None:
+            try:
+                with open(self.cache_path) as f:
+                    self._cache = json.load(f)
+            except (OSError, ValueError):
+                self._cache = {}
+        return self._cache
+
+    def _save(self):
+        directory = os.path.dirname(self.cache_path)
+        os.makedirs(directory, exist_ok=True)
+        # written to a temporary file first, so that concurrent renders never read a partial file
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+            json.dump(self._cache, f, indent=2)
+        os.replace(f.name, self.cache_path)
+
+    def _describe(self, image_name):
+        try:
+            return self.sagemaker_client.describe_image_version(ImageName=image_name)["ContainerImage"]
+        except self.sagemaker_client.exceptions.ResourceNotFound:
+            return None
+
+    def resolve(self, image_names, default=None, refresh=False):
+        """Resolves the container image of several SageMaker images.
+
+        The images missing from the cache, or whose cache entry expired, are described concurrently.
+
+        Args:
+            image_names: names of the SageMaker images
+            default: image URI returned for the images which do not exist
+            refresh: describe every image, ignoring the cache
+
+        Returns:
+            dict of the container image URI of every image name
+        """
+        cache = self._load()
+        now = time.time()
+        missing = [
+            name for name in image_names if refresh or now - cache.get(name, {}).get("resolved_at", 0) >= self.ttl
+        ]
+        if missing:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(missing)) as pool:
+                for name, uri in zip(missing, pool.map(self._describe, missing)):
+                    cache[name] = {"uri": uri, "resolved_at": now}
+            self._save()
+        return {name: cache[name]["uri"] or default for name in image_names}
+
+    def prewarm(self, image_names):
+        """Describes the images and stores them in the cache, whatever the state of the cache."""
+        return self.resolve(image_names, refresh=True)
+
+
+def main():  # pragma: no cover
+    """The main harness that pre-warms the image URI cache of projects."""
+    parser = argparse.ArgumentParser("Pre-warms the image URI cache used to render the pipelines of projects.")
+
+    parser.add_argument(
+        "-region",
+        "--region",
+        dest="region",
+        type=str,
+        default=None,
+        help="The AWS region of the images, the default region of the session if not set.",
+    )
+    parser.add_argument(
+        "-project-ids",
+        "--project-ids",
+        dest="project_ids",
+        nargs="+",
+        help="The ids of the SageMaker projects.",
+    )
+    parser.add_argument(
+        "-image-names",
+        "--image-names",
+        dest="image_names",
+        nargs="+",
+        default=DEFAULT_IMAGE_NAMES,
+        help="The names of the images of each project, where {project_id} is replaced by the project id.",
+    )
+    args = parser.parse_args()
+
+    if not args.project_ids:
+        parser.print_help()
+        sys.exit(2)
+
+    from ml_pipelines.sessions import get_boto_session, get_client  # pylint: disable=C0415
+
+    try:
+        region = get_boto_session(args.region).region_name
+        sagemaker_client = get_client("sagemaker", region)
+        for project_id in args.project_ids:
+            image_names = [name.format(project_id=project_id) for name in args.image_names]
+            resolver = ImageUriResolver(sagemaker_client, region, project_id)
+            print(json.dumps(resolver.prewarm(image_names), indent=2))
+    except Exception as e:  # pylint: disable=W0703
+        print(f"Exception: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Picks the batching settings of the batch transform step from the inference data and a calibration run.
+
+With the MultiRecord strategy, the transform job sends mini-batches of up to MaxPayloadInMB of
+records in every request to the container, and up to MaxConcurrentTransforms requests at the same
+time to every instance, rather than one request per record.
+"""
+from __future__ import absolute_import
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import math
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# SageMaker limit of MaxPayloadInMB, and of MaxPayloadInMB * MaxConcurrentTransforms.
+MAX_PAYLOAD_MB = 100
+DEFAULT_RECORDS_PER_REQUEST = 5000
+DEFAULT_SAMPLE_MB = 20
+
+# Pipeline parameters of the transform step, and their default values.
+DEFAULT_TRANSFORM_SETTINGS = {
+    "TransformStrategy": "MultiRecord",
+    "TransformMaxPayloadInMB": 6,
+    "TransformMaxConcurrentTransforms": 16,
+}
+
+
+def _split_s3_uri(uri):
+    bucket, _, key = uri[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def read_sample(s3_client, data_uri, sample_bytes=DEFAULT_SAMPLE_MB * MB):
+    """Reads the first records of the inference data.
+
+    Args:
+        s3_client: boto3 S3 client
+        data_uri: S3 URI of a CSV file or of a prefix of CSV files, one record per line
+        sample_bytes: number of bytes read from the first file
+
+    Returns:
+        list of the records read, as bytes, without the partial last record
+    """
+    bucket, prefix = _split_s3_uri(data_uri)
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            if item["Size"] == 0:
+                continue
+            body = s3_client.get_object(Bucket=bucket, Key=item["Key"], Range=f"bytes=0-{sample_bytes - 1}")["Body"]
+            lines = body.read().splitlines()
+            if item["Size"] > sample_bytes:
+                lines = lines[:-1]
+            return [line for line in lines if line]
+    raise ValueError(f"No data found under {data_uri}")
+
+
+def measure_records(records):
+    """Gets the number of records and their mean and maximum size in bytes, line ending included."""
+    sizes = [len(record) + 1 for record in records]
+    return {"records": len(sizes), "mean_bytes": sum(sizes) / len(sizes), "max_bytes": max(sizes)}
+
+
+def get_instance_vcpus(ec2_client, instance_type):
+    """Gets the number of vCPUs of a SageMaker instance type from its EC2 counterpart, None if unknown."""
+    try:
+        response = ec2_client.describe_instance_types(InstanceTypes=[instance_type.replace("ml.", "", 1)])
+        return response["InstanceTypes"][0]["VCpuInfo"]["DefaultVCpus"]
+    except Exception as e:  # pylint: disable=W0703
+        logger.warning(f"Could not get the vCPUs of {instance_type}: {e}")
+        return None
+
+
+def recommend_settings(max_record_bytes, vcpus=None, records_per_request=DEFAULT_RECORDS_PER_REQUEST):
+    """Derives the transform settings from the record size and the capacity of the instances.
+
+    The payload fits records_per_request of the largest records, and the number of concurrent
+    requests matches the vCPUs of the instance, one per model server worker, within the limit of
+    MAX_PAYLOAD_MB in flight per instance.
+
+    Args:
+        max_record_bytes: size of the largest record, in bytes
+        vcpus: number of vCPUs of the transform instance type, 1 if unknown
+        records_per_request: number of records to send in every request
+
+    Returns:
+        dict of the transform step pipeline parameters
+    """
+    payload = min(MAX_PAYLOAD_MB, max(1, math.ceil(records_per_request * max_record_bytes / MB)))
+    concurrency = max(1, min(vcpus or 1, MAX_PAYLOAD_MB // payload))
+    return {
+        "TransformStrategy": "MultiRecord",
+        "TransformMaxPayloadInMB": payload,
+        "TransformMaxConcurrentTransforms": concurrency,
+    }
+
+
+def candidate_settings(recommended):
+    """Lists the settings tried by the calibration run: the recommended ones, larger payloads and more concurrency."""
+    payload = recommended["TransformMaxPayloadInMB"]
+    concurrency = recommended["TransformMaxConcurrentTransforms"]
+    candidates = []
+    for candidate_payload, candidate_concurrency in [
+        (payload, concurrency),
+        (payload, concurrency * 2),
+        (payload * 4, concurrency),
+        (1, concurrency),
+    ]:
+        candidate_payload = min(candidate_payload, MAX_PAYLOAD_MB)
+        candidate_concurrency = max(1, min(candidate_concurrency, MAX_PAYLOAD_MB // candidate_payload))
+        candidate = dict(
+            recommended,
+            TransformMaxPayloadInMB=candidate_payload,
+            TransformMaxConcurrentTransforms=candidate_concurrency,
+        )
+        if candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+
+def _run_transform_job(sagemaker_client, job_name, model_name, settings, input_uri, output_uri, instance_type):
+    """Runs a transform job with the settings and returns its run time on the instances, None if it failed."""
+    sagemaker_client.create_transform_job(
+        TransformJobName=job_name,
+        ModelName=model_name,
+        BatchStrategy=settings["TransformStrategy"],
+        MaxPayloadInMB=settings["TransformMaxPayloadInMB"],
+        MaxConcurrentTransforms=settings["TransformMaxConcurrentTransforms"],
+        TransformInput={
+            "DataSource": {"S3DataSource": {"S3DataType": "S3Prefix", "S3Uri": input_uri}},
+            "ContentType": "text/csv",
+            "SplitType": "Line",
+        },
+        TransformOutput={"S3OutputPath": f"{output_uri}/{job_name}", "AssembleWith": "Line"},
+        TransformResources={"InstanceType": instance_type, "InstanceCount": 1},
+    )
+    sagemaker_client.get_waiter("transform_job_completed_or_stopped").wait(
+        TransformJobName=job_name, WaiterConfig={"Delay": 30, "MaxAttempts": 120}
+    )
+    job = sagemaker_client.describe_transform_job(TransformJobName=job_name)
+    if job["TransformJobStatus"] != "Completed":
+        logger.warning(f"Calibration job {job_name} {job['TransformJobStatus']}: {job.get('FailureReason', '')}")
+        return None
+    return (job["TransformEndTime"] - job["TransformStartTime"]).total_seconds()
+
+
+def run_calibration(
+    sagemaker_client, s3_client, model_package_arn, role_arn, records, candidates, output_uri, instance_type
+):
+    """Scores a sample of the records with every candidate setting, in concurrent transform jobs.
+
+    Args:
+        sagemaker_client: boto3 SageMaker client
+        s3_client: boto3 S3 client
+        model_package_arn: ARN of the model package to score the records with
+        role_arn: ARN of the role of the calibration model
+        records: records of the sample, see read_sample
+        candidates: transform settings to try, see candidate_settings
+        output_uri: S3 URI prefix of the sample and of the outputs of the calibration jobs
+        instance_type: instance type of the transform jobs
+
+    Returns:
+        list of the candidates, with the seconds their job ran for and the records scored per second,
+        None for the jobs which failed
+    """
+    output_uri = output_uri.rstrip("/")
+    bucket, prefix = _split_s3_uri(output_uri)
+    s3_client.put_object(Bucket=bucket, Key=f"{prefix}/input/sample.csv", Body=b"\n".join(records) + b"\n")
+
+    model_name = f"transform-calibration-{int(time.time())}"
+    sagemaker_client.create_model(
+        ModelName=model_name, ExecutionRoleArn=role_arn, PrimaryContainer={"ModelPackageName": model_package_arn}
+    )
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+            durations = list(
+                pool.map(
+                    lambda i: _run_transform_job(
+                        sagemaker_client,
+                        f"{model_name}-{i}",
+                        model_name,
+                        candidates[i],
+                        f"{output_uri}/input/",
+                        output_uri,
+                        instance_type,
+                    ),
+                    range(len(candidates)),
+                )
+            )
+    finally:
+        sagemaker_client.delete_model(ModelName=model_name)
+
+    return [
+        dict(
+            candidate,
+            seconds=seconds,
+            records_per_second=round(len(records) / seconds, 1) if seconds else None,
+        )
+        for candidate, seconds in zip(candidates, durations)
+    ]
+
+
+def pick_best(results):
+    """Picks the transform settings of the calibration result which scored the most records per second."""
+    completed = [result for result in results if result["records_per_second"]]
+    if not completed:
+        raise ValueError("None of the calibration jobs completed")
+    best = max(completed, key=lambda result: result["records_per_second"])
+    return {name: best[name] for name in DEFAULT_TRANSFORM_SETTINGS}
+
+
+def main():  # pragma: no cover
+    """The main harness that prints the transform step pipeline parameters picked for the data.
+
+    The settings are printed as a JSON dict of pipeline parameters, to be merged into the
+    --pipeline-inputs of run-pipeline. Progress is logged to stderr.
+    """
+    parser = argparse.ArgumentParser("Picks the batching settings of the batch transform step for the data.")
+
+    parser.add_argument(
+        "-data-uri",
+        "--data-uri",
+        dest="data_uri",
+        type=str,
+        help="S3 URI of the preprocessed inference data, a CSV file or a prefix of CSV files.",
+    )
+    parser.add_argument(
+        "-instance-type",
+        "--instance-type",
+        dest="instance_type",
+        type=str,
+        default="ml.m5.large",
+        help="The instance type of the transform step.",
+    )
+    parser.add_argument(
+        "-model-package-arn",
+        "--model-package-arn",
+        dest="model_package_arn",
+        type=str,
+        default=None,
+        help="The model package of the calibration run, the settings are only estimated without it.",
+    )
+    parser.add_argument(
+        "-role-arn",
+        "--role-arn",
+        dest="role_arn",
+        type=str,
+        default=None,
+        help="The role of the calibration model.",
+    )
+    parser.add_argument(
+        "-output-uri",
+        "--output-uri",
+        dest="output_uri",
+        type=str,
+        default=None,
+        help="S3 URI prefix of the sample and of the outputs of the calibration run.",
+    )
+    parser.add_argument(
+        "-sample-mb",
+        "--sample-mb",
+        dest="sample_mb",
+        type=int,
+        default=DEFAULT_SAMPLE_MB,
+        help="Size of the sample of the data, in MB.",
+    )
+    parser.add_argument(
+        "-records-per-request",
+        "--records-per-request",
+        dest="records_per_request",
+        type=int,
+        default=DEFAULT_RECORDS_PER_REQUEST,
+        help="Number of records to send in every request to the container.",
+    )
+    parser.add_argument(
+        "-region",
+        "--region",
+        dest="region",
+        type=str,
+        default=None,
+        help="The AWS region, the default region of the session if not set.",
+    )
+    args = parser.parse_args()
+
+    if args.data_uri is None or (args.model_package_arn and not (args.role_arn and args.output_uri)):
+        parser.print_help()
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+
+    from ml_pipelines.sessions import get_client  # pylint: disable=C0415
+
+    try:
+        records = read_sample(get_client("s3", args.region), args.data_uri, args.sample_mb * MB)
+        sizes = measure_records(records)
+        vcpus = get_instance_vcpus(get_client("ec2", args.region), args.instance_type)
+        logger.info(f"{sizes['records']} records of {sizes['mean_bytes']:.0f} bytes on average, {vcpus} vCPUs")
+        settings = recommend_settings(sizes["max_bytes"], vcpus, args.records_per_request)
+        if args.model_package_arn:
+            results = run_calibration(
+                get_client("sagemaker", args.region),
+                get_client("s3", args.region),
+                args.model_package_arn,
+                args.role_arn,
+                records,
+                candidate_settings(settings),
+                args.output_uri,
+                args.instance_type,
+            )
+            for result in results:
+                logger.info(json.dumps(result))
+            settings = pick_best(results)
+        print(json.dumps(settings))
+    except Exception as e:  # pylint: disable=W0703
+        logger.error(f"Exception: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
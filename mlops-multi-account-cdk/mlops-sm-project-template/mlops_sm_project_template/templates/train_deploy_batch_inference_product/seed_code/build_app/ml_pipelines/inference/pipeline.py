@@ -19,13 +19,25 @@
 
     Create Model -> Transform Job
 
+With in_process_scoring, inputs of up to InProcessScoringMaxRows rows are scored by the preprocessing
+step itself, which saves creating a model and provisioning the transform instances:
+
+    Preprocess and score if small -> Condition (transform?) -> Create Model -> Transform Job
+
+In incremental mode, only the input partitions which were not scored yet are preprocessed and scored:
+
+    Preprocess new partitions -> Condition (transform?) -> Create Model -> Transform Job -> Commit manifest
+
+With postprocessing, the predictions are joined with the keys of their input rows into partitioned Parquet:
+
+    ... -> Transform Job -> Merge predictions
+
 Implements a get_pipeline(**kwargs) method.
 """
 
 import os
 import time
 
-import boto3
 import logging
 import sagemaker
 import sagemaker.session
@@ -36,21 +48,34 @@ from sagemaker.transformer import Transformer
 from sagemaker.sklearn.processing import SKLearnProcessor
 from sagemaker.processing import (
     ProcessingInput,
-    ProcessingOutput
+    ProcessingOutput,
+    ScriptProcessor
 )
+from sagemaker.workflow.condition_step import ConditionStep
+from sagemaker.workflow.conditions import ConditionEquals, ConditionGreaterThan
 from sagemaker.workflow.execution_variables import ExecutionVariables
-from sagemaker.workflow.functions import Join
+from sagemaker.workflow.functions import Join, JsonGet
 from sagemaker.workflow.model_step import ModelStep
 from sagemaker.workflow.steps import ProcessingStep, TransformStep
 from sagemaker.workflow.parameters import ParameterInteger, ParameterString
 from sagemaker.workflow.pipeline import Pipeline
 from sagemaker.workflow.pipeline_context import PipelineSession
+from sagemaker.workflow.properties import PropertyFile
 from sagemaker.workflow.retry import (
     StepRetryPolicy, 
     StepExceptionTypeEnum,
     SageMakerJobExceptionTypeEnum,
     SageMakerJobStepRetryPolicy
 )
+from ml_pipelines.caching import (
+    CACHE_KEY_ENV,
+    compute_cache_key,
+    get_cache_config,
+    get_input_etags_parameter,
+    get_output_destination,
+)
+from ml_pipelines.inference.calibration import DEFAULT_TRANSFORM_SETTINGS
+from ml_pipelines.sessions import get_boto_session, get_client
 
 # BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -66,9 +91,7 @@ def get_sagemaker_client(region):
     Returns:
         `sagemaker.session.Session instance
     """
-    boto_session = boto3.Session(region_name=region)
-    sagemaker_client = boto_session.client("sagemaker")
-    return sagemaker_client
+    return get_client("sagemaker", region)
 
 
 def get_session(region, default_bucket):
@@ -82,10 +105,10 @@ def get_session(region, default_bucket):
         `sagemaker.session.Session instance
     """
 
-    boto_session = boto3.Session(region_name=region)
+    boto_session = get_boto_session(region)
 
-    sagemaker_client = boto_session.client("sagemaker")
-    runtime_client = boto_session.client("sagemaker-runtime")
+    sagemaker_client = get_client("sagemaker", region)
+    runtime_client = get_client("sagemaker-runtime", region)
     return sagemaker.session.Session(
         boto_session=boto_session,
         sagemaker_client=sagemaker_client,
@@ -104,8 +127,8 @@ def get_pipeline_session(region, default_bucket):
         PipelineSession instance
     """
 
-    boto_session = boto3.Session(region_name=region)
-    sagemaker_client = boto_session.client("sagemaker")
+    boto_session = get_boto_session(region)
+    sagemaker_client = get_client("sagemaker", region)
 
     return PipelineSession(
         boto_session=boto_session,
@@ -132,6 +155,10 @@ def get_pipeline(
     pipeline_name,
     base_job_prefix,
     model_package_arn,
+    cache_expire_after="",
+    incremental=False,
+    in_process_scoring=False,
+    postprocess=False,
     **kwargs
 ):
     """Gets a SageMaker ML Pipeline instance working with the data.
@@ -140,13 +167,32 @@ def get_pipeline(
         region: AWS region to create and run the pipeline.
         role: IAM role to create and run steps and pipeline.
         artifact_bucket: the bucket to use for storing the artifacts
+        cache_expire_after: ISO 8601 duration the results of the preprocessing step are reused for
+            by later executions with the same input data and code, caching is disabled if empty, the
+            default: the step is keyed on the InputDataETags parameter, which only run-pipeline sets,
+            and the definition deployed by the deploy app is started without it
+        incremental: InputDataUrl is a prefix of partition files, and only the partitions which the
+            manifest in the outputs bucket does not record as scored with the model package are scored,
+            with the preprocessor fitted at training time, in the image of the model package
+        in_process_scoring: opt in to scoring inputs of up to InProcessScoringMaxRows rows in the
+            preprocessing step, which then runs in the image of the model package and is not cached,
+            disabled by default
+        postprocess: merge the predictions, joined with the source file and row number of their input rows, into
+            Parquet partitioned by source file, with summary statistics
 
     Returns:
         an instance of a pipeline
     """
-    
-    # For debugging
-    # cache_config = CacheConfig(enable_caching=True, expire_after="1d")
+
+    if isinstance(incremental, str):
+        incremental = incremental == "True"
+    if isinstance(in_process_scoring, str):
+        in_process_scoring = in_process_scoring == "True"
+    if isinstance(postprocess, str):
+        postprocess = postprocess == "True"
+    # the preprocessing step is cached if enabled, keyed on the ETags of its input data and its code, but not in
+    # incremental mode where its output also depends on the manifest, nor when it scores the data
+    cache_config = None if incremental or in_process_scoring else get_cache_config(cache_expire_after)
 
     pipeline_session = get_pipeline_session(region, artifact_bucket)
 
@@ -161,6 +207,11 @@ def get_pipeline(
         name="ProcessingInstanceCount",
         default_value=1
     )
+    # rows per chunk for the streaming preprocessing mode, 0 keeps the whole dataset in memory
+    preprocessing_chunk_size = ParameterInteger(
+        name="PreprocessingChunkSize",
+        default_value=0
+    )
     transform_instance_type = ParameterString(
         name="TransformInstanceType",
         default_value="ml.m5.large"
@@ -169,6 +220,21 @@ def get_pipeline(
         name="TransformInstanceCount",
         default_value=1
     )
+    # MultiRecord sends mini-batches of up to TransformMaxPayloadInMB of records per request, rather
+    # than one request per record, see ml_pipelines/inference/calibration.py to pick the values
+    transform_strategy = ParameterString(
+        name="TransformStrategy",
+        default_value=DEFAULT_TRANSFORM_SETTINGS["TransformStrategy"],
+        enum_values=["MultiRecord", "SingleRecord"],
+    )
+    transform_max_payload = ParameterInteger(
+        name="TransformMaxPayloadInMB",
+        default_value=DEFAULT_TRANSFORM_SETTINGS["TransformMaxPayloadInMB"]
+    )
+    transform_max_concurrent_transforms = ParameterInteger(
+        name="TransformMaxConcurrentTransforms",
+        default_value=DEFAULT_TRANSFORM_SETTINGS["TransformMaxConcurrentTransforms"]
+    )
 
     input_data = ParameterString(
         name="InputDataUrl",
@@ -178,6 +244,11 @@ def get_pipeline(
     outputs_bucket = ParameterString(
         name="OutputsBucket"
     )
+    # inputs of up to this many rows are scored in the preprocessing step, 0 always runs the transform job
+    in_process_max_rows = ParameterInteger(
+        name="InProcessScoringMaxRows",
+        default_value=10000
+    )
 
     # Retry policies
     # https://docs.aws.amazon.com/sagemaker/latest/dg/pipelines-retry-policy.html
@@ -228,44 +299,114 @@ def get_pipeline(
     )
     
     # Processing step for feature engineering
-    sklearn_processor = SKLearnProcessor(
-        framework_version='0.20.0',
+    preprocessing_key = compute_cache_key(
+        get_client("s3", region), "source_scripts/preprocessing/prepare_abalone_data", inputs=[input_data]
+    )
+    processor_kwargs = dict(
         instance_type=processing_instance_type,
         instance_count=processing_instance_count,
         base_job_name=f"{base_job_prefix}/sklearn-abalone-preprocess",
         sagemaker_session=pipeline_session,
         role=role,
+        env={CACHE_KEY_ENV: preprocessing_key} if cache_config else None,
     )
+    if incremental or in_process_scoring or postprocess:
+        # the image of the model package has the xgboost version the model was trained with, and
+        # pandas and pyarrow to run the preprocessing and postprocessing scripts
+        model_container = get_sagemaker_client(region).describe_model_package(
+            ModelPackageName=model_package_arn
+        )["InferenceSpecification"]["Containers"][0]
+    # the preprocessor fitted at training time, which incremental mode reuses, is unpickled with the
+    # scikit-learn version of the XGBoost image it was fitted in
+    if incremental or in_process_scoring:
+        sklearn_processor = ScriptProcessor(
+            image_uri=model_container["Image"], command=["python3"], **processor_kwargs
+        )
+    else:
+        sklearn_processor = SKLearnProcessor(framework_version='0.20.0', **processor_kwargs)
+
+    # Predictions of the execution, written by the transform job or the preprocessing step
+    output_transform = Join(on='/', values=['s3:/', outputs_bucket, base_job_prefix, ExecutionVariables.PIPELINE_EXECUTION_ID, "batch/"])
+    def cached_output(output_name):
+        # written under the cache key when cached rather than under the execution, see get_output_destination
+        destination = None
+        if cache_config:
+            destination = get_output_destination(
+                f"s3://{pipeline_session.default_bucket()}/{base_job_prefix}/PreprocessAbaloneData",
+                output_name,
+                preprocessing_key,
+                [processing_instance_count, preprocessing_chunk_size, transform_instance_count],
+            )
+        return ProcessingOutput(
+            output_name=output_name, source=f"/opt/ml/processing/{output_name}", destination=destination
+        )
+
+    processing_outputs = [cached_output("output_data")]
+    job_arguments = [
+        "--input-data", input_data,
+        "--do-train-test-split", "False",
+        "--chunk-size", preprocessing_chunk_size.to_string(),
+        # one part file per transform instance, see the transform step
+        "--num-parts", transform_instance_count.to_string(),
+    ]
+    property_files = []
+    if incremental:
+        # partitions scored, with their ETag and model package, see source_scripts/preprocessing
+        manifest_url = Join(on='/', values=['s3:/', outputs_bucket, base_job_prefix, "inference-manifest.json"])
+        pending_partitions = PropertyFile(name="PendingPartitions", output_name="manifest", path="pending.json")
+        processing_outputs.append(ProcessingOutput(output_name="manifest", source="/opt/ml/processing/manifest"))
+        job_arguments += [
+            "--manifest-url", manifest_url,
+            "--model-package-arn", model_package_arn,
+            "--execution-id", ExecutionVariables.PIPELINE_EXECUTION_ID,
+        ]
+        property_files.append(pending_partitions)
+    if in_process_scoring:
+        # "none" when there is nothing to score, "in-process" when it was scored, else "transform"
+        scoring_route = PropertyFile(name="ScoringRoute", output_name="routing", path="routing.json")
+        processing_outputs.append(ProcessingOutput(output_name="routing", source="/opt/ml/processing/routing"))
+        job_arguments += [
+            "--in-process-max-rows", in_process_max_rows.to_string(),
+            "--output-uri", output_transform,
+        ]
+        property_files.append(scoring_route)
+    if incremental or in_process_scoring:
+        # the model scoring in process, and the preprocessor fitted at training time packaged with it,
+        # see source_scripts/evaluate
+        job_arguments += ["--model-data-url", model_container["ModelDataUrl"]]
+    if postprocess:
+        # source file and row number of the rows of every output_data file, for MergePredictions
+        processing_outputs.append(cached_output("keys"))
+        job_arguments.append("--write-keys")
+
     step_process = ProcessingStep(
         name="PreprocessAbaloneData",
-        processor=sklearn_processor,
-        outputs=[
-            ProcessingOutput(output_name="output_data", source="/opt/ml/processing/output_data"),
-        ],
-        code="source_scripts/preprocessing/prepare_abalone_data/main.py",  # we must figure out this path to get it from step_source directory
-        job_arguments=[
-            "--input-data", input_data,
-            "--do-train-test-split", "False",
-        ],
+        step_args=sklearn_processor.run(
+            outputs=processing_outputs,
+            code="source_scripts/preprocessing/prepare_abalone_data/main.py",  # we must figure out this path to get it from step_source directory
+            arguments=job_arguments,
+        ),
+        property_files=property_files,
+        cache_config=cache_config,
     )
 
 
     # Define qgen transformer and TransformStep
-    output_transform = Join(on='/', values=['s3:/', outputs_bucket, base_job_prefix, ExecutionVariables.PIPELINE_EXECUTION_ID, "batch/"])
-
     transformer = Transformer(
         model_name=step_create_model.properties.ModelName,
         instance_count=transform_instance_count,
         instance_type=transform_instance_type,
-        max_concurrent_transforms=64,
-        max_payload=1,
-        strategy = 'SingleRecord',
+        max_concurrent_transforms=transform_max_concurrent_transforms,
+        max_payload=transform_max_payload,
+        strategy=transform_strategy,
         assemble_with = 'Line',
         output_path=output_transform,
     )
 
     input_path_transform_step=step_process.properties.ProcessingOutputConfig.Outputs["output_data"].S3Output.S3Uri
 
+    # Transform jobs spread the S3 objects under their input prefix over their instances, so the
+    # preprocessing step writes one part file of about the same size per transform instance
     step_transformer = TransformStep(
         name="Transformer",
         transformer=transformer,
@@ -275,9 +416,116 @@ def get_pipeline(
             split_type = 'Line'
         ),
         retry_policies=retry_policies,
-        # cache_config=cache_config
+        # not cached, its predictions are written under the prefix of every execution
     )
-    
+
+    transform_steps = [step_create_model, step_transformer]
+    if incremental:
+        # records the partitions as scored once the transform succeeded
+        commit_processor = SKLearnProcessor(
+            framework_version='0.20.0',
+            instance_type="ml.t3.medium",
+            instance_count=1,
+            base_job_name=f"{base_job_prefix}/sklearn-abalone-commit-manifest",
+            sagemaker_session=pipeline_session,
+            role=role,
+        )
+        step_commit = ProcessingStep(
+            name="CommitManifest",
+            processor=commit_processor,
+            inputs=[
+                ProcessingInput(
+                    source=step_process.properties.ProcessingOutputConfig.Outputs["manifest"].S3Output.S3Uri,
+                    destination="/opt/ml/processing/manifest",
+                ),
+            ],
+            code="source_scripts/preprocessing/prepare_abalone_data/main.py",
+            job_arguments=[
+                "--commit-manifest", "/opt/ml/processing/manifest/pending.json",
+                "--manifest-url", manifest_url,
+                "--execution-id", ExecutionVariables.PIPELINE_EXECUTION_ID,
+                "--output-uri", output_transform,
+            ],
+            depends_on=[step_transformer],
+        )
+        transform_steps.append(step_commit)
+
+    if postprocess:
+        # joins the predictions with the keys of their input rows, see source_scripts/postprocessing
+        merge_processor = ScriptProcessor(
+            image_uri=model_container["Image"],
+            command=["python3"],
+            instance_type=processing_instance_type,
+            instance_count=1,
+            base_job_name=f"{base_job_prefix}/abalone-merge-predictions",
+            sagemaker_session=pipeline_session,
+            role=role,
+        )
+        merge_step_args = dict(
+            processor=merge_processor,
+            inputs=[
+                ProcessingInput(
+                    source=step_process.properties.ProcessingOutputConfig.Outputs["keys"].S3Output.S3Uri,
+                    destination="/opt/ml/processing/keys",
+                ),
+                ProcessingInput(source=output_transform, destination="/opt/ml/processing/predictions"),
+            ],
+            outputs=[
+                ProcessingOutput(
+                    output_name="predictions",
+                    source="/opt/ml/processing/output",
+                    destination=Join(on='/', values=['s3:/', outputs_bucket, base_job_prefix, ExecutionVariables.PIPELINE_EXECUTION_ID, "parquet/"]),
+                ),
+                ProcessingOutput(
+                    output_name="summary",
+                    source="/opt/ml/processing/summary",
+                    destination=Join(on='/', values=['s3:/', outputs_bucket, base_job_prefix, ExecutionVariables.PIPELINE_EXECUTION_ID, "summary/"]),
+                ),
+            ],
+            code="source_scripts/postprocessing/merge_predictions/main.py",
+        )
+        step_merge = ProcessingStep(name="MergePredictions", depends_on=[step_transformer], **merge_step_args)
+        transform_steps.append(step_merge)
+
+    steps = [step_process] + transform_steps
+    if in_process_scoring or incremental:
+        if in_process_scoring:
+            condition = ConditionEquals(
+                left=JsonGet(step_name=step_process.name, property_file=scoring_route, json_path="route"),
+                right="transform",
+            )
+        else:
+            # nothing to create, score or record when every partition was already scored
+            condition = ConditionGreaterThan(
+                left=JsonGet(step_name=step_process.name, property_file=pending_partitions, json_path="count"),
+                right=0,
+            )
+        else_steps = []
+        if in_process_scoring and postprocess:
+            # a step after the condition step would not wait for its branches, so the predictions
+            # scored in process are merged by a step of their own
+            step_merge_in_process = ProcessingStep(name="MergeInProcessPredictions", **merge_step_args)
+            else_steps = [
+                ConditionStep(
+                    name="CheckScoredInProcess",
+                    conditions=[
+                        ConditionEquals(
+                            left=JsonGet(step_name=step_process.name, property_file=scoring_route, json_path="route"),
+                            right="in-process",
+                        ),
+                    ],
+                    if_steps=[step_merge_in_process],
+                    else_steps=[],
+                )
+            ]
+        step_condition = ConditionStep(
+            name="CheckScoringRoute",
+            conditions=[condition],
+            if_steps=transform_steps,
+            else_steps=else_steps,
+        )
+        steps = [step_process, step_condition]
+
     ############################################
     # Pipeline Definition
     ############################################
@@ -289,13 +537,15 @@ def get_pipeline(
             outputs_bucket,
             transform_instance_count,
             transform_instance_type,
+            transform_strategy,
+            transform_max_payload,
+            transform_max_concurrent_transforms,
             processing_instance_count,
             processing_instance_type,
-        ],
-        steps=[
-            step_create_model,
-            step_process,
-            step_transformer,
-        ],
+            preprocessing_chunk_size,
+            # set by run-pipeline, see compute_cache_key
+            get_input_etags_parameter(),
+        ] + ([in_process_max_rows] if in_process_scoring else []),
+        steps=steps,
     )
     return pipeline
@@ -0,0 +1,508 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""A CLI to run a pipeline locally, with a directory standing in for S3.
+
+The pipeline definition is rendered offline and its steps are run on this machine: processing scripts
+as local Python processes, training steps of the built-in XGBoost algorithm with the xgboost package,
+and condition, register and fail steps by the runner itself. Steps run in parallel as soon as the steps
+they depend on have completed.
+"""
+from __future__ import absolute_import
+
+import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import pickle
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+import time
+
+from ml_pipelines._utils import convert_struct, get_pipeline_driver
+
+logger = logging.getLogger(__name__)
+
+# Root of the paths processing scripts see inside their container.
+CONTAINER_ROOT = "/opt/ml"
+
+STEP_REFERENCE = re.compile(r"Steps\.([^.\]\[']+)")
+PROCESSING_OUTPUT = re.compile(r"Steps\.(.+)\.ProcessingOutputConfig\.Outputs\['(.+)'\]\.S3Output\.S3Uri")
+MODEL_ARTIFACTS = re.compile(r"Steps\.(.+)\.ModelArtifacts\.S3ModelArtifacts")
+TRAINING_JOB_NAME = re.compile(r"Steps\.(.+)\.TrainingJobName")
+PROPERTY_FILE = re.compile(r"Steps\.(.+)\.PropertyFiles\.(.+)")
+
+CONDITIONS = {
+    "Equals": lambda left, right: left == right,
+    "GreaterThan": lambda left, right: left > right,
+    "GreaterThanOrEqualTo": lambda left, right: left >= right,
+    "LessThan": lambda left, right: left < right,
+    "LessThanOrEqualTo": lambda left, right: left <= right,
+}
+
+
+class LocalPipelineError(Exception):
+    """Raised when a step of a local pipeline execution fails."""
+
+
+class LocalS3:
+    """Maps S3 URIs to a local directory, `s3://bucket/key` being stored under `root/bucket/key`."""
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root).absolute()
+
+    def path(self, uri):
+        """Returns the local path of an S3 URI."""
+        bucket, _, key = uri[len("s3://") :].partition("/")
+        return self.root / bucket / key
+
+    def list_files(self, uri):
+        """Lists the objects stored under an S3 URI, which is either an object or a prefix."""
+        path = self.path(uri)
+        if path.is_file():
+            return [path]
+        if not path.is_dir():
+            raise LocalPipelineError(f"Nothing found in the local S3 directory for {uri} ({path})")
+        return sorted(p for p in path.rglob("*") if p.is_file())
+
+    def download(self, uri, local_dir, shard=None):
+        """Copies the objects of an S3 URI to a local directory.
+
+        Args:
+            uri: S3 URI of an object or a prefix
+            local_dir: directory to copy the objects to
+            shard: optional tuple (index, count) keeping only every count-th object, as ShardedByS3Key does
+        """
+        path = self.path(uri)
+        files = self.list_files(uri)
+        if shard is not None:
+            index, count = shard
+            files = files[index::count]
+        for f in files:
+            target = pathlib.Path(local_dir) / (f.relative_to(path) if f != path else f.name)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(f, target)
+
+    def upload(self, local_dir, uri):
+        """Copies the content of a local directory under an S3 prefix, merging with existing objects."""
+        if pathlib.Path(local_dir).is_dir():
+            shutil.copytree(local_dir, self.path(uri), dirs_exist_ok=True)
+
+
+@contextlib.contextmanager
+def redirect_s3(local_s3):
+    """Redirects the boto3 S3 file transfers of this process to a LocalS3."""
+    from boto3.s3.transfer import S3Transfer
+
+    def download_file(self, bucket, key, filename, *args, **kwargs):
+        shutil.copyfile(local_s3.path(f"s3://{bucket}/{key}"), filename)
+
+    def upload_file(self, filename, bucket, key, *args, **kwargs):
+        target = local_s3.path(f"s3://{bucket}/{key}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(filename, target)
+
+    original = S3Transfer.download_file, S3Transfer.upload_file
+    S3Transfer.download_file, S3Transfer.upload_file = download_file, upload_file
+    try:
+        yield
+    finally:
+        S3Transfer.download_file, S3Transfer.upload_file = original
+
+
+@contextlib.contextmanager
+def offline_definition(local_s3):
+    """Lets a pipeline definition be rendered without an AWS account.
+
+    Code uploads go to the LocalS3, whose top-level folders are listed as the existing buckets and
+    files as their objects, and custom SageMaker images are reported as not found, so the pipeline
+    falls back to built-in image URIs, which local execution does not use.
+    """
+    import datetime
+
+    import botocore.client
+
+    make_api_call = botocore.client.BaseClient._make_api_call
+
+    def _make_api_call(client, operation_name, api_params):
+        if operation_name == "ListBuckets":
+            created = datetime.datetime.now(datetime.timezone.utc)
+            return {"Buckets": [{"Name": p.name, "CreationDate": created} for p in local_s3.root.iterdir()]}
+        if operation_name == "ListObjectsV2":
+            bucket_dir = local_s3.root / api_params["Bucket"]
+            files = sorted(p for p in bucket_dir.rglob("*") if p.is_file()) if bucket_dir.is_dir() else []
+            contents = [
+                {"Key": p.relative_to(bucket_dir).as_posix(), "ETag": f'"{hashlib.md5(p.read_bytes()).hexdigest()}"'}
+                for p in files
+                if p.relative_to(bucket_dir).as_posix().startswith(api_params.get("Prefix", ""))
+            ]
+            return {"Contents": contents, "KeyCount": len(contents), "IsTruncated": False}
+        if operation_name == "DescribeImageVersion":
+            error = {"Error": {"Code": "ResourceNotFound", "Message": "Not resolved in local mode"}}
+            raise client.exceptions.ResourceNotFound(error, operation_name)
+        return make_api_call(client, operation_name, api_params)
+
+    botocore.client.BaseClient._make_api_call = _make_api_call
+    # keeps the images reported as not found out of the image URI cache of real renders
+    cache_dir = os.environ.get("ML_PIPELINES_IMAGE_CACHE_DIR")
+    os.environ["ML_PIPELINES_IMAGE_CACHE_DIR"] = str(local_s3.root.parent / "image-uris")
+    try:
+        with redirect_s3(local_s3):
+            yield
+    finally:
+        botocore.client.BaseClient._make_api_call = make_api_call
+        if cache_dir is None:
+            del os.environ["ML_PIPELINES_IMAGE_CACHE_DIR"]
+        else:
+            os.environ["ML_PIPELINES_IMAGE_CACHE_DIR"] = cache_dir
+
+
+def step_dependencies(step):
+    """Returns the names of the steps a step definition refers to or depends on."""
+    return set(STEP_REFERENCE.findall(json.dumps(step.get("Arguments", {})))) | set(step.get("DependsOn", []))
+
+
+class LocalPipelineRunner:
+    """Runs the steps of a pipeline definition locally.
+
+    Args:
+        definition: the pipeline definition, as returned by `json.loads(pipeline.definition())`
+        work_dir: working directory, holding the local S3 directory (`s3/`), the step folders
+            (`executions/<execution id>/<step name>/`) and the local model registry (`model-registry/`)
+        parameters: optional dict overriding the default values of the pipeline parameters
+        max_workers: maximum number of steps run at the same time
+    """
+
+    def __init__(self, definition, work_dir, parameters=None, max_workers=None):
+        self.definition = definition
+        self.work_dir = pathlib.Path(work_dir).absolute()
+        self.s3 = LocalS3(self.work_dir / "s3")
+        self.parameters = {p["Name"]: p.get("DefaultValue") for p in definition.get("Parameters", [])}
+        self.parameters.update(parameters or {})
+        self.max_workers = max_workers or os.cpu_count()
+        self.execution_id = time.strftime("local-%Y%m%d-%H%M%S")
+        self.execution_dir = self.work_dir / "executions" / self.execution_id
+        self.steps = {}
+        self.statuses = {}
+        self.outputs = {}
+        self.model_artifacts = {}
+        self.property_files = {}
+
+    def run(self):
+        """Runs the pipeline and returns the status of every step that was run."""
+        logger.info("Starting local execution %s in %s", self.execution_id, self.execution_dir)
+        pending = list(self.definition["Steps"])
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                if "Failed" not in self.statuses.values():
+                    for step in [s for s in pending if step_dependencies(s) <= set(self.statuses)]:
+                        dependencies = step_dependencies(step)
+                        if any(self.statuses[d] != "Succeeded" for d in dependencies):
+                            self.statuses[step["Name"]] = "NotRun"
+                        else:
+                            logger.info("Starting step %s", step["Name"])
+                            running[pool.submit(self.run_step, step)] = step
+                        pending.remove(step)
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    try:
+                        pending.extend(future.result() or [])
+                        self.statuses[step["Name"]] = "Succeeded"
+                        logger.info("Step %s succeeded", step["Name"])
+                    except Exception:  # pylint: disable=W0703
+                        self.statuses[step["Name"]] = "Failed"
+                        logger.exception("Step %s failed", step["Name"])
+        for step in pending:
+            self.statuses[step["Name"]] = "NotRun"
+        return self.statuses
+
+    def run_step(self, step):
+        """Runs one step, returning the steps of the chosen branch for a condition step."""
+        self.steps[step["Name"]] = step
+        handler = {
+            "Processing": self.run_processing,
+            "Training": self.run_training,
+            "Condition": self.run_condition,
+            "RegisterModel": self.run_register_model,
+            "Fail": self.run_fail,
+        }.get(step["Type"])
+        if handler is None:
+            raise LocalPipelineError(f"Steps of type {step['Type']} cannot be run locally")
+        return handler(step)
+
+    def resolve(self, value):
+        """Evaluates the pipeline expressions (parameters, step properties, functions) of a value."""
+        if isinstance(value, list):
+            return [self.resolve(v) for v in value]
+        if not isinstance(value, dict):
+            return value
+        if "Get" in value:
+            return self._get(value["Get"])
+        if "Std:Join" in value:
+            return value["Std:Join"]["On"].join(str(self.resolve(v)) for v in value["Std:Join"]["Values"])
+        if "Std:JsonGet" in value:
+            property_file = value["Std:JsonGet"]["PropertyFile"]
+            path = self.resolve(property_file) if isinstance(property_file, dict) else property_file
+            with open(path) as f:
+                document = json.load(f)
+            for key in re.findall(r"[^.\[\]]+", value["Std:JsonGet"]["Path"]):
+                document = document[int(key)] if isinstance(document, list) else document[key]
+            return document
+        return {k: self.resolve(v) for k, v in value.items()}
+
+    def _get(self, name):
+        if name.startswith("Parameters."):
+            return self.parameters[name[len("Parameters.") :]]
+        if name == "Execution.PipelineExecutionId":
+            return self.execution_id
+        if name.startswith("Execution."):
+            return f"local-{name[len('Execution.') :]}"
+        for pattern, lookup in [
+            (PROCESSING_OUTPUT, lambda step, output: self.outputs[step][output]),
+            (MODEL_ARTIFACTS, lambda step: self.model_artifacts[step]),
+            (TRAINING_JOB_NAME, lambda step: f"{step}-{self.execution_id}"),
+            (PROPERTY_FILE, lambda step, name: self.property_files[step][name]),
+        ]:
+            match = pattern.fullmatch(name)
+            if match:
+                return lookup(*match.groups())
+        raise LocalPipelineError(f"{name} cannot be resolved locally")
+
+    def run_processing(self, step):
+        arguments = self.resolve(step["Arguments"])
+        instance_count = int(arguments["ProcessingResources"]["ClusterConfig"]["InstanceCount"])
+        hosts = [f"algo-{i + 1}" for i in range(instance_count)]
+        step_dir = self.execution_dir / step["Name"]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=instance_count) as pool:
+            list(pool.map(lambda i: self._run_processing_host(arguments, step_dir, hosts, i), range(instance_count)))
+
+        self.outputs[step["Name"]] = {}
+        for output in arguments.get("ProcessingOutputConfig", {}).get("Outputs", []):
+            uri = output["S3Output"]["S3Uri"]
+            for host in hosts:
+                self.s3.upload(self._local_path(step_dir / host, output["S3Output"]["LocalPath"]), uri)
+            self.outputs[step["Name"]][output["OutputName"]] = uri
+        self.property_files[step["Name"]] = {
+            p["PropertyFileName"]: self.s3.path(self.outputs[step["Name"]][p["OutputName"]]) / p["FilePath"]
+            for p in step.get("PropertyFiles", [])
+        }
+
+    def _run_processing_host(self, arguments, step_dir, hosts, index):
+        host_dir = step_dir / hosts[index]
+        config_dir = self._local_path(host_dir, f"{CONTAINER_ROOT}/config")
+        config_dir.mkdir(parents=True, exist_ok=True)
+        (config_dir / "resourceconfig.json").write_text(json.dumps({"current_host": hosts[index], "hosts": hosts}))
+
+        for processing_input in arguments.get("ProcessingInputs", []):
+            s3_input = processing_input["S3Input"]
+            shard = (index, len(hosts)) if s3_input.get("S3DataDistributionType") == "ShardedByS3Key" else None
+            local_dir = self._local_path(host_dir, s3_input["LocalPath"])
+            local_dir.mkdir(parents=True, exist_ok=True)
+            self.s3.download(s3_input["S3Uri"], local_dir, shard)
+            if processing_input["InputName"] == "code":
+                for script in local_dir.rglob("*.py"):
+                    script.write_text(script.read_text().replace(CONTAINER_ROOT, str(host_dir / CONTAINER_ROOT[1:])))
+        for output in arguments.get("ProcessingOutputConfig", {}).get("Outputs", []):
+            self._local_path(host_dir, output["S3Output"]["LocalPath"]).mkdir(parents=True, exist_ok=True)
+
+        app = arguments["AppSpecification"]
+        command = [self._local_argument(host_dir, a) for a in app["ContainerEntrypoint"][1:]]
+        command += [self._local_argument(host_dir, str(a)) for a in app.get("ContainerArguments", [])]
+        env = dict(os.environ, **arguments.get("Environment", {}))
+        env["PYTHONPATH"] = os.pathsep.join([str(pathlib.Path(__file__).parent.parent), env.get("PYTHONPATH", "")])
+        log_path = host_dir / "log.txt"
+        with open(log_path, "w") as log:
+            process = subprocess.run(
+                [sys.executable, "-m", "ml_pipelines.local_pipeline", "exec", str(self.s3.root)] + command,
+                cwd=host_dir,
+                env=env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        if process.returncode:
+            raise LocalPipelineError(f"{' '.join(command)} failed on {hosts[index]}, see {log_path}")
+
+    def _local_path(self, host_dir, container_path):
+        return host_dir / container_path.lstrip("/")
+
+    def _local_argument(self, host_dir, argument):
+        if argument.startswith(CONTAINER_ROOT):
+            return str(self._local_path(host_dir, argument))
+        return argument
+
+    def run_training(self, step):
+        import numpy as np
+        import pandas as pd
+        import xgboost
+
+        arguments = self.resolve(step["Arguments"])
+        if "xgboost" not in arguments["AlgorithmSpecification"].get("TrainingImage", ""):
+            raise LocalPipelineError("Only the built-in XGBoost algorithm can be trained locally")
+        step_dir = self.execution_dir / step["Name"]
+
+        channels = {}
+        for channel in arguments["InputDataConfig"]:
+            local_dir = step_dir / "input" / "data" / channel["ChannelName"]
+            self.s3.download(channel["DataSource"]["S3DataSource"]["S3Uri"], local_dir)
+            files = sorted(p for p in local_dir.rglob("*") if p.is_file())
+            if channel.get("ContentType") == "application/x-parquet":
+                data = pd.concat([pd.read_parquet(f) for f in files]).to_numpy(dtype=np.float64)
+            else:
+                data = pd.concat([pd.read_csv(f, header=None) for f in files]).to_numpy(dtype=np.float64)
+            channels[channel["ChannelName"]] = xgboost.DMatrix(data[:, 1:], label=data[:, 0])
+
+        hyperparameters = dict(arguments.get("HyperParameters", {}))
+        num_round = int(hyperparameters.pop("num_round"))
+        hyperparameters.pop("silent", None)
+        if hyperparameters.get("objective") == "reg:linear":
+            hyperparameters["objective"] = "reg:squarederror"
+        booster = xgboost.train(
+            hyperparameters,
+            channels["train"],
+            num_boost_round=num_round,
+            evals=[(matrix, name) for name, matrix in channels.items()],
+        )
+
+        model_dir = step_dir / "model"
+        model_dir.mkdir(parents=True, exist_ok=True)
+        with open(model_dir / "xgboost-model", "wb") as f:
+            pickle.dump(booster, f)
+        uri = f"{arguments['OutputDataConfig']['S3OutputPath']}/{step['Name']}-{self.execution_id}/output/model.tar.gz"
+        self.s3.path(uri).parent.mkdir(parents=True, exist_ok=True)
+        with tarfile.open(self.s3.path(uri), "w:gz") as tar:
+            tar.add(model_dir / "xgboost-model", arcname="xgboost-model")
+        self.model_artifacts[step["Name"]] = uri
+
+    def evaluate_condition(self, condition):
+        """Evaluates one condition of a condition step."""
+        if condition["Type"] == "Not":
+            return not self.evaluate_condition(condition["Expression"])
+        if condition["Type"] == "Or":
+            return any(self.evaluate_condition(c) for c in condition["Conditions"])
+        if condition["Type"] == "In":
+            return self.resolve(condition["QueryValue"]) in self.resolve(condition["Values"])
+        left, right = self.resolve(condition["LeftValue"]), self.resolve(condition["RightValue"])
+        return CONDITIONS[condition["Type"]](left, right)
+
+    def run_condition(self, step):
+        outcome = all(self.evaluate_condition(c) for c in step["Arguments"]["Conditions"])
+        logger.info("Condition %s evaluated to %s", step["Name"], outcome)
+        return step["Arguments"]["IfSteps" if outcome else "ElseSteps"]
+
+    def run_register_model(self, step):
+        arguments = self.resolve(step["Arguments"])
+        group_dir = self.work_dir / "model-registry" / arguments["ModelPackageGroupName"]
+        group_dir.mkdir(parents=True, exist_ok=True)
+        version = len(list(group_dir.glob("*.json"))) + 1
+        arguments["ModelPackageVersion"] = version
+        arguments["PipelineExecutionId"] = self.execution_id
+        (group_dir / f"{version}.json").write_text(json.dumps(arguments, indent=2))
+        logger.info("Registered version %d of %s", version, arguments["ModelPackageGroupName"])
+
+    def run_fail(self, step):
+        raise LocalPipelineError(self.resolve(step["Arguments"].get("ErrorMessage", "Fail step reached")))
+
+
+def exec_script(s3_root, argv):
+    """Runs a processing script as `__main__`, with its S3 transfers redirected to the local S3 directory."""
+    import runpy
+
+    sys.argv = argv
+    sys.path.insert(0, os.path.dirname(argv[0]))
+    with redirect_s3(LocalS3(s3_root)):
+        runpy.run_path(argv[0], run_name="__main__")
+
+
+def main():  # pragma: no cover
+    """The main harness that renders the pipeline and runs it locally."""
+    if sys.argv[1:2] == ["exec"]:
+        return exec_script(sys.argv[2], sys.argv[3:])
+    parser = argparse.ArgumentParser("Runs the pipeline for the pipeline script locally.")
+
+    parser.add_argument(
+        "-n",
+        "--module-name",
+        dest="module_name",
+        type=str,
+        help="The module name of the pipeline to import.",
+    )
+    parser.add_argument(
+        "-kwargs",
+        "--kwargs",
+        dest="kwargs",
+        default=None,
+        help="Dict string of keyword arguments for the pipeline generation (if supported)",
+    )
+    parser.add_argument(
+        "-parameters",
+        "--parameters",
+        dest="parameters",
+        default=None,
+        help="Dict string of pipeline parameter values overriding their defaults",
+    )
+    parser.add_argument(
+        "-work-dir",
+        "--work-dir",
+        dest="work_dir",
+        type=str,
+        default=".local-pipeline",
+        help="Working directory, S3 URIs are mapped to its s3/ folder.",
+    )
+    parser.add_argument(
+        "-max-workers",
+        "--max-workers",
+        dest="max_workers",
+        type=int,
+        default=None,
+        help="Maximum number of steps run at the same time, the number of cores by default.",
+    )
+    args = parser.parse_args()
+
+    if args.module_name is None:
+        parser.print_help()
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    kwargs = convert_struct(args.kwargs)
+    kwargs.setdefault("role", "arn:aws:iam::000000000000:role/local-pipeline")
+    kwargs.setdefault("default_bucket", "local-pipeline")
+    local_s3 = LocalS3(pathlib.Path(args.work_dir) / "s3")
+    local_s3.path(f"s3://{kwargs['default_bucket']}").mkdir(parents=True, exist_ok=True)
+    with offline_definition(local_s3):
+        pipeline = get_pipeline_driver(args.module_name, repr(kwargs))
+        definition = json.loads(pipeline.definition())
+
+    runner = LocalPipelineRunner(definition, args.work_dir, convert_struct(args.parameters), args.max_workers)
+    statuses = runner.run()
+    print(json.dumps(statuses, indent=2))
+    if any(status != "Succeeded" for status in statuses.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
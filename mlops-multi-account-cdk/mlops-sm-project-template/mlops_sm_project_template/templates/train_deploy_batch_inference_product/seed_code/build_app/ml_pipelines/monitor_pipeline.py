@@ -0,0 +1,183 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""A CLI to monitor pipeline executions until they complete."""
+from __future__ import absolute_import
+
+import argparse
+import asyncio
+import functools
+import sys
+
+# Delays between two polls of an execution, in seconds. The delay grows by BACKOFF_FACTOR every
+# poll which sees no step state change, and is reset to MIN_POLL_DELAY when a change is seen.
+MIN_POLL_DELAY = 5
+MAX_POLL_DELAY = 120
+BACKOFF_FACTOR = 1.5
+
+FAILED_STATUSES = ("Failed", "Stopped")
+
+
+class PipelineExecutionFailed(Exception):
+    """Raised when a monitored pipeline execution or one of its steps fails."""
+
+    def __init__(self, execution_arn, message):
+        super().__init__(message)
+        self.execution_arn = execution_arn
+
+
+async def _call(function, *args, **kwargs):
+    """Runs a blocking boto3 call in the default executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+
+def list_execution_steps(sagemaker_client, execution_arn):
+    """Lists the steps of a pipeline execution, in the order they were started."""
+    paginator = sagemaker_client.get_paginator("list_pipeline_execution_steps")
+    steps = []
+    for page in paginator.paginate(PipelineExecutionArn=execution_arn, SortOrder="Ascending"):
+        steps.extend(page["PipelineExecutionSteps"])
+    return steps
+
+
+async def monitor_execution(
+    sagemaker_client, execution_arn, min_delay=MIN_POLL_DELAY, max_delay=MAX_POLL_DELAY, log=print
+):
+    """Polls a pipeline execution until it completes, logging every step state change.
+
+    Args:
+        sagemaker_client: boto3 SageMaker client
+        execution_arn: ARN of the pipeline execution
+        min_delay: delay between two polls while the steps are changing state, in seconds
+        max_delay: maximum delay between two polls, in seconds
+        log: function called with a message for every step state change
+
+    Returns:
+        dict of the final status of every step of the execution
+
+    Raises:
+        PipelineExecutionFailed: as soon as the execution or one of its steps fails or is stopped
+    """
+    execution_id = execution_arn.split("/")[-1]
+    step_statuses = {}
+    delay = min_delay
+    while True:
+        description = await _call(sagemaker_client.describe_pipeline_execution, PipelineExecutionArn=execution_arn)
+        steps = await _call(list_execution_steps, sagemaker_client, execution_arn)
+
+        changed = False
+        for step in steps:
+            name, status = step["StepName"], step["StepStatus"]
+            if step_statuses.get(name) == status:
+                continue
+            changed = True
+            step_statuses[name] = status
+            reason = f": {step['FailureReason']}" if step.get("FailureReason") else ""
+            cached = " (cache hit)" if step.get("CacheHitResult") else ""
+            log(f"[{execution_id}] {name} {status}{cached}{reason}")
+            if status in FAILED_STATUSES:
+                raise PipelineExecutionFailed(execution_arn, f"Step {name} of {execution_arn} {status.lower()}{reason}")
+
+        status = description["PipelineExecutionStatus"]
+        if status in FAILED_STATUSES:
+            reason = description.get("FailureReason", "")
+            raise PipelineExecutionFailed(execution_arn, f"Execution {execution_arn} {status.lower()}: {reason}")
+        if status == "Succeeded":
+            log(f"[{execution_id}] Succeeded")
+            return step_statuses
+
+        delay = min_delay if changed else min(delay * BACKOFF_FACTOR, max_delay)
+        await asyncio.sleep(delay)
+
+
+async def monitor_executions(sagemaker_client, execution_arns, **kwargs):
+    """Polls several pipeline executions concurrently until they all complete or one fails.
+
+    Args:
+        sagemaker_client: boto3 SageMaker client
+        execution_arns: ARNs of the pipeline executions
+        kwargs: passed to monitor_execution
+
+    Returns:
+        dict of the step statuses of every execution, by execution ARN
+
+    Raises:
+        PipelineExecutionFailed: as soon as one of the executions fails, without waiting for the others
+    """
+    tasks = {arn: asyncio.ensure_future(monitor_execution(sagemaker_client, arn, **kwargs)) for arn in execution_arns}
+    try:
+        done, _ = await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+        return {arn: task.result() for arn, task in tasks.items()}
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+
+def wait_for_executions(sagemaker_client, execution_arns, **kwargs):
+    """Blocking wrapper of monitor_executions."""
+    return asyncio.run(monitor_executions(sagemaker_client, execution_arns, **kwargs))
+
+
+def main():  # pragma: no cover
+    """The main harness that monitors pipeline executions."""
+    parser = argparse.ArgumentParser("Monitors pipeline executions until they complete or one of them fails.")
+
+    parser.add_argument(
+        "-execution-arns",
+        "--execution-arns",
+        dest="execution_arns",
+        nargs="+",
+        help="The ARNs of the pipeline executions to monitor.",
+    )
+    parser.add_argument(
+        "-min-poll-delay",
+        "--min-poll-delay",
+        dest="min_delay",
+        type=float,
+        default=MIN_POLL_DELAY,
+        help="Delay between two polls of an execution while its steps change state, in seconds.",
+    )
+    parser.add_argument(
+        "-max-poll-delay",
+        "--max-poll-delay",
+        dest="max_delay",
+        type=float,
+        default=MAX_POLL_DELAY,
+        help="Maximum delay between two polls of an execution, in seconds.",
+    )
+    args = parser.parse_args()
+
+    if not args.execution_arns:
+        parser.print_help()
+        sys.exit(2)
+
+    from ml_pipelines.sessions import get_client  # pylint: disable=C0415
+
+    try:
+        wait_for_executions(
+            get_client("sagemaker"), args.execution_arns, min_delay=args.min_delay, max_delay=args.max_delay
+        )
+    except Exception as e:  # pylint: disable=W0703
+        print(f"Exception: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
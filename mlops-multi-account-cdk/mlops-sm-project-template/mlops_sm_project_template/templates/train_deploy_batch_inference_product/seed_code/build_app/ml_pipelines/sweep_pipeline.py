@@ -0,0 +1,397 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""A CLI to run a pipeline with several sets of parameters and compare the executions."""
+from __future__ import absolute_import
+
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import sys
+import uuid
+
+from ml_pipelines._utils import convert_struct, get_pipeline_custom_tags, get_pipeline_driver
+from ml_pipelines.monitor_pipeline import PipelineExecutionFailed, _call, list_execution_steps, monitor_execution
+
+DEFAULT_MAX_CONCURRENT_EXECUTIONS = 10
+# StartPipelineExecution calls per second, throttled calls are retried by the adaptive retry mode
+DEFAULT_STARTS_PER_SECOND = 1.0
+
+# Name of the processing output and file of the evaluation reports, see the evaluation steps.
+EVALUATION_OUTPUT_NAME = "evaluation"
+EVALUATION_REPORT_NAME = "evaluation.json"
+
+
+class RateLimiter:
+    """Spaces out calls to at most rate per second, in the order they are made."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = None
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        """Waits until the next call is allowed."""
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._next is not None and self._next > now:
+                await asyncio.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+def expand_parameter_sets(grid=None, parameter_sets=None):
+    """Lists the pipeline parameters of every execution of a sweep.
+
+    Args:
+        grid: dict of the values of every parameter, every combination of which is an execution
+        parameter_sets: list of dict of parameters, one per execution, run after the grid
+
+    Returns:
+        list of dict of parameter values
+    """
+    expanded = []
+    if grid:
+        names = list(grid)
+        expanded.extend(dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names)))
+    expanded.extend(parameter_sets or [])
+    return expanded
+
+
+def flatten_metrics(report, prefix=""):
+    """Flattens the numeric values of an evaluation report, e.g. {"mse": {"value": 1}} to {"mse.value": 1}."""
+    metrics = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[f"{prefix}{key}"] = value
+    return metrics
+
+
+def get_job_usage(sagemaker_client, steps, prices=None):
+    """Sums the compute time of the processing and training jobs of an execution.
+
+    The steps reused from the cache are skipped, their job having run, and been charged, for an earlier execution.
+
+    Args:
+        sagemaker_client: boto3 SageMaker client
+        steps: the steps of the execution, as returned by ListPipelineExecutionSteps
+        prices: optional dict of the price per hour of instance types
+
+    Returns:
+        dict of the instance hours of the jobs, and their cost if prices is given, None if the price
+        of an instance type is missing
+    """
+    instance_seconds = {}
+    for step in steps:
+        if step.get("CacheHitResult"):
+            continue
+        metadata = step.get("Metadata", {})
+        if "TrainingJob" in metadata:
+            job = sagemaker_client.describe_training_job(TrainingJobName=metadata["TrainingJob"]["Arn"].split("/")[-1])
+            resources = job["ResourceConfig"]
+            seconds = job.get("BillableTimeInSeconds", 0) * resources["InstanceCount"]
+        elif "ProcessingJob" in metadata:
+            job = sagemaker_client.describe_processing_job(
+                ProcessingJobName=metadata["ProcessingJob"]["Arn"].split("/")[-1]
+            )
+            resources = job["ProcessingResources"]["ClusterConfig"]
+            if "ProcessingStartTime" not in job or "ProcessingEndTime" not in job:
+                continue
+            duration = (job["ProcessingEndTime"] - job["ProcessingStartTime"]).total_seconds()
+            seconds = duration * resources["InstanceCount"]
+        else:
+            continue
+        instance_type = resources["InstanceType"]
+        instance_seconds[instance_type] = instance_seconds.get(instance_type, 0) + seconds
+
+    usage = {"instance_hours": round(sum(instance_seconds.values()) / 3600, 4)}
+    if prices is not None:
+        known = all(instance_type in prices for instance_type in instance_seconds)
+        cost = sum(seconds / 3600 * prices.get(instance_type, 0) for instance_type, seconds in instance_seconds.items())
+        usage["cost"] = round(cost, 4) if known else None
+    return usage
+
+
+def get_evaluation_metrics(sagemaker_client, s3_client, steps):
+    """Reads the evaluation reports written by the processing steps of an execution.
+
+    Returns:
+        dict of the flattened numeric metrics of the reports
+    """
+    metrics = {}
+    for step in steps:
+        if step.get("StepStatus") != "Succeeded" or "ProcessingJob" not in step.get("Metadata", {}):
+            continue
+        job = sagemaker_client.describe_processing_job(
+            ProcessingJobName=step["Metadata"]["ProcessingJob"]["Arn"].split("/")[-1]
+        )
+        for output in job.get("ProcessingOutputConfig", {}).get("Outputs", []):
+            if output["OutputName"] != EVALUATION_OUTPUT_NAME:
+                continue
+            bucket, _, prefix = output["S3Output"]["S3Uri"][len("s3://") :].partition("/")
+            key = f"{prefix.rstrip('/')}/{EVALUATION_REPORT_NAME}"
+            report = json.loads(s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+            metrics.update(flatten_metrics(report))
+    return metrics
+
+
+async def run_execution(
+    sagemaker_client, s3_client, pipeline_name, parameters, limiter, prices=None, definition=None, **kwargs
+):
+    """Starts an execution of a sweep once the rate limiter allows it, and waits for its results.
+
+    Args:
+        sagemaker_client: boto3 SageMaker client
+        s3_client: boto3 S3 client used to list the input data and read the evaluation reports
+        pipeline_name: name of the pipeline
+        parameters: dict of the pipeline parameters of the execution
+        limiter: RateLimiter of the StartPipelineExecution calls
+        prices: optional dict of the price per hour of instance types
+        definition: optional parsed pipeline definition, to set the InputDataETags parameter of the
+            execution as run-pipeline does, see with_input_etags
+        kwargs: passed to monitor_execution
+
+    Returns:
+        dict with the parameters, status, usage and evaluation metrics of the execution
+    """
+    from ml_pipelines.caching import with_input_etags  # pylint: disable=C0415
+
+    result = {"parameters": parameters}
+    try:
+        start_parameters = parameters
+        if definition is not None:
+            start_parameters = await _call(with_input_etags, s3_client, definition, parameters)
+        await limiter.wait()
+        response = await _call(
+            sagemaker_client.start_pipeline_execution,
+            PipelineName=pipeline_name,
+            PipelineParameters=[{"Name": name, "Value": str(value)} for name, value in start_parameters.items()],
+            PipelineExecutionDescription=f"sweep {json.dumps(parameters, sort_keys=True)}"[:3072],
+            # makes the retries of a throttled call start a single execution
+            ClientRequestToken=str(uuid.uuid4()),
+        )
+        result["execution_arn"] = response["PipelineExecutionArn"]
+        try:
+            await monitor_execution(sagemaker_client, result["execution_arn"], **kwargs)
+            result["status"] = "Succeeded"
+        except PipelineExecutionFailed as e:
+            result.update(status="Failed", error=str(e))
+        steps = await _call(list_execution_steps, sagemaker_client, result["execution_arn"])
+        result.update(await _call(get_job_usage, sagemaker_client, steps, prices))
+        result["metrics"] = await _call(get_evaluation_metrics, sagemaker_client, s3_client, steps)
+    except Exception as e:  # pylint: disable=W0703
+        result.update(status="Failed", error=str(e))
+    return result
+
+
+async def run_sweep(
+    sagemaker_client,
+    s3_client,
+    pipeline_name,
+    parameter_sets,
+    max_concurrent_executions=DEFAULT_MAX_CONCURRENT_EXECUTIONS,
+    starts_per_second=DEFAULT_STARTS_PER_SECOND,
+    prices=None,
+    definition=None,
+    **kwargs,
+):
+    """Runs an execution of a pipeline for every set of parameters, max_concurrent_executions at a time.
+
+    Executions are started as soon as a previous one completes, at most starts_per_second per second,
+    and a failed execution does not stop the others.
+
+    Returns:
+        list of the results of run_execution, in the order of parameter_sets
+    """
+    limiter = RateLimiter(starts_per_second)
+    semaphore = asyncio.Semaphore(max_concurrent_executions)
+
+    async def run(parameters):
+        async with semaphore:
+            return await run_execution(
+                sagemaker_client, s3_client, pipeline_name, parameters, limiter, prices, definition, **kwargs
+            )
+
+    return await asyncio.gather(*(run(parameters) for parameters in parameter_sets))
+
+
+def comparison_table(results):
+    """Lays out the results of a sweep as rows of a table, with a column per parameter and metric."""
+    parameter_names = list(dict.fromkeys(name for result in results for name in result["parameters"]))
+    metric_names = sorted({name for result in results for name in result.get("metrics", {})})
+    has_cost = any("cost" in result for result in results)
+    header = parameter_names + ["status", "instance_hours"] + (["cost"] if has_cost else []) + metric_names
+    rows = [header]
+    for result in results:
+        row = [result["parameters"].get(name, "") for name in parameter_names]
+        row += [result["status"], result.get("instance_hours", "")]
+        row += [result.get("cost", "")] if has_cost else []
+        row += [result.get("metrics", {}).get(name, "") for name in metric_names]
+        rows.append(["" if value is None else str(value) for value in row])
+    return rows
+
+
+def format_table(rows):
+    """Formats rows as aligned columns."""
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
+
+
+def main():  # pragma: no cover
+    """The main harness that runs a parameter sweep of a pipeline.
+
+    Creates or updates the pipeline, starts an execution for every set of parameters and prints a
+    table comparing the compute time, cost and evaluation metrics of the executions.
+    """
+    parser = argparse.ArgumentParser("Runs the pipeline for every set of parameters and compares the executions.")
+
+    parser.add_argument(
+        "-n",
+        "--module-name",
+        dest="module_name",
+        type=str,
+        help="The module name of the pipeline to import.",
+    )
+    parser.add_argument(
+        "-kwargs",
+        "--kwargs",
+        dest="kwargs",
+        default=None,
+        help="Dict string of keyword arguments for the pipeline generation (if supported)",
+    )
+    parser.add_argument(
+        "-grid",
+        "--grid",
+        dest="grid",
+        default=None,
+        help="""Dict string of '{"ParameterName": [value, ..], ..}', every combination is run.""",
+    )
+    parser.add_argument(
+        "-parameter-sets",
+        "--parameter-sets",
+        dest="parameter_sets",
+        default=None,
+        help="""List of dict strings of '[{"ParameterName": value, ..}, ..]', each one is run.""",
+    )
+    parser.add_argument(
+        "-role-arn",
+        "--role-arn",
+        dest="role_arn",
+        type=str,
+        help="The role arn for the pipeline service execution role.",
+    )
+    parser.add_argument(
+        "-description",
+        "--description",
+        dest="description",
+        type=str,
+        default=None,
+        help="The description of the pipeline.",
+    )
+    parser.add_argument(
+        "-tags",
+        "--tags",
+        dest="tags",
+        default=None,
+        help="""List of dict strings of '[{"Key": "string", "Value": "string"}, ..]'""",
+    )
+    parser.add_argument(
+        "-max-concurrent-executions",
+        "--max-concurrent-executions",
+        dest="max_concurrent_executions",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENT_EXECUTIONS,
+        help="The maximum number of executions running at the same time.",
+    )
+    parser.add_argument(
+        "-starts-per-second",
+        "--starts-per-second",
+        dest="starts_per_second",
+        type=float,
+        default=DEFAULT_STARTS_PER_SECOND,
+        help="The maximum number of executions started per second.",
+    )
+    parser.add_argument(
+        "-prices",
+        "--prices",
+        dest="prices",
+        default=None,
+        help="""Dict string of '{"ml.m5.xlarge": price per hour, ..}' to compute the cost of the executions.""",
+    )
+    parser.add_argument(
+        "-output-file",
+        "--output-file",
+        dest="output_file",
+        type=str,
+        default=None,
+        help="The CSV file to write the comparison table to.",
+    )
+    args = parser.parse_args()
+
+    parameter_sets = expand_parameter_sets(convert_struct(args.grid), convert_struct(args.parameter_sets) or None)
+    if args.module_name is None or args.role_arn is None or not parameter_sets:
+        parser.print_help()
+        sys.exit(2)
+
+    from ml_pipelines.sessions import get_client  # pylint: disable=C0415
+
+    try:
+        pipeline = get_pipeline_driver(args.module_name, args.kwargs)
+        all_tags = get_pipeline_custom_tags(args.module_name, args.kwargs, convert_struct(args.tags))
+        definition = json.loads(pipeline.definition())
+        upsert_response = pipeline.upsert(role_arn=args.role_arn, description=args.description, tags=all_tags)
+        print("###### Created/Updated SageMaker Pipeline: Response received:")
+        print(upsert_response)
+
+        region = pipeline.sagemaker_session.boto_region_name
+        print(f"\n###### Running {len(parameter_sets)} executions of {pipeline.name}")
+        results = asyncio.run(
+            run_sweep(
+                get_client("sagemaker", region),
+                get_client("s3", region),
+                pipeline.name,
+                parameter_sets,
+                max_concurrent_executions=args.max_concurrent_executions,
+                starts_per_second=args.starts_per_second,
+                prices=convert_struct(args.prices) or None,
+                # the cache keys of the steps cover the data the parameters of each execution resolve to
+                definition=definition,
+            )
+        )
+    except Exception as e:  # pylint: disable=W0703
+        print(f"Exception: {e}")
+        sys.exit(1)
+
+    rows = comparison_table(results)
+    print("\n###### Comparison of the executions")
+    print(format_table(rows))
+    for result in results:
+        if result["status"] == "Failed":
+            print(f"{result.get('execution_arn', json.dumps(result['parameters']))}: {result['error']}")
+    if args.output_file:
+        with open(args.output_file, "w", newline="") as f:
+            csv.writer(f).writerows(rows)
+    if any(result["status"] == "Failed" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Collects the step telemetry of pipeline executions, and a CLI to export it."""
+from __future__ import absolute_import
+
+import argparse
+import concurrent.futures
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+from ml_pipelines.monitor_pipeline import list_execution_steps
+
+# Jobs run by the steps, by metadata key of ListPipelineExecutionSteps: the describe call, its name
+# argument, the field of the time the job started on its instances and the field of its instances.
+JOB_TYPES = {
+    "ProcessingJob": ("describe_processing_job", "ProcessingJobName", "ProcessingStartTime", "ProcessingResources"),
+    "TrainingJob": ("describe_training_job", "TrainingJobName", "TrainingStartTime", "ResourceConfig"),
+    "TransformJob": ("describe_transform_job", "TransformJobName", "TransformStartTime", "TransformResources"),
+}
+
+CSV_FIELDS = (
+    "step_name",
+    "step_type",
+    "status",
+    "start_time",
+    "end_time",
+    "duration_seconds",
+    "queue_seconds",
+    "instance_type",
+    "instance_count",
+    "attempts",
+    "cache_hit",
+    "critical",
+    "depends_on",
+)
+
+DEFAULT_EMF_NAMESPACE = "MLPipelines"
+
+
+def _references(value):
+    """Yields the names of the steps whose properties a step definition refers to."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            # the steps run by a condition step are steps of their own
+            if key in ("IfSteps", "ElseSteps"):
+                continue
+            if key == "Get" and isinstance(item, str) and item.startswith("Steps."):
+                yield item.split(".")[1]
+            else:
+                yield from _references(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _references(item)
+
+
+def get_step_dependencies(definition):
+    """Gets the steps every step of a pipeline definition waits for.
+
+    A step depends on the steps of its DependsOn, on the steps whose properties it uses, and on
+    the condition step which runs it, if any.
+
+    Args:
+        definition: pipeline definition, as a dict
+
+    Returns:
+        dict of the sorted names of the steps every step depends on, by step name
+    """
+    dependencies = {}
+
+    def add(step, condition=None):
+        names = set(step.get("DependsOn", [])) | set(_references(step))
+        if condition:
+            names.add(condition)
+        dependencies[step["Name"]] = sorted(names - {step["Name"]})
+        arguments = step.get("Arguments", {}) if step.get("Type") == "Condition" else {}
+        for nested in arguments.get("IfSteps", []) + arguments.get("ElseSteps", []):
+            add(nested, step["Name"])
+
+    for step in definition.get("Steps", []):
+        add(step)
+    return dependencies
+
+
+def _seconds(start, end):
+    return round((end - start).total_seconds(), 3) if start and end else None
+
+
+def describe_step_job(sagemaker_client, step):
+    """Describes the processing, training or transform job run by a pipeline execution step.
+
+    Returns:
+        dict with the job_start_time, instance_type and instance_count of the job, empty for the steps
+        which do not run a job
+    """
+    for job_type, (describe, name_argument, start_field, resources_field) in JOB_TYPES.items():
+        job_arn = step.get("Metadata", {}).get(job_type, {}).get("Arn")
+        if job_arn:
+            job = getattr(sagemaker_client, describe)(**{name_argument: job_arn.split("/")[-1]})
+            # processing jobs nest their instances in a cluster configuration
+            resources = job.get(resources_field, {})
+            resources = resources.get("ClusterConfig", resources)
+            return {
+                "job_start_time": job.get(start_field),
+                "instance_type": resources.get("InstanceType"),
+                "instance_count": resources.get("InstanceCount"),
+            }
+    return {}
+
+
+def find_critical_path(steps):
+    """Finds the chain of steps which determined the end time of an execution.
+
+    Starting from the step which ended last, walks back to the dependency which ended last, until
+    a step with no dependencies. Shortening any other step does not make the execution shorter.
+
+    Args:
+        steps: step telemetry with the step_name, start_time, end_time and depends_on of every step
+
+    Returns:
+        names of the steps of the critical path, in execution order
+    """
+    ended = {step["step_name"]: step for step in steps if step["start_time"] and step["end_time"]}
+    if not ended:
+        return []
+    step = max(ended.values(), key=lambda s: s["end_time"])
+    path = [step["step_name"]]
+    while True:
+        dependencies = [ended[name] for name in step["depends_on"] if name in ended and name not in path]
+        if not dependencies:
+            break
+        step = max(dependencies, key=lambda s: s["end_time"])
+        path.append(step["step_name"])
+    return path[::-1]
+
+
+def collect_execution_telemetry(sagemaker_client, execution_arn, max_workers=8):
+    """Collects the telemetry of every step of a pipeline execution.
+
+    For every step: its start and end times and duration, its queue time (the time between the start
+    of the step and the start of its job on the instances, which covers provisioning the instances
+    and pulling the image), the instance type and count of its job, its number of attempts and
+    whether it was a cache hit. The jobs are described concurrently.
+
+    Args:
+        sagemaker_client: boto3 SageMaker client
+        execution_arn: ARN of the pipeline execution
+        max_workers: maximum number of jobs described at the same time
+
+    Returns:
+        dict of the execution, its steps in start order and its critical path, times as ISO 8601 strings
+    """
+    execution = sagemaker_client.describe_pipeline_execution(PipelineExecutionArn=execution_arn)
+    definition = sagemaker_client.describe_pipeline_definition_for_execution(PipelineExecutionArn=execution_arn)
+    dependencies = get_step_dependencies(json.loads(definition["PipelineDefinition"]))
+    execution_steps = list_execution_steps(sagemaker_client, execution_arn)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        jobs = list(pool.map(lambda step: describe_step_job(sagemaker_client, step), execution_steps))
+
+    steps = []
+    for step, job in zip(execution_steps, jobs):
+        cache_hit = bool(step.get("CacheHitResult"))
+        metadata = step.get("Metadata", {})
+        start_time, end_time = step.get("StartTime"), step.get("EndTime")
+        steps.append(
+            {
+                "step_name": step["StepName"],
+                "step_type": next(iter(metadata), None),
+                "status": step["StepStatus"],
+                "start_time": start_time,
+                "end_time": end_time,
+                "duration_seconds": _seconds(start_time, end_time),
+                # a cache hit points at the job of a previous execution
+                "queue_seconds": None if cache_hit else _seconds(start_time, job.get("job_start_time")),
+                "instance_type": job.get("instance_type"),
+                "instance_count": job.get("instance_count"),
+                "attempts": step.get("AttemptCount", 1),
+                "cache_hit": cache_hit,
+                "depends_on": dependencies.get(step["StepName"], []),
+            }
+        )
+
+    critical_path = find_critical_path(steps)
+    by_name = {step["step_name"]: step for step in steps}
+    for step in steps:
+        step["critical"] = step["step_name"] in critical_path
+    critical_path_seconds = (
+        _seconds(by_name[critical_path[0]]["start_time"], by_name[critical_path[-1]]["end_time"])
+        if critical_path
+        else None
+    )
+
+    for step in steps:
+        for field in ("start_time", "end_time"):
+            step[field] = step[field].isoformat() if step[field] else None
+    start_time, end_time = execution.get("CreationTime"), execution.get("LastModifiedTime")
+    return {
+        "execution_arn": execution_arn,
+        "pipeline_name": execution["PipelineArn"].split("/")[-1],
+        "status": execution["PipelineExecutionStatus"],
+        "start_time": start_time.isoformat() if start_time else None,
+        "end_time": end_time.isoformat() if end_time else None,
+        "duration_seconds": _seconds(start_time, end_time),
+        "critical_path": critical_path,
+        "critical_path_seconds": critical_path_seconds,
+        "steps": steps,
+    }
+
+
+def to_csv(telemetry):
+    """Formats the steps of the telemetry of an execution as CSV, one row per step."""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=CSV_FIELDS, extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    for step in telemetry["steps"]:
+        writer.writerow(dict(step, depends_on=" ".join(step["depends_on"])))
+    return output.getvalue()
+
+
+def to_emf(telemetry, namespace=DEFAULT_EMF_NAMESPACE, timestamp=None):
+    """Formats the telemetry of an execution as CloudWatch embedded metric format documents.
+
+    One document per step with its duration, queue time, attempts and cache hit, by pipeline and
+    step, and one with the duration and critical path duration of the execution, by pipeline.
+    Metrics without a value, like the queue time of the steps which run no job, are left out.
+
+    Args:
+        telemetry: telemetry of an execution, see collect_execution_telemetry
+        namespace: CloudWatch namespace of the metrics
+        timestamp: time of the metrics in milliseconds since the epoch, the end of the execution by default
+
+    Returns:
+        list of JSON documents, to be written one per line to a log group
+    """
+    if timestamp is None:
+        end_time = telemetry["end_time"]
+        now = datetime.fromisoformat(end_time) if end_time else datetime.now(timezone.utc)
+        timestamp = int(now.timestamp() * 1000)
+
+    def document(dimensions, metrics):
+        values = {name: value for name, (value, _) in metrics.items() if value is not None}
+        return json.dumps(
+            {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": namespace,
+                            "Dimensions": [list(dimensions)],
+                            "Metrics": [{"Name": name, "Unit": metrics[name][1]} for name in values],
+                        }
+                    ],
+                },
+                **dimensions,
+                **values,
+            }
+        )
+
+    pipeline = {"PipelineName": telemetry["pipeline_name"]}
+    documents = [
+        document(
+            dict(pipeline, StepName=step["step_name"]),
+            {
+                "StepDuration": (step["duration_seconds"], "Seconds"),
+                "StepQueueTime": (step["queue_seconds"], "Seconds"),
+                "StepAttempts": (step["attempts"], "Count"),
+                "StepCacheHit": (int(step["cache_hit"]), "Count"),
+            },
+        )
+        for step in telemetry["steps"]
+    ]
+    documents.append(
+        document(
+            pipeline,
+            {
+                "ExecutionDuration": (telemetry["duration_seconds"], "Seconds"),
+                "CriticalPathDuration": (telemetry["critical_path_seconds"], "Seconds"),
+            },
+        )
+    )
+    return documents
+
+
+def write_telemetry(telemetry, output_dir, s3_client=None):
+    """Writes the telemetry of an execution as JSON and CSV files named after the execution.
+
+    Args:
+        telemetry: telemetry of an execution, see collect_execution_telemetry
+        output_dir: local directory or S3 URI prefix of the files
+        s3_client: boto3 S3 client, required to write to S3
+
+    Returns:
+        paths or S3 URIs of the JSON and CSV files
+    """
+    name = f"{telemetry['pipeline_name']}-{telemetry['execution_arn'].split('/')[-1]}"
+    contents = {
+        f"{name}.json": json.dumps(telemetry, indent=2),
+        f"{name}.csv": to_csv(telemetry),
+    }
+    paths = []
+    for file_name, content in contents.items():
+        if output_dir.startswith("s3://"):
+            bucket, _, prefix = output_dir[len("s3://") :].partition("/")
+            key = f"{prefix.rstrip('/')}/{file_name}".lstrip("/")
+            s3_client.put_object(Bucket=bucket, Key=key, Body=content.encode("utf-8"))
+            paths.append(f"s3://{bucket}/{key}")
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+            path = os.path.join(output_dir, file_name)
+            with open(path, "w") as f:
+                f.write(content)
+            paths.append(path)
+    return paths
+
+
+def format_step_table(telemetry):
+    """Formats the steps of the telemetry of an execution as a table, critical path steps marked with *."""
+    rows = [("", "STEP", "STATUS", "DURATION", "QUEUE", "INSTANCES", "ATTEMPTS", "CACHE HIT")]
+    for step in telemetry["steps"]:
+        instances = f"{step['instance_count']} x {step['instance_type']}" if step["instance_type"] else "-"
+        rows.append(
+            (
+                "*" if step["critical"] else "",
+                step["step_name"],
+                step["status"],
+                "-" if step["duration_seconds"] is None else f"{step['duration_seconds']:.0f}s",
+                "-" if step["queue_seconds"] is None else f"{step['queue_seconds']:.0f}s",
+                instances,
+                str(step["attempts"]),
+                "yes" if step["cache_hit"] else "no",
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+    if telemetry["critical_path"]:
+        lines.append(
+            f"Critical path ({telemetry['critical_path_seconds']:.0f}s): {' -> '.join(telemetry['critical_path'])}"
+        )
+    return "\n".join(lines)
+
+
+def export_telemetry(sagemaker_client, execution_arns, output_dir=None, s3_client=None, emf_namespace=None):
+    """Collects, prints and optionally writes the telemetry of pipeline executions.
+
+    Args:
+        sagemaker_client: boto3 SageMaker client
+        execution_arns: ARNs of the pipeline executions
+        output_dir: local directory or S3 URI prefix the JSON and CSV files are written to, if any
+        s3_client: boto3 S3 client, required to write to S3
+        emf_namespace: CloudWatch namespace of the embedded metric format documents printed, if any
+
+    Returns:
+        list of the telemetry of every execution
+    """
+    all_telemetry = []
+    for execution_arn in execution_arns:
+        telemetry = collect_execution_telemetry(sagemaker_client, execution_arn)
+        print(f"\n###### Step telemetry of {execution_arn}")
+        print(format_step_table(telemetry))
+        if output_dir:
+            for path in write_telemetry(telemetry, output_dir, s3_client):
+                print(f"Telemetry written to {path}")
+        if emf_namespace:
+            for document in to_emf(telemetry, emf_namespace):
+                print(document)
+        all_telemetry.append(telemetry)
+    return all_telemetry
+
+
+def main():  # pragma: no cover
+    """The main harness that exports the step telemetry of pipeline executions."""
+    parser = argparse.ArgumentParser("Exports the step telemetry and critical path of pipeline executions.")
+
+    parser.add_argument(
+        "-execution-arns",
+        "--execution-arns",
+        dest="execution_arns",
+        nargs="+",
+        help="The ARNs of the pipeline executions.",
+    )
+    parser.add_argument(
+        "-output-dir",
+        "--output-dir",
+        dest="output_dir",
+        type=str,
+        default=None,
+        help="Local directory or S3 URI the JSON and CSV telemetry of every execution is written to.",
+    )
+    parser.add_argument(
+        "-emf-namespace",
+        "--emf-namespace",
+        dest="emf_namespace",
+        type=str,
+        default=None,
+        help="Print the metrics in the CloudWatch embedded metric format, in this namespace.",
+    )
+    args = parser.parse_args()
+
+    if not args.execution_arns:
+        parser.print_help()
+        sys.exit(2)
+
+    from ml_pipelines.sessions import get_client  # pylint: disable=C0415
+
+    try:
+        export_telemetry(
+            get_client("sagemaker"),
+            args.execution_arns,
+            args.output_dir,
+            get_client("s3") if args.output_dir else None,
+            args.emf_namespace,
+        )
+    except Exception as e:  # pylint: disable=W0703
+        print(f"Exception: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -62,6 +62,12 @@ setuptools.setup(
         "console_scripts": [
             "get-pipeline-definition=ml_pipelines.get_pipeline_definition:main",
             "run-pipeline=ml_pipelines.run_pipeline:main",
+            "run-local-pipeline=ml_pipelines.local_pipeline:main",
+            "monitor-pipeline=ml_pipelines.monitor_pipeline:main",
+            "prewarm-image-uris=ml_pipelines.image_uris:main",
+            "sweep-pipeline=ml_pipelines.sweep_pipeline:main",
+            "export-pipeline-telemetry=ml_pipelines.telemetry:main",
+            "calibrate-transform=ml_pipelines.inference.calibration:main",
         ]
     },
     classifiers=[
@@ -0,0 +1,230 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Merges the predictions of a batch transform job into Parquet, joined with the keys of their input rows.
+
+The transform job writes one `.out` file per input file, with one line of predictions per input line
+and no record ID. The preprocessing step wrote, under the same file name, the source file and row
+number of every input row in the same order, so the n-th line of a `.out` file is the prediction of
+the n-th key of its keys file.
+
+Both files are read in chunks, and the rows written to `source=<source>/<input file>.parquet`, a
+Hive-style partitioning by source file whose value is URI-encoded. Summary statistics of the
+predictions, overall and by source, are written to a separate JSON file.
+"""
+import argparse
+import json
+import logging
+import os
+import pathlib
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.StreamHandler())
+
+# Suffix the batch transform job appends to the name of its input files.
+PREDICTIONS_SUFFIX = ".out"
+
+
+class PredictionSummary:
+    """Accumulates the count, mean, standard deviation, minimum and maximum of predictions.
+
+    Means and sums of squared deviations are combined with Chan's parallel update, which is
+    numerically stable.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """Folds a numpy array of predictions into the statistics."""
+        if len(values) == 0:
+            return
+        chunk = PredictionSummary()
+        chunk.count = len(values)
+        chunk.mean = float(np.mean(values))
+        chunk.m2 = float(np.sum((values - chunk.mean) ** 2))
+        chunk.min = float(np.min(values))
+        chunk.max = float(np.max(values))
+        self.merge(chunk)
+
+    def merge(self, other):
+        """Folds the statistics of disjoint predictions into these."""
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta**2 * self.count * other.count / total
+        self.mean += delta * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def report(self):
+        """Returns the statistics as a JSON serializable dict."""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": float(self.mean),
+            "std": float(np.sqrt(self.m2 / self.count)),
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+def read_predictions(path, chunk_size):
+    """Reads a .out file in chunks, with one `prediction` column, or `prediction_<i>` for several values."""
+    for chunk in pd.read_csv(path, header=None, chunksize=chunk_size, dtype=np.float64):
+        if chunk.shape[1] == 1:
+            chunk.columns = ["prediction"]
+        else:
+            chunk.columns = [f"prediction_{i}" for i in range(chunk.shape[1])]
+        yield chunk
+
+
+def read_keys(path, name, chunk_size):
+    """Reads a keys file in chunks, or numbers the rows of the input file name when it has none."""
+    if os.path.exists(path):
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype={"source": str, "row": np.int64})
+        return
+    start = 0
+    while True:
+        yield pd.DataFrame({"source": name, "row": np.arange(start, start + chunk_size)})
+        start += chunk_size
+
+
+def merge_file(predictions_path, keys_path, output_dir, chunk_size, summaries):
+    """Joins the predictions of one .out file with their keys and appends them to the Parquet partitions.
+
+    Args:
+        predictions_path: local path of the .out file
+        keys_path: local path of the keys of its input file, rows are numbered by input file if it does not exist
+        output_dir: directory of the Parquet dataset
+        chunk_size: number of rows held in memory at a time
+        summaries: dict of the PredictionSummary of every source, updated in place
+
+    Returns:
+        the number of rows merged
+    """
+    # pyarrow is only needed, and only imported, to write Parquet.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    name = os.path.basename(predictions_path)[: -len(PREDICTIONS_SUFFIX)]
+    file_name = f"{os.path.splitext(name)[0]}.parquet"
+    has_keys = os.path.exists(keys_path)
+    keys = read_keys(keys_path, name, chunk_size)
+    writers = {}
+    rows = 0
+    try:
+        for predictions in read_predictions(predictions_path, chunk_size):
+            chunk_keys = next(keys, None)
+            if chunk_keys is None or len(chunk_keys) < len(predictions):
+                raise ValueError(f"{predictions_path} has more predictions than {keys_path} has keys.")
+            if has_keys and len(chunk_keys) > len(predictions):
+                raise ValueError(f"{keys_path} has more keys than {predictions_path} has predictions.")
+            chunk = pd.concat(
+                [chunk_keys.iloc[: len(predictions)].reset_index(drop=True), predictions.reset_index(drop=True)], axis=1
+            )
+            for source, rows_of_source in chunk.groupby("source", sort=False):
+                table = pa.Table.from_pandas(rows_of_source.drop(columns=["source"]), preserve_index=False)
+                if source not in writers:
+                    directory = f"{output_dir}/source={urllib.parse.quote(source, safe='')}"
+                    pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+                    writers[source] = pq.ParquetWriter(f"{directory}/{file_name}", table.schema)
+                writers[source].write_table(table)
+                summaries.setdefault(source, PredictionSummary()).update(rows_of_source.iloc[:, 2].to_numpy())
+            rows += len(chunk)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    if has_keys and next(keys, None) is not None:
+        raise ValueError(f"{keys_path} has more keys than {predictions_path} has predictions.")
+    return rows
+
+
+def merge_predictions(predictions_dir, keys_dir, output_dir, summary_path, chunk_size=100000):
+    """Merges every .out file of the predictions directory into a Parquet dataset partitioned by source.
+
+    Args:
+        predictions_dir: local directory holding the .out files of the transform job
+        keys_dir: local directory holding the keys written by the preprocessing step
+        output_dir: directory to write the Parquet dataset to
+        summary_path: path to write the summary to, outside of output_dir for readers of the dataset
+        chunk_size: number of rows held in memory at a time
+
+    Returns:
+        the summary, with the statistics of the first prediction column overall and by source
+
+    Raises:
+        ValueError: if the keys and the predictions of a file differ in count, or an input file with keys
+            has no predictions
+    """
+    paths = sorted(pathlib.Path(predictions_dir).rglob(f"*{PREDICTIONS_SUFFIX}"))
+    logger.info("Merging %d prediction files.", len(paths))
+    names = {path.name[: -len(PREDICTIONS_SUFFIX)] for path in paths}
+    unscored = sorted(path.name for path in pathlib.Path(keys_dir).glob("*") if path.name not in names)
+    if unscored:
+        raise ValueError(f"{keys_dir} has keys of input files without predictions: {', '.join(unscored)}.")
+    summaries = {}
+    for path in paths:
+        keys_path = f"{keys_dir}/{path.name[: -len(PREDICTIONS_SUFFIX)]}"
+        rows = merge_file(str(path), keys_path, output_dir, chunk_size, summaries)
+        logger.info("Merged %d rows of %s.", rows, path.name)
+
+    overall = PredictionSummary()
+    for summary in summaries.values():
+        overall.merge(summary)
+    report = {
+        "predictions": overall.report(),
+        "sources": {source: summary.report() for source, summary in summaries.items()},
+    }
+    pathlib.Path(summary_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(summary_path, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    logger.debug("Starting postprocessing.")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100000,
+        help="Rows of predictions held in memory at a time.",
+    )
+    args = parser.parse_args()
+
+    base_dir = "/opt/ml/processing"
+    report = merge_predictions(
+        f"{base_dir}/predictions",
+        f"{base_dir}/keys",
+        f"{base_dir}/output",
+        f"{base_dir}/summary/summary.json",
+        args.chunk_size,
+    )
+    logger.info("Merged %d predictions.", report["predictions"]["count"])
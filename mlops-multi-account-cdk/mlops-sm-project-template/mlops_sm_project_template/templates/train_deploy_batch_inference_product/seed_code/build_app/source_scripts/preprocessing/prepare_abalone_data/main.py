@@ -14,13 +14,48 @@
 # HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
-"""Feature engineers the abalone dataset."""
+"""Feature engineers the abalone dataset.
+
+By default the whole dataset is loaded into memory. When `--chunk-size` is set the script
+runs in streaming mode instead: a first pass reads the input chunk by chunk to fit the
+preprocessor, and a second pass transforms each chunk and appends it to the output splits.
+Peak memory is then bounded by the chunk size rather than the dataset size.
+
+The splits are written as headerless CSV by default, or as Parquet with `--content-type
+application/x-parquet`. In both cases the label is the first column.
+
+With `--input-dir` the script runs as one instance of a multi-instance job whose input is
+sharded by S3 key. It is then run twice: with `--statistics-only` every instance writes the
+partial statistics of its shard, then with `--statistics-dir` every instance merges all the
+partial statistics into the same fitted transformer and writes the splits of its own shard.
+
+Without a train/test split, `--num-parts` spreads the rows over that many files of about the same
+size, so that every instance of a multi-instance batch transform job gets its share of the data.
+
+With `--manifest-url` the input is a prefix of partition files and only the partitions which the
+manifest does not record as scored, with the same ETag and model package, are preprocessed, with
+the preprocessor fitted at training time packaged in the model.tar.gz of `--model-data-url`. The
+selected partitions are written to `manifest/pending.json`, and once they are scored the script
+is run again with `--commit-manifest` to record them in the manifest.
+
+With `--in-process-max-rows`, inputs of up to that many rows are scored by this script with the
+model of `--model-data-url`, and their predictions written to `--output-uri`, rather than by a
+batch transform job. The route taken is written to `routing/routing.json`.
+
+With `--write-keys`, every output_data file gets a CSV file of the same name under `keys/` with the
+source file and row number of each of its rows, in the same order, for the predictions to be joined
+back to the input rows.
+"""
+
 import argparse
+import datetime
+import json
 import logging
 import os
 import pathlib
-import requests
-import tempfile
+import pickle
+import tarfile
+import zlib
 
 import boto3
 import numpy as np
@@ -61,6 +96,29 @@ feature_columns_dtype = {
 }
 label_column_dtype = {"rings": np.float64}
 
+numeric_features = [c for c in feature_columns_names if c != "sex"]
+categorical_features = ["sex"]
+
+# Upper bound on the number of values per numeric column kept to estimate the median in
+# streaming mode. Below this many rows the median is exact.
+MEDIAN_SAMPLE_SIZE = 100000
+
+# Upper bounds of the train and validation partitions on the [0, 1) hash scale, i.e. a 70/15/15 split.
+SPLIT_BOUNDARIES = [0.7, 0.85]
+
+# Supported content types of the output splits and their file extension.
+CONTENT_TYPE_EXTENSIONS = {
+    "text/csv": "csv",
+    "application/x-parquet": "parquet",
+}
+
+# Location of the fitted preprocessor, in the preprocessor output and inside model.tar.gz, where
+# the evaluation script packages it next to the model.
+PREPROCESSOR_PATH = "preprocessor/preprocessor.pkl"
+
+# First byte of pickles of protocol 2 and later, which xgboost's own model formats never start with.
+PICKLE_PROTOCOL_MARKER = b"\x80"
+
 
 def merge_two_dicts(x, y):
     """Merges two dicts, returning a new copy."""
@@ -69,40 +127,47 @@ def merge_two_dicts(x, y):
     return z
 
 
-if __name__ == "__main__":
-    logger.debug("Starting preprocessing.")
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--input-data", type=str, required=True)
-    parser.add_argument("--do-train-test-split", type=str, default="True")
-    args = parser.parse_args()
+def read_abalone_csv(path, chunk_size=None):
+    """Reads the headerless abalone CSV.
 
-    base_dir = "/opt/ml/processing"
-    pathlib.Path(f"{base_dir}/data").mkdir(parents=True, exist_ok=True)
-    input_data = args.input_data
-    logger.info("Input data path: %s", input_data)
-    bucket = input_data.split("/")[2]
-    key = "/".join(input_data.split("/")[3:])
+    Args:
+        path: local path of the CSV file
+        chunk_size: if set, number of rows per chunk
 
-    logger.info("Downloading data from bucket: %s, key: %s", bucket, key)
-    fn = f"{base_dir}/data/abalone-dataset.csv"
-    s3 = boto3.resource("s3")
-    s3.Bucket(bucket).download_file(key, fn)
-
-    logger.debug("Reading downloaded data.")
-    df = pd.read_csv(
-        fn,
+    Returns:
+        a DataFrame, or an iterator of DataFrames when chunk_size is set
+    """
+    return pd.read_csv(
+        path,
         header=None,
         names=feature_columns_names + [label_column],
         dtype=merge_two_dicts(feature_columns_dtype, label_column_dtype),
+        chunksize=chunk_size or None,
     )
-    os.unlink(fn)
 
-    logger.debug("Defining transformers.")
-    numeric_features = list(feature_columns_names)
-    numeric_features.remove("sex")
+
+def assign_splits(df, split_key=None):
+    """Assigns each row to train (0), validation (1) or test (2) from a stable hash of its key.
+
+    A given key always lands in the same partition, whichever chunk or instance reads it, so re-runs on the same
+    data give identical splits.
+
+    Args:
+        df: raw rows, including the label
+        split_key: columns identifying a row, the whole row content is hashed if not set
+
+    Returns:
+        numpy array holding the partition of each row
+    """
+    keys = df[split_key] if split_key else df
+    hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+    return np.digitize(hashes / np.float64(2**64), SPLIT_BOUNDARIES)
+
+
+def build_preprocessor():
+    """Defines the (unfitted) feature transformer."""
     numeric_transformer = Pipeline(steps=[("imputer", SimpleImputer(strategy="median")), ("scaler", StandardScaler())])
 
-    categorical_features = ["sex"]
     categorical_transformer = Pipeline(
         steps=[
             ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
@@ -110,28 +175,974 @@ if __name__ == "__main__":
         ]
     )
 
-    preprocess = ColumnTransformer(
+    return ColumnTransformer(
         transformers=[
             ("num", numeric_transformer, numeric_features),
             ("cat", categorical_transformer, categorical_features),
         ]
     )
 
+
+class StreamingFeatureStatistics:
+    """Accumulates the statistics needed to fit the preprocessor one chunk at a time.
+
+    For every numeric column it keeps the count, mean and sum of squared deviations of the
+    observed values (combined with Chan's parallel update, which is numerically stable), the
+    number of missing values and a bounded uniform sample used to estimate the median. For the
+    categorical column it keeps the set of observed values.
+    """
+
+    def __init__(self, sample_size=MEDIAN_SAMPLE_SIZE, seed=0):
+        n_features = len(numeric_features)
+        self.sample_size = sample_size
+        self.count = np.zeros(n_features)
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+        self.missing = np.zeros(n_features)
+        self.categories = set()
+        self.categories_missing = False
+        # The sample keeps the values holding the smallest random priorities seen so far, which
+        # is a uniform sample without replacement of everything observed.
+        self.sample_values = [np.empty(0) for _ in numeric_features]
+        self.sample_priorities = [np.empty(0) for _ in numeric_features]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, df):
+        """Folds one chunk of features into the statistics.
+
+        Args:
+            df: DataFrame holding the feature columns
+        """
+        values = df[numeric_features].to_numpy(dtype=np.float64)
+        observed = ~np.isnan(values)
+        count = observed.sum(axis=0)
+        total = np.where(observed, values, 0.0).sum(axis=0)
+        mean = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+        m2 = np.where(observed, (values - mean) ** 2, 0.0).sum(axis=0)
+        self._combine(count, mean, m2)
+        self.missing += (~observed).sum(axis=0)
+
+        for i in range(len(numeric_features)):
+            column = values[observed[:, i], i]
+            self._sample(i, column, self._rng.random(len(column)))
+
+        categories = df[categorical_features[0]]
+        self.categories.update(categories.dropna().unique())
+        self.categories_missing |= bool(categories.isna().any())
+
+    def merge(self, other):
+        """Folds the statistics accumulated by another instance into these ones.
+
+        Args:
+            other: a StreamingFeatureStatistics
+        """
+        self._combine(other.count, other.mean, other.m2)
+        self.missing = self.missing + other.missing
+        for i in range(len(numeric_features)):
+            self._sample(i, other.sample_values[i], other.sample_priorities[i])
+        self.categories.update(other.categories)
+        self.categories_missing |= other.categories_missing
+
+    def save(self, path):
+        """Saves the statistics to a `.npz` file."""
+        samples = {}
+        for i, c in enumerate(numeric_features):
+            samples[f"sample_values_{c}"] = self.sample_values[i]
+            samples[f"sample_priorities_{c}"] = self.sample_priorities[i]
+        np.savez(
+            path,
+            count=self.count,
+            mean=self.mean,
+            m2=self.m2,
+            missing=self.missing,
+            categories=np.array(sorted(self.categories), dtype=str),
+            categories_missing=self.categories_missing,
+            **samples,
+        )
+
+    @classmethod
+    def load(cls, path, sample_size=MEDIAN_SAMPLE_SIZE):
+        """Loads statistics saved with `save`."""
+        stats = cls(sample_size=sample_size)
+        with np.load(path) as data:
+            stats.count = data["count"]
+            stats.mean = data["mean"]
+            stats.m2 = data["m2"]
+            stats.missing = data["missing"]
+            stats.categories = set(data["categories"].tolist())
+            stats.categories_missing = bool(data["categories_missing"])
+            stats.sample_values = [data[f"sample_values_{c}"] for c in numeric_features]
+            stats.sample_priorities = [data[f"sample_priorities_{c}"] for c in numeric_features]
+        return stats
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        safe_total = np.where(total > 0, total, 1.0)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / safe_total
+        self.m2 = self.m2 + m2 + delta**2 * self.count * count / safe_total
+        self.count = total
+
+    def _sample(self, i, values, priorities):
+        values = np.concatenate((self.sample_values[i], values))
+        priorities = np.concatenate((self.sample_priorities[i], priorities))
+        if len(values) > self.sample_size:
+            keep = np.argpartition(priorities, self.sample_size)[: self.sample_size]
+            values, priorities = values[keep], priorities[keep]
+        self.sample_values[i] = values
+        self.sample_priorities[i] = priorities
+
+    def medians(self):
+        """Returns the (estimated) median of every numeric column."""
+        return np.array([np.median(v) if len(v) else np.nan for v in self.sample_values])
+
+    def fit_preprocessor(self):
+        """Builds a preprocessor fitted from the accumulated statistics.
+
+        The result is equivalent to calling `build_preprocessor().fit(df)` on the full data,
+        except that the medians are estimated from a sample once a column holds more than
+        `sample_size` values.
+
+        Returns:
+            a fitted ColumnTransformer
+        """
+        medians = self.medians()
+        categories = sorted(self.categories)
+        if self.categories_missing:
+            categories.append("missing")
+        if not categories:
+            categories = ["missing"]
+
+        # Fitting on a small frame gives every transformer its fitted structure (feature names,
+        # one-hot categories, imputer medians); the scaler moments are then set from the stream.
+        seed_frame = pd.DataFrame({c: [medians[i]] * len(categories) for i, c in enumerate(numeric_features)})
+        seed_frame.insert(0, categorical_features[0], categories)
+        preprocess = build_preprocessor().fit(seed_frame)
+
+        # Missing values are imputed with the median before scaling, so the scaler sees them as
+        # extra observations equal to the median.
+        total = self.count + self.missing
+        delta = medians - self.mean
+        mean = self.mean + delta * self.missing / total
+        m2 = self.m2 + delta**2 * self.count * self.missing / total
+        var = m2 / total
+
+        scaler = preprocess.named_transformers_["num"].named_steps["scaler"]
+        scaler.mean_ = mean
+        scaler.var_ = var
+        scaler.scale_ = np.where(var > np.finfo(np.float64).eps, np.sqrt(var), 1.0)
+        scaler.n_samples_seen_ = int(total[0])
+        return preprocess
+
+
+class SplitWriter:
+    """Appends rows of floats to one output file, as headerless CSV or Parquet.
+
+    With a keys_path, the keys of the rows are appended to that CSV file as well.
+    """
+
+    def __init__(self, path, content_type="text/csv", keys_path=None):
+        self.path = path
+        self.content_type = content_type
+        self.keys_path = keys_path
+        self.rows = 0
+        self._file = None
+        self._keys_file = None
+        self._parquet_writer = None
+
+    def write(self, rows, keys=None):
+        """Appends a 2D array of rows, and the DataFrame of their keys, to the file."""
+        if self.keys_path is not None:
+            if self._keys_file is None:
+                self._keys_file = open(self.keys_path, "w")
+                keys.iloc[:0].to_csv(self._keys_file, index=False)
+            keys.to_csv(self._keys_file, header=False, index=False)
+        if self.content_type == "application/x-parquet":
+            # pyarrow is only needed, and only imported, for Parquet output.
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_arrays(
+                [pa.array(rows[:, i]) for i in range(rows.shape[1])],
+                names=[str(i) for i in range(rows.shape[1])],
+            )
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            if self._file is None:
+                self._file = open(self.path, "w")
+            pd.DataFrame(rows).to_csv(self._file, header=False, index=False)
+        self.rows += len(rows)
+
+    def close(self):
+        """Flushes and closes the file."""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if self._file is not None:
+            self._file.close()
+        if self._keys_file is not None:
+            self._keys_file.close()
+
+
+class PartitionedWriter:
+    """Spreads rows over several part files of about the same number of rows, one SplitWriter each.
+
+    Every batch of rows is cut into one slice per part, the larger slices going to the parts with
+    the fewest rows, so that the parts never differ by more than one row.
+    """
+
+    def __init__(self, path_template, num_parts, content_type="text/csv", keys_dir=None):
+        self.writers = [
+            SplitWriter(path_template.format(part=i), content_type, keys_path(path_template.format(part=i), keys_dir))
+            for i in range(num_parts)
+        ]
+
+    @property
+    def rows(self):
+        return sum(writer.rows for writer in self.writers)
+
+    def write(self, rows, keys=None):
+        """Appends a 2D array of rows, and the DataFrame of their keys, to the parts."""
+        slices = sorted(np.array_split(np.arange(len(rows)), len(self.writers)), key=len, reverse=True)
+        for writer, part in zip(sorted(self.writers, key=lambda writer: writer.rows), slices):
+            if len(part):
+                writer.write(rows[part], None if keys is None else keys.iloc[part])
+
+    def close(self):
+        """Flushes and closes the part files."""
+        for writer in self.writers:
+            writer.close()
+
+
+def keys_path(path, keys_dir):
+    """Returns the path of the keys file of an output file, None without a keys directory."""
+    return f"{keys_dir}/{os.path.basename(path)}" if keys_dir else None
+
+
+def output_data_writer(path_prefix, extension, content_type="text/csv", num_parts=1, keys_dir=None):
+    """Opens the writer of the output_data rows, a single file or num_parts part files.
+
+    With a keys_dir, the keys of the rows are written to a file of the same name in that directory.
+    """
+    if num_parts > 1:
+        return PartitionedWriter(f"{path_prefix}-part-{{part:05d}}.{extension}", num_parts, content_type, keys_dir)
+    path = f"{path_prefix}.{extension}"
+    return SplitWriter(path, content_type, keys_path(path, keys_dir))
+
+
+def row_keys(source, start, count):
+    """Returns the keys of count rows of a source file, from row number start."""
+    return pd.DataFrame({"source": source, "row": np.arange(start, start + count)})
+
+
+def write_split(rows, path, content_type="text/csv"):
+    """Writes a 2D array of rows to a single file."""
+    writer = SplitWriter(path, content_type)
+    try:
+        writer.write(rows)
+    finally:
+        writer.close()
+
+
+def preprocess_in_memory(
+    input_path,
+    base_dir,
+    do_train_test_split=True,
+    content_type="text/csv",
+    split_key=None,
+    num_parts=1,
+    source=None,
+):
+    """Fits the transformer on the whole dataset at once and writes the splits.
+
+    Args:
+        input_path: local path of the raw CSV file
+        base_dir: processing directory holding the output folders
+        do_train_test_split: write train, validation and test splits rather than one file
+        content_type: content type of the output files
+        split_key: columns hashed to assign rows to splits, the whole row if not set
+        num_parts: number of files the rows are spread over without a train/test split
+        source: name of the input in the keys written to base_dir/keys without a train/test split, no keys if not set
+    """
+    logger.debug("Reading downloaded data.")
+    df = read_abalone_csv(input_path)
+    assignment = assign_splits(df, split_key) if do_train_test_split else None
+
     logger.info("Applying transforms.")
+    preprocess = build_preprocessor()
     y = df.pop("rings")
     X_pre = preprocess.fit_transform(df)
     y_pre = y.to_numpy().reshape(len(y), 1)
 
-    if args.do_train_test_split == "True":
+    extension = CONTENT_TYPE_EXTENSIONS[content_type]
+    if do_train_test_split:
+        save_preprocessor(preprocess, base_dir)
         X = np.concatenate((y_pre, X_pre), axis=1)
         logger.info("Splitting %d rows of data into train, validation, test datasets.", len(X))
-        np.random.shuffle(X)
-        train, validation, test = np.split(X, [int(0.7 * len(X)), int(0.85 * len(X))])
-
         logger.info("Writing out datasets to %s.", base_dir)
-        pd.DataFrame(train).to_csv(f"{base_dir}/train/train.csv", header=False, index=False)
-        pd.DataFrame(validation).to_csv(f"{base_dir}/validation/validation.csv", header=False, index=False)
-        pd.DataFrame(test).to_csv(f"{base_dir}/test/test.csv", header=False, index=False)
+        for i, split in enumerate(["train", "validation", "test"]):
+            write_split(X[assignment == i], f"{base_dir}/{split}/{split}.{extension}", content_type)
     else:
         logger.info("Writing out datasets to %s.", base_dir)
-        pd.DataFrame(X_pre).to_csv(f"{base_dir}/output_data/data.csv", header=False, index=False)
+        keys_dir = f"{base_dir}/keys" if source else None
+        writer = output_data_writer(f"{base_dir}/output_data/data", extension, content_type, num_parts, keys_dir)
+        try:
+            writer.write(X_pre, row_keys(source, 0, len(X_pre)) if source else None)
+        finally:
+            writer.close()
+
+
+def save_preprocessor(preprocess, base_dir):
+    """Pickles the fitted preprocessor, for the evaluation step to package it with the model."""
+    path = pathlib.Path(base_dir, PREPROCESSOR_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump(preprocess, f)
+
+
+def iter_chunks(input_paths, chunk_size=None):
+    """Yields the rows of several CSV files as DataFrames.
+
+    Args:
+        input_paths: local paths of the raw CSV files
+        chunk_size: if set, number of rows per DataFrame, otherwise one DataFrame per file
+    """
+    for path in input_paths:
+        if chunk_size:
+            yield from read_abalone_csv(path, chunk_size)
+        else:
+            yield read_abalone_csv(path)
+
+
+def compute_statistics(input_paths, chunk_size=None, seed=0):
+    """Accumulates the preprocessor statistics over the raw CSV files.
+
+    Args:
+        input_paths: local paths of the raw CSV files
+        chunk_size: if set, number of rows held in memory at a time
+        seed: seed of the median sample, must differ between instances of a sharded job
+
+    Returns:
+        a StreamingFeatureStatistics
+    """
+    stats = StreamingFeatureStatistics(seed=seed)
+    for chunk in iter_chunks(input_paths, chunk_size):
+        stats.update(chunk.drop(columns=[label_column]))
+    return stats
+
+
+def transform_and_write(
+    preprocess,
+    input_paths,
+    base_dir,
+    chunk_size=None,
+    do_train_test_split=True,
+    content_type="text/csv",
+    part=None,
+    split_key=None,
+    num_parts=1,
+    sources=None,
+):
+    """Transforms the raw CSV files with a fitted preprocessor and appends them to the splits.
+
+    Rows are assigned to train, validation and test with 70/15/15 probabilities from a hash of their key.
+
+    Args:
+        preprocess: the fitted ColumnTransformer
+        input_paths: local paths of the raw CSV files
+        base_dir: processing directory holding the output folders
+        chunk_size: if set, number of rows held in memory at a time
+        do_train_test_split: write train, validation and test splits rather than one file
+        content_type: content type of the output files
+        part: suffix of the output file names, so that several instances can write to the same prefix
+        split_key: columns hashed to assign rows to splits, the whole row if not set
+        num_parts: number of files the rows are spread over without a train/test split
+        sources: names of the input files, in the keys written to base_dir/keys without a train/test split,
+            no keys if not set
+    """
+    logger.info("Applying transforms and writing out datasets to %s.", base_dir)
+    extension = CONTENT_TYPE_EXTENSIONS[content_type]
+    suffix = f"-{part}" if part else ""
+    if do_train_test_split:
+        save_preprocessor(preprocess, base_dir)
+        splits = ["train", "validation", "test"]
+        writers = {
+            split: SplitWriter(f"{base_dir}/{split}/{split}{suffix}.{extension}", content_type) for split in splits
+        }
+    else:
+        splits = ["output_data"]
+        writers = {
+            "output_data": output_data_writer(
+                f"{base_dir}/output_data/data{suffix}",
+                extension,
+                content_type,
+                num_parts,
+                f"{base_dir}/keys" if sources else None,
+            )
+        }
+    try:
+        for path in input_paths:
+            # row number in the input file of the first row of the chunk
+            start = 0
+            for chunk in iter_chunks([path], chunk_size):
+                keys = None
+                if do_train_test_split:
+                    assignment = assign_splits(chunk, split_key)
+                    y = chunk.pop(label_column).to_numpy()
+                    X = np.column_stack((y, preprocess.transform(chunk)))
+                else:
+                    chunk.pop(label_column)
+                    X = preprocess.transform(chunk)
+                    assignment = np.zeros(len(X), dtype=int)
+                    if sources:
+                        keys = row_keys(sources[path], start, len(X))
+                start += len(X)
+                for i, split in enumerate(splits):
+                    part = X[assignment == i]
+                    if len(part):
+                        writers[split].write(part, keys)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    logger.info("Wrote %s rows.", {split: writer.rows for split, writer in writers.items()})
+
+
+def preprocess_streaming(
+    input_path,
+    base_dir,
+    chunk_size,
+    do_train_test_split=True,
+    content_type="text/csv",
+    split_key=None,
+    num_parts=1,
+    source=None,
+):
+    """Fits the transformer and writes the splits in two passes over chunks of the input.
+
+    Args:
+        input_path: local path of the raw CSV file
+        base_dir: processing directory holding the output folders
+        chunk_size: number of rows held in memory at a time
+        do_train_test_split: write train, validation and test splits rather than one file
+        content_type: content type of the output files
+        split_key: columns hashed to assign rows to splits, the whole row if not set
+        num_parts: number of files the rows are spread over without a train/test split
+        source: name of the input in the keys written to base_dir/keys without a train/test split, no keys if not set
+    """
+    logger.info("Fitting transforms on chunks of %d rows.", chunk_size)
+    stats = compute_statistics([input_path], chunk_size)
+    preprocess = stats.fit_preprocessor()
+    logger.info("Fitted transforms on %d rows.", stats.count[0] + stats.missing[0])
+
+    transform_and_write(
+        preprocess,
+        [input_path],
+        base_dir,
+        chunk_size,
+        do_train_test_split,
+        content_type,
+        split_key=split_key,
+        num_parts=num_parts,
+        sources={input_path: source} if source else None,
+    )
+
+
+def get_current_host():
+    """Returns the name of this instance of the processing job."""
+    try:
+        with open("/opt/ml/config/resourceconfig.json") as f:
+            return json.load(f)["current_host"]
+    except (OSError, KeyError, ValueError):
+        return "algo-1"
+
+
+def list_input_files(input_dir):
+    """Lists the files of this instance's input shard."""
+    return sorted(str(p) for p in pathlib.Path(input_dir).rglob("*") if p.is_file())
+
+
+def preprocess_shard_statistics(input_dir, statistics_dir, host, chunk_size=None):
+    """Writes the partial preprocessor statistics of this instance's shard.
+
+    Args:
+        input_dir: local directory holding this instance's input shard
+        statistics_dir: directory to write the statistics to
+        host: name of this instance
+        chunk_size: if set, number of rows held in memory at a time
+    """
+    input_paths = list_input_files(input_dir)
+    logger.info("Computing statistics of %d input files on %s.", len(input_paths), host)
+    stats = compute_statistics(input_paths, chunk_size, seed=zlib.crc32(host.encode()))
+    pathlib.Path(statistics_dir).mkdir(parents=True, exist_ok=True)
+    stats.save(f"{statistics_dir}/{host}.npz")
+
+
+def merge_statistics(statistics_dir):
+    """Merges the partial statistics written by every instance.
+
+    The files are merged in name order, so every instance builds the same transformer.
+
+    Args:
+        statistics_dir: local directory holding the partial statistics
+
+    Returns:
+        a StreamingFeatureStatistics
+    """
+    paths = sorted(pathlib.Path(statistics_dir).glob("*.npz"))
+    logger.info("Merging statistics of %d instances.", len(paths))
+    stats = StreamingFeatureStatistics()
+    for path in paths:
+        stats.merge(StreamingFeatureStatistics.load(path))
+    return stats
+
+
+def preprocess_shard(
+    input_dir,
+    statistics_dir,
+    base_dir,
+    host,
+    chunk_size=None,
+    do_train_test_split=True,
+    content_type="text/csv",
+    split_key=None,
+    num_parts=1,
+    write_keys=False,
+):
+    """Fits the transformer from the merged statistics and writes the splits of this instance's shard.
+
+    Args:
+        input_dir: local directory holding this instance's input shard
+        statistics_dir: local directory holding the partial statistics of every instance
+        base_dir: processing directory holding the output folders
+        host: name of this instance, used to name its output files
+        chunk_size: if set, number of rows held in memory at a time
+        do_train_test_split: write train, validation and test splits rather than one file
+        content_type: content type of the output files
+        split_key: columns hashed to assign rows to splits, the whole row if not set
+        num_parts: number of files the rows of this instance are spread over without a train/test split
+        write_keys: write the keys of the rows, named by their path in input_dir, without a train/test split
+    """
+    preprocess = merge_statistics(statistics_dir).fit_preprocessor()
+    input_paths = list_input_files(input_dir)
+    transform_and_write(
+        preprocess,
+        input_paths,
+        base_dir,
+        chunk_size,
+        do_train_test_split,
+        content_type,
+        part=host,
+        split_key=split_key,
+        num_parts=num_parts,
+        sources={path: os.path.relpath(path, input_dir) for path in input_paths} if write_keys else None,
+    )
+
+
+def split_s3_uri(uri):
+    """Splits an S3 URI into its bucket and key."""
+    bucket, _, key = uri[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def load_manifest(s3_client, manifest_url):
+    """Loads the manifest of the scored partitions, empty if it does not exist yet.
+
+    The manifest is a JSON object with the ETag, model package, execution and output of the last
+    scoring of every partition, by S3 URI.
+    """
+    bucket, key = split_s3_uri(manifest_url)
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except s3_client.exceptions.NoSuchKey:
+        return {"partitions": {}}
+    return json.loads(body)
+
+
+def list_partitions(s3_client, input_prefix):
+    """Lists the non-empty files under an S3 prefix, with their S3 URI and ETag."""
+    bucket, prefix = split_s3_uri(input_prefix)
+    partitions = []
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            if item["Size"] > 0:
+                partitions.append({"uri": f"s3://{bucket}/{item['Key']}", "etag": item["ETag"]})
+    return partitions
+
+
+def select_new_partitions(partitions, manifest, model_package_arn):
+    """Selects the partitions which are new, changed, or were scored with another model package."""
+    scored = manifest["partitions"]
+    return [
+        partition
+        for partition in partitions
+        if scored.get(partition["uri"], {}).get("etag") != partition["etag"]
+        or scored[partition["uri"]].get("model_package_arn") != model_package_arn
+    ]
+
+
+def preprocess_new_partitions(
+    s3_client,
+    input_prefix,
+    manifest_url,
+    model_package_arn,
+    base_dir,
+    chunk_size=None,
+    content_type="text/csv",
+    num_parts=1,
+    write_keys=False,
+    model_data_url=None,
+):
+    """Preprocesses the partitions of the input which the manifest does not record as scored.
+
+    The partitions are transformed with the preprocessor fitted at training time, which is packaged
+    in the model.tar.gz, so that they are scaled like the training data whichever partitions are new.
+    The selected partitions are written to manifest/pending.json along with their count, which is
+    0 when there is nothing to score, for the pipeline to skip the transform.
+
+    Args:
+        s3_client: boto3 S3 client
+        input_prefix: S3 URI prefix of the partition files
+        manifest_url: S3 URI of the manifest of the scored partitions
+        model_package_arn: ARN of the model package the partitions are scored with
+        base_dir: processing directory holding the output folders
+        chunk_size: if set, number of rows held in memory at a time
+        content_type: content type of the output files
+        num_parts: number of files the rows are spread over
+        write_keys: write the keys of the rows, named by the S3 URI of their partition
+        model_data_url: S3 URI of the model.tar.gz the fitted preprocessor is packaged in
+    """
+    partitions = list_partitions(s3_client, input_prefix)
+    pending = select_new_partitions(partitions, load_manifest(s3_client, manifest_url), model_package_arn)
+    logger.info("%d of %d partitions to score.", len(pending), len(partitions))
+
+    input_paths = []
+    sources = {}
+    for i, partition in enumerate(pending):
+        bucket, key = split_s3_uri(partition["uri"])
+        path = f"{base_dir}/data/partition-{i:05d}.csv"
+        s3_client.download_file(bucket, key, path)
+        input_paths.append(path)
+        sources[path] = partition["uri"]
+    if input_paths:
+        preprocess = load_preprocessor(s3_client, model_data_url, f"{base_dir}/model") if model_data_url else None
+        if preprocess is None:
+            logger.warning("No fitted preprocessor packaged with the model, fitting it on the new partitions.")
+            preprocess = compute_statistics(input_paths, chunk_size).fit_preprocessor()
+        transform_and_write(
+            preprocess,
+            input_paths,
+            base_dir,
+            chunk_size,
+            False,
+            content_type,
+            num_parts=num_parts,
+            sources=sources if write_keys else None,
+        )
+        for path in input_paths:
+            os.unlink(path)
+
+    pathlib.Path(f"{base_dir}/manifest").mkdir(parents=True, exist_ok=True)
+    with open(f"{base_dir}/manifest/pending.json", "w") as f:
+        json.dump({"count": len(pending), "model_package_arn": model_package_arn, "partitions": pending}, f)
+
+
+def commit_manifest(s3_client, manifest_url, pending_path, execution_id, output_uri):
+    """Records the partitions of pending.json as scored in the manifest.
+
+    The manifest is read again just before it is written, so that only the entries of the
+    partitions of this execution change.
+
+    Args:
+        s3_client: boto3 S3 client
+        manifest_url: S3 URI of the manifest of the scored partitions
+        pending_path: local path of the pending.json written by the preprocessing
+        execution_id: ID of the pipeline execution which scored the partitions
+        output_uri: S3 URI of the predictions of the execution
+    """
+    with open(pending_path) as f:
+        pending = json.load(f)
+    manifest = load_manifest(s3_client, manifest_url)
+    scored_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    for partition in pending["partitions"]:
+        manifest["partitions"][partition["uri"]] = {
+            "etag": partition["etag"],
+            "model_package_arn": pending["model_package_arn"],
+            "execution_id": execution_id,
+            "output_uri": output_uri,
+            "scored_at": scored_at,
+        }
+    bucket, key = split_s3_uri(manifest_url)
+    s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest, indent=2).encode("utf-8"))
+    logger.info("Recorded %d scored partitions in %s.", len(pending["partitions"]), manifest_url)
+
+
+def count_rows(paths, limit):
+    """Counts the lines of CSV files, stopping once there are more than limit."""
+    rows = 0
+    for path in paths:
+        with open(path) as f:
+            for _ in f:
+                rows += 1
+                if rows > limit:
+                    return rows
+    return rows
+
+
+def extract_model_artifact(s3_client, model_data_url, model_dir):
+    """Downloads and extracts a model.tar.gz into model_dir, unless it already was."""
+    if not os.path.exists(f"{model_dir}/model.tar.gz"):
+        bucket, key = split_s3_uri(model_data_url)
+        pathlib.Path(model_dir).mkdir(parents=True, exist_ok=True)
+        s3_client.download_file(bucket, key, f"{model_dir}/model.tar.gz")
+        with tarfile.open(f"{model_dir}/model.tar.gz") as tar:
+            tar.extractall(path=model_dir)
+
+
+def load_preprocessor(s3_client, model_data_url, model_dir):
+    """Loads the preprocessor fitted at training time from a model.tar.gz.
+
+    Returns:
+        the fitted ColumnTransformer, or None if the model was packaged without it
+    """
+    extract_model_artifact(s3_client, model_data_url, model_dir)
+    path = pathlib.Path(model_dir, PREPROCESSOR_PATH)
+    if not path.exists():
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def load_model(s3_client, model_data_url, model_dir):
+    """Downloads and loads the xgboost Booster of a model.tar.gz.
+
+    The built-in algorithm saves the model pickled up to version 1.2 and in xgboost's own format,
+    binary, JSON or UBJSON, from version 1.3. Only files starting with the pickle protocol marker
+    are unpickled, the others are loaded with `Booster.load_model`.
+    """
+    import xgboost
+
+    extract_model_artifact(s3_client, model_data_url, model_dir)
+    model_path = f"{model_dir}/xgboost-model"
+    with open(model_path, "rb") as f:
+        if f.read(1) == PICKLE_PROTOCOL_MARKER:
+            f.seek(0)
+            return pickle.load(f)
+    model = xgboost.Booster()
+    model.load_model(model_path)
+    return model
+
+
+def score_in_process(s3_client, model, input_paths, output_uri):
+    """Scores preprocessed CSV files and writes their predictions like a batch transform job would.
+
+    Every file is predicted in one vectorized call, and its predictions are written one per line to
+    the output URI, as the input file name followed by .out.
+    """
+    # xgboost is only needed, and only imported, to score in process.
+    import xgboost
+
+    bucket, prefix = split_s3_uri(output_uri)
+    for path in input_paths:
+        features = pd.read_csv(path, header=None).to_numpy(dtype=np.float32)
+        if hasattr(model, "inplace_predict"):
+            predictions = model.inplace_predict(np.ascontiguousarray(features))
+        else:
+            predictions = model.predict(xgboost.DMatrix(features))
+        body = "".join(f"{prediction}\n" for prediction in predictions.tolist())
+        key = f"{prefix.rstrip('/')}/{os.path.basename(path)}.out".lstrip("/")
+        s3_client.put_object(Bucket=bucket, Key=key, Body=body.encode("utf-8"))
+        logger.info("Wrote %d predictions to s3://%s/%s.", len(predictions), bucket, key)
+
+
+def route_scoring(s3_client, base_dir, max_rows, model_data_url, output_uri, content_type="text/csv"):
+    """Scores the preprocessed data in process if it is small enough, and writes the route taken.
+
+    The route, written to routing/routing.json, is "none" when there are no rows, "in-process"
+    when there are up to max_rows and they were scored here, and "transform" otherwise, for the
+    pipeline to run the batch transform job.
+
+    Args:
+        s3_client: boto3 S3 client
+        base_dir: processing directory holding the output folders
+        max_rows: maximum number of rows scored in process, 0 to always run the transform job
+        model_data_url: S3 URI of the model.tar.gz of the model
+        output_uri: S3 URI prefix of the predictions
+        content_type: content type of the preprocessed data, only CSV is scored in process
+
+    Returns:
+        the route
+    """
+    input_paths = sorted(str(p) for p in pathlib.Path(f"{base_dir}/output_data").glob("*") if p.is_file())
+    if content_type != "text/csv":
+        route = "transform" if input_paths else "none"
+    else:
+        rows = count_rows(input_paths, max_rows)
+        route = "none" if rows == 0 else "in-process" if rows <= max_rows else "transform"
+    logger.info("Scoring route: %s.", route)
+
+    if route == "in-process":
+        model = load_model(s3_client, model_data_url, f"{base_dir}/model")
+        score_in_process(s3_client, model, input_paths, output_uri)
+
+    pathlib.Path(f"{base_dir}/routing").mkdir(parents=True, exist_ok=True)
+    with open(f"{base_dir}/routing/routing.json", "w") as f:
+        json.dump({"route": route}, f)
+    return route
+
+
+if __name__ == "__main__":
+    logger.debug("Starting preprocessing.")
+    parser = argparse.ArgumentParser()
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument("--input-data", type=str, help="S3 URI of the raw CSV file.")
+    input_group.add_argument("--input-dir", type=str, help="Local directory holding this instance's input shard.")
+    input_group.add_argument(
+        "--commit-manifest",
+        type=str,
+        help="Local path of the pending.json of the scored partitions to record in the --manifest-url manifest.",
+    )
+    parser.add_argument(
+        "--statistics-only",
+        action="store_true",
+        help="With --input-dir, only write the partial statistics of the shard to --statistics-dir.",
+    )
+    parser.add_argument(
+        "--statistics-dir",
+        type=str,
+        default="/opt/ml/processing/statistics",
+        help="With --input-dir, directory holding the partial statistics of every instance.",
+    )
+    parser.add_argument("--do-train-test-split", type=str, default="True")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=0,
+        help="Rows per chunk in streaming mode. 0 loads the whole dataset in memory.",
+    )
+    parser.add_argument(
+        "--content-type",
+        type=str,
+        default="text/csv",
+        choices=sorted(CONTENT_TYPE_EXTENSIONS),
+        help="Content type of the output files.",
+    )
+    parser.add_argument(
+        "--split-key",
+        type=str,
+        default="",
+        help="Comma-separated columns hashed to assign rows to splits. Empty hashes the whole row.",
+    )
+    parser.add_argument(
+        "--num-parts",
+        type=int,
+        default=1,
+        help="Number of files the rows are spread over without a train/test split, e.g. one per transform instance.",
+    )
+    parser.add_argument(
+        "--manifest-url",
+        type=str,
+        default="",
+        help="S3 URI of the manifest of the scored partitions, --input-data is then a prefix of partitions.",
+    )
+    parser.add_argument("--model-package-arn", type=str, default="", help="Model package the data is scored with.")
+    parser.add_argument("--execution-id", type=str, default="", help="With --commit-manifest, the pipeline execution.")
+    parser.add_argument("--output-uri", type=str, default="", help="S3 URI of the predictions.")
+    parser.add_argument(
+        "--in-process-max-rows",
+        type=int,
+        default=None,
+        help="Score inputs of up to this many rows in process, and write the scoring route to routing/routing.json.",
+    )
+    parser.add_argument(
+        "--model-data-url",
+        type=str,
+        default="",
+        help="S3 URI of the model.tar.gz to score with, and of the fitted preprocessor with --manifest-url.",
+    )
+    parser.add_argument(
+        "--write-keys",
+        action="store_true",
+        help="Without a train/test split, write the source and row number of the output_data rows to keys/.",
+    )
+    args = parser.parse_args()
+    split_key = [c for c in args.split_key.split(",") if c]
+
+    base_dir = "/opt/ml/processing"
+    do_train_test_split = args.do_train_test_split == "True"
+    if args.write_keys and not do_train_test_split:
+        pathlib.Path(f"{base_dir}/keys").mkdir(parents=True, exist_ok=True)
+    if args.commit_manifest:
+        commit_manifest(boto3.client("s3"), args.manifest_url, args.commit_manifest, args.execution_id, args.output_uri)
+    elif args.manifest_url:
+        pathlib.Path(f"{base_dir}/data").mkdir(parents=True, exist_ok=True)
+        preprocess_new_partitions(
+            boto3.client("s3"),
+            args.input_data,
+            args.manifest_url,
+            args.model_package_arn,
+            base_dir,
+            args.chunk_size,
+            args.content_type,
+            args.num_parts,
+            args.write_keys,
+            args.model_data_url,
+        )
+    elif args.input_dir:
+        host = get_current_host()
+        if args.statistics_only:
+            preprocess_shard_statistics(args.input_dir, args.statistics_dir, host, args.chunk_size)
+        else:
+            preprocess_shard(
+                args.input_dir,
+                args.statistics_dir,
+                base_dir,
+                host,
+                args.chunk_size,
+                do_train_test_split,
+                args.content_type,
+                split_key,
+                args.num_parts,
+                args.write_keys,
+            )
+    else:
+        pathlib.Path(f"{base_dir}/data").mkdir(parents=True, exist_ok=True)
+        input_data = args.input_data
+        logger.info("Input data path: %s", input_data)
+        bucket = input_data.split("/")[2]
+        key = "/".join(input_data.split("/")[3:])
+
+        logger.info("Downloading data from bucket: %s, key: %s", bucket, key)
+        fn = f"{base_dir}/data/abalone-dataset.csv"
+        s3 = boto3.resource("s3")
+        s3.Bucket(bucket).download_file(key, fn)
+
+        source = input_data if args.write_keys else None
+        if args.chunk_size > 0:
+            preprocess_streaming(
+                fn, base_dir, args.chunk_size, do_train_test_split, args.content_type, split_key, args.num_parts, source
+            )
+        else:
+            preprocess_in_memory(
+                fn, base_dir, do_train_test_split, args.content_type, split_key, args.num_parts, source
+            )
+        os.unlink(fn)
+
+    if args.in_process_max_rows is not None and not args.commit_manifest:
+        route = route_scoring(
+            boto3.client("s3"),
+            base_dir,
+            args.in_process_max_rows,
+            args.model_data_url,
+            args.output_uri,
+            args.content_type,
+        )
+        # the transform route records the partitions once the transform job succeeded
+        if route == "in-process" and args.manifest_url:
+            commit_manifest(
+                boto3.client("s3"),
+                args.manifest_url,
+                f"{base_dir}/manifest/pending.json",
+                args.execution_id,
+                args.output_uri,
+            )
@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import pytest
+
+from ml_pipelines.inference.calibration import (
+    DEFAULT_TRANSFORM_SETTINGS,
+    MAX_PAYLOAD_MB,
+    MB,
+    candidate_settings,
+    pick_best,
+    recommend_settings,
+)
+
+
+def settings(payload, concurrency):
+    return {
+        "TransformStrategy": "MultiRecord",
+        "TransformMaxPayloadInMB": payload,
+        "TransformMaxConcurrentTransforms": concurrency,
+    }
+
+
+def test_recommend_settings_sizes_the_payload_for_the_records_per_request():
+    assert recommend_settings(1000, vcpus=4, records_per_request=5000) == settings(5, 4)
+
+
+def test_recommend_settings_sends_one_request_per_vcpu():
+    assert recommend_settings(100, vcpus=8) == settings(1, 8)
+    assert recommend_settings(100, vcpus=None) == settings(1, 1)
+
+
+def test_recommend_settings_stays_within_the_payload_limits():
+    assert recommend_settings(MB, vcpus=4, records_per_request=1000) == settings(MAX_PAYLOAD_MB, 1)
+    # 30 MB requests, only 3 of which fit in the 100 MB in flight per instance
+    assert recommend_settings(30 * MB, vcpus=16, records_per_request=1) == settings(30, 3)
+
+
+def test_candidate_settings_start_with_the_recommended_ones():
+    candidates = candidate_settings(settings(2, 4))
+
+    assert candidates == [settings(2, 4), settings(2, 8), settings(8, 4), settings(1, 4)]
+
+
+def test_candidate_settings_are_capped_and_deduplicated():
+    candidates = candidate_settings(settings(50, 2))
+
+    assert candidates == [settings(50, 2), settings(100, 1), settings(1, 2)]
+    for candidate in candidates:
+        assert candidate["TransformMaxPayloadInMB"] * candidate["TransformMaxConcurrentTransforms"] <= MAX_PAYLOAD_MB
+
+
+def test_pick_best_picks_the_most_records_per_second_of_the_completed_jobs():
+    results = [
+        dict(settings(1, 4), seconds=None, records_per_second=None),
+        dict(settings(2, 4), seconds=100, records_per_second=50),
+        dict(settings(8, 4), seconds=80, records_per_second=62.5),
+    ]
+
+    best = pick_best(results)
+
+    assert best == settings(8, 4)
+    assert set(best) == set(DEFAULT_TRANSFORM_SETTINGS)
+
+
+def test_pick_best_fails_when_no_job_completed():
+    with pytest.raises(ValueError):
+        pick_best([dict(settings(1, 4), seconds=None, records_per_second=None)])
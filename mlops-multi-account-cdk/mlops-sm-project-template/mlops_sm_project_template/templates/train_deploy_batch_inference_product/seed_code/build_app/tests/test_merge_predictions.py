@@ -0,0 +1,124 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import importlib.util
+import json
+import os
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "merge_predictions",
+    os.path.join(os.path.dirname(__file__), "..", "source_scripts", "postprocessing", "merge_predictions", "main.py"),
+)
+main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(main)
+
+SOURCES = ["s3://input/abalone/day=1.csv", "s3://input/abalone/day=2.csv"]
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    for folder in ["predictions", "keys"]:
+        (tmp_path / folder).mkdir()
+    return tmp_path
+
+
+def write_part(dirs, name, keys, predictions):
+    keys.to_csv(dirs / "keys" / name, index=False)
+    (dirs / "predictions" / f"{name}{main.PREDICTIONS_SUFFIX}").write_text(
+        "".join(f"{prediction}\n" for prediction in predictions)
+    )
+
+
+def make_keys(rows_per_source, start=0):
+    return pd.DataFrame(
+        {
+            "source": [source for source in SOURCES for _ in range(rows_per_source)],
+            "row": [start + row for _ in SOURCES for row in range(rows_per_source)],
+        }
+    )
+
+
+def merge(dirs, chunk_size=7):
+    return main.merge_predictions(
+        dirs / "predictions", dirs / "keys", dirs / "output", dirs / "summary" / "summary.json", chunk_size
+    )
+
+
+def test_aligned_predictions_are_joined_with_their_keys(dirs):
+    keys = [make_keys(10), make_keys(15, start=10)]
+    predictions = [np.arange(20, dtype=np.float64), np.arange(20, 50, dtype=np.float64)]
+    for i in range(2):
+        write_part(dirs, f"data-{i}.csv", keys[i], predictions[i])
+
+    report = merge(dirs)
+
+    merged = ds.dataset(dirs / "output", format="parquet", partitioning="hive").to_table().to_pandas()
+    expected = pd.concat(keys, ignore_index=True).assign(prediction=np.concatenate(predictions))
+    merged["source"] = merged["source"].astype(str).map(urllib.parse.unquote)
+    pd.testing.assert_frame_equal(
+        merged.sort_values(["source", "row"]).reset_index(drop=True),
+        expected.sort_values(["source", "row"]).reset_index(drop=True)[["row", "prediction", "source"]],
+        check_dtype=False,
+    )
+    assert report["predictions"]["count"] == 50
+    assert report["predictions"]["mean"] == pytest.approx(24.5)
+    assert report["sources"][SOURCES[0]]["count"] == 25
+    assert json.loads((dirs / "summary" / "summary.json").read_text()) == report
+
+
+def test_output_is_partitioned_by_source_with_one_file_per_part(dirs):
+    for i in range(3):
+        write_part(dirs, f"data-{i}.csv", make_keys(4), np.ones(8))
+
+    merge(dirs)
+
+    partitions = sorted(path.name for path in (dirs / "output").iterdir())
+    assert partitions == sorted(f"source={urllib.parse.quote(source, safe='')}" for source in SOURCES)
+    for partition in partitions:
+        assert sorted(os.listdir(dirs / "output" / partition)) == [f"data-{i}.parquet" for i in range(3)]
+    assert not (dirs / "output" / "summary.json").exists()
+
+
+@pytest.mark.parametrize("keys_rows,prediction_rows", [(10, 21), (10, 19), (10, 14)])
+def test_row_count_mismatch_fails(dirs, keys_rows, prediction_rows):
+    write_part(dirs, "data-0.csv", make_keys(keys_rows), np.zeros(prediction_rows))
+
+    with pytest.raises(ValueError, match="more"):
+        merge(dirs)
+
+
+def test_keys_without_predictions_fail(dirs):
+    write_part(dirs, "data-0.csv", make_keys(5), np.zeros(10))
+    make_keys(5).to_csv(dirs / "keys" / "data-1.csv", index=False)
+
+    with pytest.raises(ValueError, match="data-1.csv"):
+        merge(dirs)
+
+
+def test_predictions_without_keys_are_numbered_by_input_file(dirs):
+    (dirs / "predictions" / f"data-0.csv{main.PREDICTIONS_SUFFIX}").write_text("1.0\n2.0\n3.0\n")
+
+    merge(dirs, chunk_size=2)
+
+    merged = pd.read_parquet(dirs / "output" / "source=data-0.csv" / "data-0.parquet")
+    assert merged["row"].tolist() == [0, 1, 2]
+    assert merged["prediction"].tolist() == [1.0, 2.0, 3.0]
@@ -0,0 +1,252 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import importlib.util
+import io
+import json
+import os
+import pickle
+import tarfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "prepare_abalone_data",
+    os.path.join(os.path.dirname(__file__), "..", "source_scripts", "preprocessing", "prepare_abalone_data", "main.py"),
+)
+main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(main)
+
+MODEL_PACKAGE_ARN = "arn:aws:sagemaker:eu-west-1:123456789012:model-package/abalone/1"
+MANIFEST_URL = "s3://outputs/batch/inference-manifest.json"
+
+
+class FakeS3Client:
+    """In-memory S3 client with the calls made by the preprocessing script."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.puts = []
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.puts.append((Bucket, Key))
+        self.objects[(Bucket, Key)] = Body
+
+    def download_file(self, Bucket, Key, Filename):
+        with open(Filename, "wb") as f:
+            f.write(self.objects[(Bucket, Key)])
+
+    def get_paginator(self, name):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {
+                    "Contents": [
+                        {"Key": key, "Size": len(body), "ETag": f'"{hash(body)}"'}
+                        for (bucket, key), body in sorted(client.objects.items())
+                        if bucket == Bucket and key.startswith(Prefix)
+                    ]
+                }
+
+        return Paginator()
+
+
+def make_abalone_frame(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({c: rng.gamma(2.0, 0.5, n_rows) for c in main.numeric_features})
+    df.insert(0, "sex", rng.choice(["M", "F", "I"], n_rows))
+    df[main.label_column] = rng.integers(1, 30, n_rows).astype(np.float64)
+    return df
+
+
+def csv_bytes(df):
+    return df.to_csv(header=False, index=False).encode("utf-8")
+
+
+def model_tar_gz(preprocess=None):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        members = {"xgboost-model": b"model"}
+        if preprocess is not None:
+            members[main.PREPROCESSOR_PATH] = pickle.dumps(preprocess)
+        for name, body in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(body)
+            tar.addfile(info, io.BytesIO(body))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def base_dir(tmp_path):
+    for folder in ["data", "output_data", "keys"]:
+        (tmp_path / folder).mkdir()
+    return tmp_path
+
+
+def read_pending(base_dir):
+    with open(base_dir / "manifest" / "pending.json") as f:
+        return json.load(f)
+
+
+def test_select_new_partitions_skips_partitions_scored_with_the_same_etag_and_model_package():
+    partitions = [
+        {"uri": "s3://input/day=1.csv", "etag": '"a"'},
+        {"uri": "s3://input/day=2.csv", "etag": '"b"'},
+        {"uri": "s3://input/day=3.csv", "etag": '"c"'},
+        {"uri": "s3://input/day=4.csv", "etag": '"d"'},
+    ]
+    manifest = {
+        "partitions": {
+            "s3://input/day=1.csv": {"etag": '"a"', "model_package_arn": MODEL_PACKAGE_ARN},
+            "s3://input/day=2.csv": {"etag": '"changed"', "model_package_arn": MODEL_PACKAGE_ARN},
+            "s3://input/day=3.csv": {"etag": '"c"', "model_package_arn": f"{MODEL_PACKAGE_ARN[:-1]}0"},
+        }
+    }
+
+    selected = main.select_new_partitions(partitions, manifest, MODEL_PACKAGE_ARN)
+
+    assert [p["uri"] for p in selected] == ["s3://input/day=2.csv", "s3://input/day=3.csv", "s3://input/day=4.csv"]
+
+
+def test_preprocess_new_partitions_only_writes_the_new_partitions(base_dir):
+    s3_client = FakeS3Client(
+        {
+            ("input", "abalone/day=1.csv"): csv_bytes(make_abalone_frame(50, seed=1)),
+            ("input", "abalone/day=2.csv"): csv_bytes(make_abalone_frame(70, seed=2)),
+        }
+    )
+    scored = main.list_partitions(s3_client, "s3://input/abalone/")[0]
+    manifest = {"partitions": {scored["uri"]: {"etag": scored["etag"], "model_package_arn": MODEL_PACKAGE_ARN}}}
+    s3_client.objects[("outputs", "batch/inference-manifest.json")] = json.dumps(manifest).encode("utf-8")
+
+    main.preprocess_new_partitions(
+        s3_client, "s3://input/abalone/", MANIFEST_URL, MODEL_PACKAGE_ARN, str(base_dir), write_keys=True
+    )
+
+    pending = read_pending(base_dir)
+    assert pending["count"] == 1
+    assert [p["uri"] for p in pending["partitions"]] == ["s3://input/abalone/day=2.csv"]
+    keys = pd.read_csv(base_dir / "keys" / "data.csv")
+    assert len(pd.read_csv(base_dir / "output_data" / "data.csv", header=None)) == 70
+    assert set(keys["source"]) == {"s3://input/abalone/day=2.csv"}
+    assert list(os.listdir(base_dir / "data")) == []
+
+
+def test_preprocess_new_partitions_does_not_commit_the_manifest(base_dir):
+    s3_client = FakeS3Client({("input", "abalone/day=1.csv"): csv_bytes(make_abalone_frame(50))})
+
+    main.preprocess_new_partitions(s3_client, "s3://input/abalone/", MANIFEST_URL, MODEL_PACKAGE_ARN, str(base_dir))
+
+    assert s3_client.puts == []
+    assert main.load_manifest(s3_client, MANIFEST_URL) == {"partitions": {}}
+
+
+def test_empty_delta_writes_nothing(base_dir):
+    s3_client = FakeS3Client({("input", "abalone/day=1.csv"): csv_bytes(make_abalone_frame(50))})
+    main.preprocess_new_partitions(s3_client, "s3://input/abalone/", MANIFEST_URL, MODEL_PACKAGE_ARN, str(base_dir))
+    main.commit_manifest(s3_client, MANIFEST_URL, base_dir / "manifest" / "pending.json", "execution-1", "s3://o/1/")
+    for path in (base_dir / "output_data").iterdir():
+        path.unlink()
+
+    main.preprocess_new_partitions(s3_client, "s3://input/abalone/", MANIFEST_URL, MODEL_PACKAGE_ARN, str(base_dir))
+
+    pending = read_pending(base_dir)
+    assert pending["count"] == 0
+    assert pending["partitions"] == []
+    assert list((base_dir / "output_data").iterdir()) == []
+
+
+def test_commit_manifest_records_the_scored_partitions_and_keeps_the_others(base_dir):
+    manifest = {"partitions": {"s3://input/day=1.csv": {"etag": '"a"', "model_package_arn": MODEL_PACKAGE_ARN}}}
+    s3_client = FakeS3Client({("outputs", "batch/inference-manifest.json"): json.dumps(manifest).encode("utf-8")})
+    pending = {
+        "count": 1,
+        "model_package_arn": MODEL_PACKAGE_ARN,
+        "partitions": [{"uri": "s3://input/day=2.csv", "etag": '"b"'}],
+    }
+    (base_dir / "pending.json").write_text(json.dumps(pending))
+
+    main.commit_manifest(s3_client, MANIFEST_URL, base_dir / "pending.json", "execution-2", "s3://outputs/2/batch/")
+
+    committed = main.load_manifest(s3_client, MANIFEST_URL)["partitions"]
+    assert committed["s3://input/day=1.csv"] == manifest["partitions"]["s3://input/day=1.csv"]
+    assert committed["s3://input/day=2.csv"]["etag"] == '"b"'
+    assert committed["s3://input/day=2.csv"]["execution_id"] == "execution-2"
+    assert committed["s3://input/day=2.csv"]["output_uri"] == "s3://outputs/2/batch/"
+
+
+def test_new_partitions_are_transformed_with_the_preprocessor_fitted_at_training_time(base_dir):
+    training = make_abalone_frame(1000, seed=0)
+    preprocess = main.build_preprocessor().fit(training.drop(columns=[main.label_column]))
+    # a partition on another scale than the training data, which refitting would standardize
+    partition = make_abalone_frame(40, seed=3)
+    partition[main.numeric_features] *= 10
+    s3_client = FakeS3Client(
+        {
+            ("input", "abalone/day=1.csv"): csv_bytes(partition),
+            ("models", "abalone/model.tar.gz"): model_tar_gz(preprocess),
+        }
+    )
+
+    main.preprocess_new_partitions(
+        s3_client,
+        "s3://input/abalone/",
+        MANIFEST_URL,
+        MODEL_PACKAGE_ARN,
+        str(base_dir),
+        model_data_url="s3://models/abalone/model.tar.gz",
+    )
+
+    written = pd.read_csv(base_dir / "output_data" / "data.csv", header=None).to_numpy()
+    np.testing.assert_allclose(written, preprocess.transform(partition.drop(columns=[main.label_column])))
+
+
+def test_partitioned_writer_spreads_rows_over_the_parts_with_their_keys(tmp_path):
+    (tmp_path / "output_data").mkdir()
+    (tmp_path / "keys").mkdir()
+    writer = main.output_data_writer(
+        str(tmp_path / "output_data" / "data"), "csv", num_parts=3, keys_dir=str(tmp_path / "keys")
+    )
+    start = 0
+    for batch in [10, 7, 1, 0, 23]:
+        # the first column of every row holds its row number, to check it against its key
+        rows = np.column_stack((np.arange(start, start + batch), np.ones(batch)))
+        writer.write(rows, main.row_keys("s3://input/abalone.csv", start, batch))
+        start += batch
+    writer.close()
+
+    names = sorted(os.listdir(tmp_path / "output_data"))
+    assert names == [f"data-part-{i:05d}.csv" for i in range(3)]
+    assert sorted(os.listdir(tmp_path / "keys")) == names
+    parts = [pd.read_csv(tmp_path / "output_data" / name, header=None) for name in names]
+    keys = [pd.read_csv(tmp_path / "keys" / name) for name in names]
+    assert max(map(len, parts)) - min(map(len, parts)) <= 1
+    for part, part_keys in zip(parts, keys):
+        assert part_keys["row"].tolist() == part[0].astype(int).tolist()
+        assert set(part_keys["source"]) == {"s3://input/abalone.csv"}
+    assert sorted(pd.concat(keys)["row"]) == list(range(start))
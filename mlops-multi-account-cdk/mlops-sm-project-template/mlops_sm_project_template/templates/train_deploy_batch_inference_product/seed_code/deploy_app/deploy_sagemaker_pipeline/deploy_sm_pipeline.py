@@ -15,13 +15,11 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import json
-import subprocess
-
 from aws_cdk import (
     Aws,
     CfnParameter,
     CfnTag,
+    Stack,
     aws_iam as iam,
     aws_kms as kms,
     aws_sagemaker as sagemaker,
@@ -42,10 +40,7 @@ from config.constants import (
 
 from datetime import datetime, timezone
 
-subprocess.check_call(f"aws s3 cp {SM_PIPELINE_DEFINITION_S3LOCATION} inferencepipeline.json".split())
-
-with open("inferencepipeline.json") as f:
-    SM_PIPELINE_DEFINITION = json.dumps(json.load(f))
+from deploy_sagemaker_pipeline.pipeline_definition import PLACEHOLDER_ROLE, load_pipeline_definition, substitute_placeholder
 
 
 class DeploySMPipelineConstruct(Construct):
@@ -143,10 +138,15 @@ class DeploySMPipelineConstruct(Construct):
             ],
         )
 
-        # This is a workaround to string replace the placeholder role in the SM_PIPELINE_DEFINITION with the one created here
-        smpipeline_definition_string = SM_PIPELINE_DEFINITION.replace(
-            "REPLACEROLE/REPLACEROLE", smpipeline_execution_role.role_arn
+        # The definition is fetched once per synth, when the first construct is instantiated, and the
+        # placeholder role in it is replaced with the one created here
+        smpipeline_definition, _ = substitute_placeholder(
+            load_pipeline_definition(SM_PIPELINE_DEFINITION_S3LOCATION),
+            PLACEHOLDER_ROLE,
+            smpipeline_execution_role.role_arn,
         )
+        # to_json_string escapes the definition and resolves the role token within it
+        smpipeline_definition_string = Stack.of(self).to_json_string(smpipeline_definition)
 
         # https://docs.amazonaws.cn/en_us/AWSCloudFormation/latest/UserGuide/aws-resource-sagemaker-pipeline.html
         smpipeline_config = {"PipelineDefinitionBody": smpipeline_definition_string}
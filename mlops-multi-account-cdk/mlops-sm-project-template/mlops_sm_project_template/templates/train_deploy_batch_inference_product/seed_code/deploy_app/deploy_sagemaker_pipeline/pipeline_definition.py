@@ -0,0 +1,108 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Fetches the SageMaker pipeline definition published by the build repository.
+
+The definition is streamed from S3 into a local cache keyed on the ETag of the object, so that
+successive synths only download it again once the build repository published a new one, and is
+parsed once per process, when the first DeploySMPipelineConstruct is instantiated.
+"""
+import functools
+import json
+import logging
+import os
+import tempfile
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+# Placeholder of the pipeline execution role in the definition, see build_app/buildspec.yml.
+PLACEHOLDER_ROLE = "REPLACEROLE/REPLACEROLE"
+
+# Local cache of the pipeline definitions, by ETag.
+DEFAULT_CACHE_DIR = os.getenv(
+    "PIPELINE_DEFINITION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sm-pipeline-definitions")
+)
+
+# Size of the chunks the definition is streamed in.
+CHUNK_SIZE = 1024 * 1024
+
+
+def split_s3_uri(uri):
+    """Splits an S3 URI into its bucket and key."""
+    bucket, _, key = uri[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def fetch_pipeline_definition(s3_client, s3_location, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the local path of the pipeline definition, downloading it unless cached.
+
+    Args:
+        s3_client: boto3 S3 client
+        s3_location: S3 URI of the pipeline definition
+        cache_dir: local directory of the cached definitions
+
+    Returns:
+        the path of the definition in the cache directory
+    """
+    bucket, key = split_s3_uri(s3_location)
+    etag = s3_client.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+    path = os.path.join(cache_dir, f"{etag}.json")
+    if os.path.exists(path):
+        logger.info("Using the cached pipeline definition of %s (ETag %s).", s3_location, etag)
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # IfMatch fails rather than caching another version under this ETag if the object changed since
+    body = s3_client.get_object(Bucket=bucket, Key=key, IfMatch=etag)["Body"]
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".part", delete=False) as f:
+        for chunk in body.iter_chunks(CHUNK_SIZE):
+            f.write(chunk)
+    # atomic, so that a concurrent or interrupted synth never reads a partial definition
+    os.replace(f.name, path)
+    logger.info("Downloaded the pipeline definition of %s (ETag %s).", s3_location, etag)
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def load_pipeline_definition(s3_location, cache_dir=DEFAULT_CACHE_DIR):
+    """Fetches and parses the pipeline definition, once per process and location."""
+    with open(fetch_pipeline_definition(boto3.client("s3"), s3_location, cache_dir)) as f:
+        return json.load(f)
+
+
+def substitute_placeholder(definition, placeholder, value):
+    """Returns a copy of a parsed JSON document with the string values equal to placeholder replaced.
+
+    Args:
+        definition: the parsed JSON document
+        placeholder: string value to replace
+        value: value to replace it with, can be a CDK token
+
+    Returns:
+        a tuple of the new document and the number of values replaced
+    """
+    if isinstance(definition, dict):
+        items = [(k, substitute_placeholder(v, placeholder, value)) for k, v in definition.items()]
+        return {k: v for k, (v, _) in items}, sum(count for _, (_, count) in items)
+    if isinstance(definition, list):
+        items = [substitute_placeholder(v, placeholder, value) for v in definition]
+        return [v for v, _ in items], sum(count for _, count in items)
+    if definition == placeholder:
+        return value, 1
+    return definition, 0
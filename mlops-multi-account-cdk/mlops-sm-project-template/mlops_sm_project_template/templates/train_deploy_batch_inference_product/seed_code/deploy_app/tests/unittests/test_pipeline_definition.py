@@ -0,0 +1,78 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import io
+import json
+
+from deploy_sagemaker_pipeline.pipeline_definition import (
+    PLACEHOLDER_ROLE,
+    fetch_pipeline_definition,
+    substitute_placeholder,
+)
+
+
+class FakeBody(io.BytesIO):
+    def iter_chunks(self, chunk_size):
+        return iter(lambda: self.read(chunk_size), b"")
+
+
+class FakeS3Client:
+    """Serves one object, and counts its downloads."""
+
+    def __init__(self, body, etag):
+        self.body = body
+        self.etag = etag
+        self.downloads = 0
+
+    def head_object(self, Bucket, Key):
+        return {"ETag": f'"{self.etag}"'}
+
+    def get_object(self, Bucket, Key, IfMatch):
+        assert IfMatch == self.etag
+        self.downloads += 1
+        return {"Body": FakeBody(self.body)}
+
+
+def test_downloads_the_definition_again_only_when_its_etag_changes(tmp_path):
+    s3_client = FakeS3Client(b'{"Version": "2020-12-01"}', "etag-1")
+
+    path = fetch_pipeline_definition(s3_client, "s3://bucket/definition.json", str(tmp_path))
+    fetch_pipeline_definition(s3_client, "s3://bucket/definition.json", str(tmp_path))
+    s3_client.etag = "etag-2"
+    fetch_pipeline_definition(s3_client, "s3://bucket/definition.json", str(tmp_path))
+
+    assert s3_client.downloads == 2
+    with open(path) as f:
+        assert json.load(f) == {"Version": "2020-12-01"}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["etag-1.json", "etag-2.json"]
+
+
+def test_replaces_the_placeholder_role_values_only():
+    definition = {
+        "Steps": [
+            {"Arguments": {"RoleArn": PLACEHOLDER_ROLE, "Env": {"NOTE": f"{PLACEHOLDER_ROLE} is replaced"}}},
+            {"Arguments": {"ExecutionRoleArn": PLACEHOLDER_ROLE, "Retries": [1, 2]}},
+        ]
+    }
+
+    replaced, count = substitute_placeholder(definition, PLACEHOLDER_ROLE, "arn:aws:iam::1:role/r")
+
+    assert count == 2
+    assert replaced["Steps"][0]["Arguments"]["RoleArn"] == "arn:aws:iam::1:role/r"
+    assert replaced["Steps"][0]["Arguments"]["Env"]["NOTE"] == f"{PLACEHOLDER_ROLE} is replaced"
+    assert replaced["Steps"][1]["Arguments"] == {"ExecutionRoleArn": "arn:aws:iam::1:role/r", "Retries": [1, 2]}
+    assert definition["Steps"][0]["Arguments"]["RoleArn"] == PLACEHOLDER_ROLE
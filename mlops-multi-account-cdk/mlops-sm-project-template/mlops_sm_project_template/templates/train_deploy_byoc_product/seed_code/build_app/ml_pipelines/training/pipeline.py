@@ -27,7 +27,6 @@ Implements a get_pipeline(**kwargs) method.
 """
 import os
 
-import boto3
 import logging
 import sagemaker
 import sagemaker.session
@@ -65,6 +64,7 @@ from sagemaker.workflow.step_collections import RegisterModel
 
 from botocore.exceptions import ClientError
 from sagemaker.network import NetworkConfig
+from ml_pipelines.sessions import get_boto_session, get_client
 
 
 # BASE_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -83,10 +83,10 @@ def get_session(region, default_bucket):
         `sagemaker.session.Session instance
     """
 
-    boto_session = boto3.Session(region_name=region)
+    boto_session = get_boto_session(region)
 
-    sagemaker_client = boto_session.client("sagemaker")
-    runtime_client = boto_session.client("sagemaker-runtime")
+    sagemaker_client = get_client("sagemaker", region)
+    runtime_client = get_client("sagemaker-runtime", region)
     session = sagemaker.session.Session(
         boto_session=boto_session,
         sagemaker_client=sagemaker_client,
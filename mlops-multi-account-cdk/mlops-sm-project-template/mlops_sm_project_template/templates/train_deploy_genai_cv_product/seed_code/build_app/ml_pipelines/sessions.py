@@ -0,0 +1,100 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Shared boto3 sessions and clients for the pipeline modules.
+
+Clients are created once per service and region and reused by every call, with a larger
+connection pool and the adaptive retry mode, which rate limits a client when it is
+throttled.
+"""
+
+from __future__ import absolute_import
+
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+_lock = threading.RLock()
+_sessions = {}
+_clients = {}
+_settings = {}
+
+
+def configure(max_pool_connections=None, retry_mode=None, max_attempts=None):
+    """Sets the configuration of the clients to create, and drops the cached clients.
+
+    Args:
+        max_pool_connections: maximum number of connections in each client's pool,
+            ML_PIPELINES_MAX_POOL_CONNECTIONS or 50 by default
+        retry_mode: botocore retry mode, AWS_RETRY_MODE or "adaptive" by default
+        max_attempts: maximum number of attempts of a call, AWS_MAX_ATTEMPTS or 10
+            by default
+    """
+    with _lock:
+        _settings.update(
+            max_pool_connections=max_pool_connections,
+            retry_mode=retry_mode,
+            max_attempts=max_attempts,
+        )
+        _clients.clear()
+
+
+def get_client_config():
+    """Gets the botocore configuration of the shared clients."""
+    max_pool_connections = _settings.get("max_pool_connections") or int(
+        os.environ.get("ML_PIPELINES_MAX_POOL_CONNECTIONS", 50)
+    )
+    retry_mode = _settings.get("retry_mode") or os.environ.get("AWS_RETRY_MODE", "adaptive")
+    max_attempts = _settings.get("max_attempts") or int(os.environ.get("AWS_MAX_ATTEMPTS", 10))
+    return Config(
+        max_pool_connections=max_pool_connections,
+        retries={"mode": retry_mode, "total_max_attempts": max_attempts},
+    )
+
+
+def get_boto_session(region=None):
+    """Gets the shared boto3 session of a region.
+
+    Args:
+        region: the aws region of the session, the default region if not set
+
+    Returns:
+        boto3.Session instance
+    """
+    with _lock:
+        if region not in _sessions:
+            _sessions[region] = boto3.Session(region_name=region)
+        return _sessions[region]
+
+
+def get_client(service_name, region=None):
+    """Gets the shared boto3 client of a service in a region.
+
+    Args:
+        service_name: name of the AWS service, e.g. "sagemaker"
+        region: the aws region of the client, the default region if not set
+
+    Returns:
+        boto3 client
+    """
+    with _lock:
+        key = (service_name, region)
+        if key not in _clients:
+            _clients[key] = get_boto_session(region).client(service_name, config=get_client_config())
+        return _clients[key]
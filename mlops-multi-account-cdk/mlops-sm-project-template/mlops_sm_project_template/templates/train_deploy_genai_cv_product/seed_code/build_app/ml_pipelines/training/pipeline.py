@@ -12,7 +12,6 @@ import logging
 import os
 from typing import Dict, Any
 
-import boto3
 import sagemaker
 import sagemaker.session
 
@@ -36,6 +35,7 @@ from sagemaker.huggingface import HuggingFace
 from sagemaker.huggingface.model import HuggingFaceModel
 from sagemaker.utils import name_from_base
 from sagemaker import hyperparameters as _hyperparameters
+from ml_pipelines.sessions import get_boto_session, get_client
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -50,9 +50,7 @@ def get_sagemaker_client(region):
         Returns:
             `sagemaker.session.Session instance
         """
-    boto_session = boto3.Session(region_name=region)
-    sagemaker_client = boto_session.client("sagemaker")
-    return sagemaker_client
+    return get_client("sagemaker", region)
 
 
 def get_session(region, default_bucket):
@@ -66,10 +64,10 @@ def get_session(region, default_bucket):
         `sagemaker.session.Session instance
     """
 
-    boto_session = boto3.Session(region_name=region)
+    boto_session = get_boto_session(region)
 
-    sagemaker_client = boto_session.client("sagemaker")
-    runtime_client = boto_session.client("sagemaker-runtime")
+    sagemaker_client = get_client("sagemaker", region)
+    runtime_client = get_client("sagemaker-runtime", region)
     return sagemaker.session.Session(
         boto_session=boto_session,
         sagemaker_client=sagemaker_client,
@@ -89,8 +87,8 @@ def get_pipeline_session(region, default_bucket):
         PipelineSession instance
     """
 
-    boto_session = boto3.Session(region_name=region)
-    sagemaker_client = boto_session.client("sagemaker")
+    boto_session = get_boto_session(region)
+    sagemaker_client = get_client("sagemaker", region)
 
     return PipelineSession(
         boto_session=boto_session,
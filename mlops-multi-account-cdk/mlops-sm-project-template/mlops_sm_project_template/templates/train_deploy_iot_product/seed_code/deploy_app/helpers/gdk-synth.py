@@ -9,8 +9,11 @@ import s3fs
 import sagemaker
 from pathlib import Path
 
+from model_registry import ModelRegistryIndex, NoApprovedModelPackageError
+
 logger = logging.getLogger(__name__)
 sm_client = boto3.client("sagemaker")
+model_registry = ModelRegistryIndex(sm_client)
 gg_client = boto3.client('greengrassv2')
 sagemaker_session = sagemaker.Session(sagemaker_client=sm_client)
 fs = s3fs.S3FileSystem()
@@ -107,6 +110,19 @@ def create_deployment(project_name_id, components):
     return None
 
 
+def get_model_package_group(model, project_name_id):
+    """Gets the model package group of a SageMaker managed model component.
+
+    Args:
+        model: The model configuration of the component.
+        project_name_id: The project name and ID, replacing $PROJECT_NAME_ID$.
+
+    Returns:
+        The "model-package-group" of the model, the project model package group by default.
+    """
+    return model.get("model-package-group", "$PROJECT_NAME_ID$").replace("$PROJECT_NAME_ID$", project_name_id)
+
+
 def get_approved_package(model_package_group_name):
     """Gets the latest approved model package for a model package group.
 
@@ -117,39 +133,11 @@ def get_approved_package(model_package_group_name):
         The SageMaker Model Package ARN.
     """
     try:
-        # Get the latest approved model package
-        response = sm_client.list_model_packages(
-            ModelPackageGroupName=model_package_group_name,
-            ModelApprovalStatus="Approved",
-            SortBy="CreationTime",
-            MaxResults=100,
-        )
-        approved_packages = response["ModelPackageSummaryList"]
-
-        # Fetch more packages if none returned with continuation token
-        while len(approved_packages) == 0 and "NextToken" in response:
-            logger.debug("Getting more packages for token: {}".format(response["NextToken"]))
-            response = sm_client.list_model_packages(
-                ModelPackageGroupName=model_package_group_name,
-                ModelApprovalStatus="Approved",
-                SortBy="CreationTime",
-                MaxResults=100,
-                NextToken=response["NextToken"],
-            )
-            approved_packages.extend(response["ModelPackageSummaryList"])
-
-        # Return error if no packages found
-        if len(approved_packages) == 0:
-            error_message = (
-                f"No approved ModelPackage found for ModelPackageGroup: {model_package_group_name}"
-            )
-            logger.error(error_message)
-            raise Exception(error_message)
-
-        # Return the pmodel package arn
-        model_package_arn = approved_packages[0]["ModelPackageArn"]
-        logger.info(f"Identified the latest approved model package: {model_package_arn}")
-        return model_package_arn
+        # Get the latest approved model package, listed once per model package group
+        return model_registry.latest_approved_package(model_package_group_name)["ModelPackageArn"]
+    except NoApprovedModelPackageError as e:
+        logger.error(str(e))
+        raise
     except ClientError as e:
         error_message = e.response["Error"]["Message"]
         logger.error(error_message)
@@ -276,6 +264,15 @@ if __name__ == "__main__":
         greengrass_config = yaml.safe_load(f)
 
     # 1. evaluate components version and download latest models from SageMaker if SageMaker managed model
+    # resolve the model package groups of every SageMaker managed model at once
+    model_package_groups = {
+        get_model_package_group(config["model"], args.project_name_id)
+        for config in greengrass_config["custom-components"].values()
+        if (config.get("model") or {}).get("sagemaker-managed")
+    }
+    if model_package_groups:
+        model_registry.latest_approved_packages(model_package_groups)
+
     for item, config in greengrass_config["custom-components"].items():
         # change component name to match project name
         component_name = config["component-name"]
@@ -296,8 +293,7 @@ if __name__ == "__main__":
 
         if sagemaker_managed:
             # 1. Versioning by use of latest approved package version
-            # TODO: change logic to allow for several model package groups
-            model_package_arn = get_approved_package(args.project_name_id)
+            model_package_arn = get_approved_package(get_model_package_group(model, args.project_name_id))
             model_version = model_package_arn.split('/')[-1]
             config["version"] = f"{model_version}.0.0"
             last_version = get_latest_version(component_name)
@@ -7,6 +7,7 @@ import sys
 import boto3
 from botocore.exceptions import ClientError
 
+from model_registry import ModelRegistryIndex, NoApprovedModelPackageError
 from utils import (
     download_file_from_s3,
     check_if_model_package_exists,
@@ -29,6 +30,7 @@ dev_s3_client = dev_acc_boto3_session.client("s3")
 target_s3_client = target_acc_boto3_session.client("s3")
 target_ecr_client = target_acc_boto3_session.client("ecr")
 ssm = target_acc_boto3_session.client("ssm")
+model_registry = ModelRegistryIndex(dev_sm_client)
 
 
 def get_approved_package(model_package_group_name):
@@ -37,34 +39,13 @@ def get_approved_package(model_package_group_name):
     Returns:The SageMaker Model Package ARN.
     """
     try:
-        approved_packages = []
-        # Find the latest approved model package.
-        # If there are several approved model packages, take the most recent one (by CreationTime)
-        for model_package in dev_sm_client.get_paginator(
-            "list_model_packages"
-        ).paginate(
-            ModelPackageGroupName=model_package_group_name,
-            ModelApprovalStatus="Approved",
-            SortBy="CreationTime",
-            SortOrder="Descending",
-        ):
-            approved_packages.extend(model_package["ModelPackageSummaryList"])
-
-        # Raise error if no packages found
-        if not approved_packages:
-            logger.error(
-                "No approved ModelPackage found for ModelPackageGroup: %s",
-                model_package_group_name,
-            )
-            raise Exception(
-                f"No approved ModelPackage found for {model_package_group_name}"
-            )
-
-        # Return the model package arn
-        package_arn = approved_packages[0]["ModelPackageArn"]
-        logger.info("Identified the latest approved model package: %s", package_arn)
-        package_version = approved_packages[0]["ModelPackageVersion"]
-        return package_arn, package_version
+        # Find the latest approved model package, listing the packages newest first
+        # and stopping at the first approved one
+        package = model_registry.latest_approved_package(model_package_group_name)
+        return package["ModelPackageArn"], package["ModelPackageVersion"]
+    except NoApprovedModelPackageError as error:
+        logger.error(str(error))
+        raise
     except ClientError as error:
         error_message = error.response["Error"]["Message"]
         logger.error(error_message)
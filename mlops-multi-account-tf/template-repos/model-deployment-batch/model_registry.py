@@ -0,0 +1,98 @@
+"""Resolves the latest approved model package of model package groups.
+
+The approved packages of a group are listed newest first, and the listing stops at the first page
+holding one, so a lookup is usually a single call whatever the number of package versions.
+
+A ModelRegistryIndex keeps the packages it resolved, so that the stacks or components of one
+deployment looking up the same group share one listing, and resolves many groups concurrently.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Page size of the model package listings, the maximum allowed.
+PAGE_SIZE = 100
+
+
+class NoApprovedModelPackageError(Exception):
+    """Raised when a model package group has no approved model package."""
+
+
+def find_latest_approved_package(sm_client, model_package_group_name):
+    """Lists the approved packages of a group newest first, and stops at the first one.
+
+    Args:
+        sm_client: boto3 SageMaker client
+        model_package_group_name: name of the model package group
+
+    Returns:
+        the ModelPackageSummary of the latest approved package, None if there is none
+    """
+    kwargs = dict(
+        ModelPackageGroupName=model_package_group_name,
+        ModelApprovalStatus="Approved",
+        SortBy="CreationTime",
+        SortOrder="Descending",
+        MaxResults=PAGE_SIZE,
+    )
+    while True:
+        response = sm_client.list_model_packages(**kwargs)
+        if response["ModelPackageSummaryList"]:
+            return response["ModelPackageSummaryList"][0]
+        if "NextToken" not in response:
+            return None
+        logger.debug("Getting more packages for token: %s", response["NextToken"])
+        kwargs["NextToken"] = response["NextToken"]
+
+
+class ModelRegistryIndex:
+    """Cached lookups of the latest approved model packages of model package groups.
+
+    Args:
+        sm_client: boto3 SageMaker client
+    """
+
+    def __init__(self, sm_client):
+        self.sm_client = sm_client
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def latest_approved_package(self, model_package_group_name):
+        """Returns the ModelPackageSummary of the latest approved package of a group.
+
+        The group is listed once per index, later lookups return the same package.
+
+        Raises:
+            NoApprovedModelPackageError: if the group has no approved package
+        """
+        with self._lock:
+            if model_package_group_name in self._latest:
+                return self._latest[model_package_group_name]
+        package = find_latest_approved_package(self.sm_client, model_package_group_name)
+        if package is None:
+            raise NoApprovedModelPackageError(
+                f"No approved ModelPackage found for ModelPackageGroup: {model_package_group_name}"
+            )
+        logger.info("Identified the latest approved model package: %s", package["ModelPackageArn"])
+        with self._lock:
+            return self._latest.setdefault(model_package_group_name, package)
+
+    def latest_approved_packages(self, model_package_group_names, max_workers=8):
+        """Resolves the latest approved packages of many groups concurrently.
+
+        Args:
+            model_package_group_names: names of the model package groups, duplicates are listed once
+            max_workers: maximum number of concurrent listings
+
+        Returns:
+            dict of the ModelPackageSummary of the latest approved package by group name
+
+        Raises:
+            NoApprovedModelPackageError: if a group has no approved package
+        """
+        names = list(dict.fromkeys(model_package_group_names))
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(names)))) as executor:
+            return dict(zip(names, executor.map(self.latest_approved_package, names)))
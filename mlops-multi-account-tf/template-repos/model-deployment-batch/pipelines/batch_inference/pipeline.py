@@ -7,7 +7,6 @@ Implements a get_pipeline(**kwargs) method.
 """
 import os
 
-import boto3
 import sagemaker
 import sagemaker.session
 
@@ -32,6 +31,7 @@ from sagemaker.workflow.steps import (
 
 from sagemaker.workflow.pipeline_context import PipelineSession
 from sagemaker.network import NetworkConfig
+from pipelines.sessions import get_boto_session, get_client
 
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -47,8 +47,7 @@ def get_sagemaker_client(region):
     Returns:
         `sagemaker.session.Session instance
     """
-    boto_session = boto3.Session(region_name=region)
-    return boto_session.client("sagemaker")
+    return get_client("sagemaker", region)
 
 
 def get_session(region, default_bucket):
@@ -62,10 +61,10 @@ def get_session(region, default_bucket):
         `sagemaker.session.Session instance
     """
 
-    boto_session = boto3.Session(region_name=region)
+    boto_session = get_boto_session(region)
 
-    sagemaker_client = boto_session.client("sagemaker")
-    runtime_client = boto_session.client("sagemaker-runtime")
+    sagemaker_client = get_client("sagemaker", region)
+    runtime_client = get_client("sagemaker-runtime", region)
     return sagemaker.session.Session(
         boto_session=boto_session,
         sagemaker_client=sagemaker_client,
@@ -85,8 +84,8 @@ def get_pipeline_session(region, default_bucket):
         PipelineSession instance
     """
 
-    boto_session = boto3.Session(region_name=region)
-    sagemaker_client = boto_session.client("sagemaker")
+    boto_session = get_boto_session(region)
+    sagemaker_client = get_client("sagemaker", region)
 
     return PipelineSession(
         boto_session=boto_session,
@@ -134,9 +133,9 @@ def get_pipeline(
         role = sagemaker.session.get_execution_role(sagemaker_session)
 
     pipeline_session = get_pipeline_session(region, default_bucket)
-    ecr = boto3.client("ecr")
+    ecr = get_client("ecr", region)
     # get VPC parameters from Parameter store
-    ssm = boto3.client("ssm")
+    ssm = get_client("ssm", region)
     security_group_ids = ssm.get_parameter(Name=f"sagemaker-domain-sg")["Parameter"][
         "Value"
     ].split(",")
@@ -208,7 +207,7 @@ def get_pipeline(
             ),
         ],
         code=os.path.join(BASE_DIR, "preprocess.py"),
-        arguments=["--input-data", input_data],
+        arguments=["--input-data", input_data, "--model-name", model_name],
     )
     step_process = ProcessingStep(
         name="PreprocessAbaloneData",
@@ -3,8 +3,10 @@ import argparse
 import logging
 import os
 import pathlib
+import tarfile
 
 import boto3
+import joblib
 import numpy as np
 import pandas as pd
 
@@ -43,6 +45,10 @@ feature_columns_dtype = {
 }
 label_column_dtype = {"rings": np.float64}
 
+# Location of the fitted transformer inside model.tar.gz, see the training
+# pipeline's preprocess.py.
+PREPROCESSOR_PATH = "preprocessor/preprocessor.joblib"
+
 
 def merge_two_dicts(x, y):
     """Merges two dicts, returning a new copy."""
@@ -51,10 +57,40 @@ def merge_two_dicts(x, y):
     return z
 
 
+def load_fitted_preprocessor(model_name, base_dir):
+    """Loads the preprocessor fitted at training time from the model artifact.
+
+    Args:
+        model_name: name of the SageMaker model used by the transform step
+        base_dir: local working directory
+
+    Returns:
+        the fitted ColumnTransformer, or None if the model artifact predates
+        packaging the preprocessor with the model
+    """
+    model = boto3.client("sagemaker").describe_model(ModelName=model_name)
+    container = model.get("PrimaryContainer") or model["Containers"][0]
+    model_data = container["ModelDataUrl"]
+    bucket = model_data.split("/")[2]
+    key = "/".join(model_data.split("/")[3:])
+
+    logger.info("Downloading model artifact from bucket: %s, key: %s", bucket, key)
+    fn = f"{base_dir}/model/model.tar.gz"
+    pathlib.Path(fn).parent.mkdir(parents=True, exist_ok=True)
+    boto3.resource("s3").Bucket(bucket).download_file(key, fn)
+    preprocess = None
+    with tarfile.open(fn) as tar:
+        if PREPROCESSOR_PATH in tar.getnames():
+            preprocess = joblib.load(tar.extractfile(PREPROCESSOR_PATH))
+    os.unlink(fn)
+    return preprocess
+
+
 if __name__ == "__main__":
     logger.debug("Starting preprocessing.")
     parser = argparse.ArgumentParser()
     parser.add_argument("--input-data", type=str, required=True)
+    parser.add_argument("--model-name", type=str, default=None)
     args = parser.parse_args()
 
     base_dir = "/opt/ml/processing"
@@ -77,34 +113,49 @@ if __name__ == "__main__":
     )
     os.unlink(fn)
 
-    logger.debug("Defining transformers.")
-    numeric_features = list(feature_columns_names)
-    numeric_features.remove("sex")
-    numeric_transformer = Pipeline(
-        steps=[
-            ("imputer", SimpleImputer(strategy="median")),
-            ("scaler", StandardScaler()),
-        ]
-    )
-
-    categorical_features = ["sex"]
-    categorical_transformer = Pipeline(
-        steps=[
-            ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
-            ("onehot", OneHotEncoder(handle_unknown="ignore")),
-        ]
-    )
-
-    preprocess = ColumnTransformer(
-        transformers=[
-            ("num", numeric_transformer, numeric_features),
-            ("cat", categorical_transformer, categorical_features),
-        ]
-    )
-
-    logger.info("Applying transforms.")
     df.drop("rings", axis=1, inplace=True)
-    X = preprocess.fit_transform(df)
+
+    preprocess = None
+    if args.model_name:
+        preprocess = load_fitted_preprocessor(args.model_name, base_dir)
+    if preprocess is not None:
+        logger.info("Applying preprocessor fitted at training time.")
+        X = preprocess.transform(df)
+    else:
+        logger.warning(
+            "No fitted preprocessor packaged with the model, "
+            "fitting transforms on the inference data."
+        )
+        logger.debug("Defining transformers.")
+        numeric_features = list(feature_columns_names)
+        numeric_features.remove("sex")
+        numeric_transformer = Pipeline(
+            steps=[
+                ("imputer", SimpleImputer(strategy="median")),
+                ("scaler", StandardScaler()),
+            ]
+        )
+
+        categorical_features = ["sex"]
+        categorical_transformer = Pipeline(
+            steps=[
+                (
+                    "imputer",
+                    SimpleImputer(strategy="constant", fill_value="missing"),
+                ),
+                ("onehot", OneHotEncoder(handle_unknown="ignore")),
+            ]
+        )
+
+        preprocess = ColumnTransformer(
+            transformers=[
+                ("num", numeric_transformer, numeric_features),
+                ("cat", categorical_transformer, categorical_features),
+            ]
+        )
+
+        logger.info("Applying transforms.")
+        X = preprocess.fit_transform(df)
 
     logger.info(
         "test datasets lenght %d.", len(
@@ -9,7 +9,6 @@
 Implements a get_pipeline(**kwargs) method.
 """
 import os
-import boto3
 import sagemaker
 import sagemaker.session
 
@@ -31,6 +30,7 @@ from sagemaker.workflow.condition_step import (
 )
 from sagemaker.workflow.functions import (
     JsonGet,
+    Join,
 )
 from sagemaker.workflow.parameters import (
     ParameterInteger,
@@ -46,6 +46,7 @@ from sagemaker.workflow.model_step import ModelStep
 from sagemaker.model import Model
 from sagemaker.workflow.pipeline_context import PipelineSession
 from sagemaker.network import NetworkConfig
+from pipelines.sessions import get_boto_session, get_client
 
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -61,8 +62,7 @@ def get_sagemaker_client(region):
     Returns:
         `sagemaker.session.Session instance
     """
-    boto_session = boto3.Session(region_name=region)
-    return boto_session.client("sagemaker")
+    return get_client("sagemaker", region)
 
 
 def get_session(region, default_bucket):
@@ -76,10 +76,10 @@ def get_session(region, default_bucket):
         `sagemaker.session.Session instance
     """
 
-    boto_session = boto3.Session(region_name=region)
+    boto_session = get_boto_session(region)
 
-    sagemaker_client = boto_session.client("sagemaker")
-    runtime_client = boto_session.client("sagemaker-runtime")
+    sagemaker_client = get_client("sagemaker", region)
+    runtime_client = get_client("sagemaker-runtime", region)
     return sagemaker.session.Session(
         boto_session=boto_session,
         sagemaker_client=sagemaker_client,
@@ -99,8 +99,8 @@ def get_pipeline_session(region, default_bucket):
         PipelineSession instance
     """
 
-    boto_session = boto3.Session(region_name=region)
-    sagemaker_client = boto_session.client("sagemaker")
+    boto_session = get_boto_session(region)
+    sagemaker_client = get_client("sagemaker", region)
 
     return PipelineSession(
         boto_session=boto_session,
@@ -133,6 +133,7 @@ def get_pipeline(
     processing_instance_type="ml.m5.xlarge",
     training_instance_type="ml.m5.xlarge",
     inference_instance_type="ml.m5.xlarge",
+    inplace_predict=False,
 ):
     """Gets a SageMaker ML Pipeline instance working with on abalone data.
 
@@ -140,6 +141,8 @@ def get_pipeline(
         region: AWS region to create and run the pipeline.
         role: IAM role to create and run steps and pipeline.
         default_bucket: the bucket to use for storing the artifacts
+        inplace_predict: evaluate with xgboost's multithreaded inplace_predict, which
+            needs an image with xgboost 1.1 or later
 
     Returns:
         an instance of a pipeline
@@ -150,9 +153,9 @@ def get_pipeline(
         role = sagemaker.session.get_execution_role(sagemaker_session)
 
     pipeline_session = get_pipeline_session(region, default_bucket)
-    ecr = boto3.client("ecr")
+    ecr = get_client("ecr", region)
     # get VPC parameters from Parameter store
-    ssm = boto3.client("ssm")
+    ssm = get_client("ssm", region)
     security_group_ids = ssm.get_parameter(Name="sagemaker-domain-sg")["Parameter"][
         "Value"
     ].split(",")
@@ -216,6 +219,9 @@ def get_pipeline(
                 output_name="validation", source="/opt/ml/processing/validation"
             ),
             ProcessingOutput(output_name="test", source="/opt/ml/processing/test"),
+            ProcessingOutput(
+                output_name="preprocessor", source="/opt/ml/processing/preprocessor"
+            ),
         ],
         code=os.path.join(BASE_DIR, "preprocess.py"),
         arguments=["--input-data", input_data],
@@ -311,13 +317,23 @@ def get_pipeline(
                 ].S3Output.S3Uri,
                 destination="/opt/ml/processing/test",
             ),
+            ProcessingInput(
+                source=step_process.properties.ProcessingOutputConfig.Outputs[
+                    "preprocessor"
+                ].S3Output.S3Uri,
+                destination="/opt/ml/processing/preprocessor",
+            ),
         ],
         outputs=[
             ProcessingOutput(
                 output_name="evaluation", source="/opt/ml/processing/evaluation"
             ),
+            ProcessingOutput(
+                output_name="model", source="/opt/ml/processing/packaged_model"
+            ),
         ],
         code=os.path.join(BASE_DIR, "evaluate.py"),
+        arguments=["--inplace-predict"] if inplace_predict else None,
     )
     evaluation_report = PropertyFile(
         name="AbaloneEvaluationReport",
@@ -360,9 +376,20 @@ def get_pipeline(
             py_version="py3",
             instance_type=inference_instance_type,
         )
+    # the evaluation step repacks the trained model together with the fitted
+    # preprocessor so batch inference can run a transform-only path
+    packaged_model_data = Join(
+        on="/",
+        values=[
+            step_eval.properties.ProcessingOutputConfig.Outputs[
+                "model"
+            ].S3Output.S3Uri,
+            "model.tar.gz",
+        ],
+    )
     model = Model(
         image_uri=inference_image_uri,
-        model_data=step_train.properties.ModelArtifacts.S3ModelArtifacts,
+        model_data=packaged_model_data,
         sagemaker_session=pipeline_session,
         role=role,
         vpc_config=vpc_config,
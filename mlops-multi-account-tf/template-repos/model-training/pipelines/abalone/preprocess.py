@@ -5,6 +5,7 @@ import os
 import pathlib
 
 import boto3
+import joblib
 import numpy as np
 import pandas as pd
 
@@ -43,6 +44,10 @@ feature_columns_dtype = {
 }
 label_column_dtype = {"rings": np.float64}
 
+# The fitted transformer is shipped inside model.tar.gz under this path so batch
+# inference can apply exactly the transformation the model was trained on.
+PREPROCESSOR_PATH = "preprocessor/preprocessor.joblib"
+
 
 def merge_two_dicts(x, y):
     """Merges two dicts, returning a new copy."""
@@ -107,6 +112,11 @@ if __name__ == "__main__":
     X_pre = preprocess.fit_transform(df)
     y_pre = y.to_numpy().reshape(len(y), 1)
 
+    logger.info("Saving fitted preprocessor to %s.", base_dir)
+    preprocessor_file = f"{base_dir}/{PREPROCESSOR_PATH}"
+    pathlib.Path(preprocessor_file).parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(preprocess, preprocessor_file)
+
     X = np.concatenate((y_pre, X_pre), axis=1)
 
     logger.info(
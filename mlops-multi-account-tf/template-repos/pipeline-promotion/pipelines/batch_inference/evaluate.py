@@ -1,6 +1,8 @@
 """Evaluation script for measuring mean squared error."""
+import argparse
 import json
 import logging
+import os
 import pathlib
 import pickle
 import tarfile
@@ -15,9 +17,55 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
+# Kept in sync with PREPROCESSOR_PATH in preprocess.py.
+PREPROCESSOR_PATH = "preprocessor/preprocessor.joblib"
+
+
+def package_model(model_path, preprocessor_dir, output_dir):
+    """Writes a model.tar.gz holding the trained model and its fitted preprocessor.
+
+    The preprocessor goes into a sub-directory so the XGBoost serving container,
+    which loads the first regular file at the root of the model directory, keeps
+    picking up the booster.
+
+    Args:
+        model_path: path of the model.tar.gz produced by the training job
+        preprocessor_dir: directory holding the fitted preprocessor.joblib
+        output_dir: directory to write the packaged model.tar.gz to
+
+    Returns:
+        path of the packaged model.tar.gz
+    """
+    pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+    packaged_path = f"{output_dir}/model.tar.gz"
+    with tarfile.open(model_path) as src, tarfile.open(
+        packaged_path, "w:gz"
+    ) as dst:
+        for member in src.getmembers():
+            dst.addfile(member, src.extractfile(member) if member.isfile() else None)
+        dst.add(
+            os.path.join(preprocessor_dir, os.path.basename(PREPROCESSOR_PATH)),
+            arcname=PREPROCESSOR_PATH,
+        )
+    return packaged_path
+
 
 if __name__ == "__main__":
     logger.debug("Starting evaluation.")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--inplace-predict",
+        action="store_true",
+        help="Predict with inplace_predict on a float32 array (xgboost >= 1.1).",
+    )
+    parser.add_argument(
+        "--nthread",
+        type=int,
+        default=0,
+        help="With --inplace-predict, number of threads. 0 uses every core.",
+    )
+    args = parser.parse_args()
+
     model_path = "/opt/ml/processing/model/model.tar.gz"
     with tarfile.open(model_path) as tar:
         tar.extractall(path=".")
@@ -31,11 +79,18 @@ if __name__ == "__main__":
 
     logger.debug("Reading test data.")
     y_test = df.iloc[:, 0].to_numpy()
-    df.drop(df.columns[0], axis=1, inplace=True)
-    X_test = xgboost.DMatrix(df.values)
+    if args.inplace_predict:
+        X_test = np.ascontiguousarray(df.iloc[:, 1:].to_numpy(dtype=np.float32))
+        model.set_param({"nthread": args.nthread or os.cpu_count()})
 
-    logger.info("Performing predictions against test data.")
-    predictions = model.predict(X_test)
+        logger.info("Performing in-place predictions against test data.")
+        predictions = model.inplace_predict(X_test)
+    else:
+        df.drop(df.columns[0], axis=1, inplace=True)
+        X_test = xgboost.DMatrix(df.values)
+
+        logger.info("Performing predictions against test data.")
+        predictions = model.predict(X_test)
 
     logger.debug("Calculating mean squared error.")
     mse = mean_squared_error(y_test, predictions)
@@ -53,3 +108,10 @@ if __name__ == "__main__":
     evaluation_path = f"{output_dir}/evaluation.json"
     with open(evaluation_path, "w") as f:
         f.write(json.dumps(report_dict))
+
+    preprocessor_dir = "/opt/ml/processing/preprocessor"
+    if os.path.isdir(preprocessor_dir):
+        logger.info("Packaging model with fitted preprocessor.")
+        package_model(
+            model_path, preprocessor_dir, "/opt/ml/processing/packaged_model"
+        )